@@ -0,0 +1,146 @@
+from math import ceil
+from multiprocessing import Process
+from time import sleep
+
+from metrics import Metrics
+from ratelimit import RateLimiter, PERIODS
+from workqueue import WorkQueue
+
+RETIRE = "RETIRE" # work item a worker exits on when it pops it
+
+BUSY_STAGES = ("fetch", "parse", "hyperlinks", "content", "seen_check") # time a worker spends on a page, besides waiting
+
+
+class Autoscaler:
+
+    """
+    Pool of worker processes that block on the work queue, resized at runtime. Every interval the pool is sized by
+    Little's law, to the concurrency that keeps requests at the rate the rate limits can sustain over the interval,
+    given the time a page took the workers over the last interval; it is not grown beyond the work queued, and shrinks
+    towards min_workers while there is none. Workers are retired by queueing RETIRE items behind the queued work, and
+    workers that exit for any other reason are replaced.
+
+    Args:
+        target (Callable): Worker function, which returns when it pops RETIRE.
+        args (tuple): Arguments of the worker function.
+        work_queue (WorkQueue): Queue the workers consume.
+        rate_limiter (RateLimiter): Rate limits of the requests of the workers.
+        metrics (Metrics): Latency histograms the workers record their stages in.
+        min_workers (int): Fewest worker processes.
+        max_workers (int): Most worker processes.
+        concurrency (int): Pages a worker process works on at once.
+        interval (float): Seconds between resizes.
+        on_exit (Callable): Called with the pid of every worker that exited, once it is reaped.
+    """
+
+    def __init__(self, target, args: tuple, work_queue: WorkQueue, rate_limiter: RateLimiter, metrics: Metrics, min_workers: int, max_workers: int, concurrency: int = 1, interval: float = 5, on_exit = None) -> None:
+
+        self.target = target
+        self.args = args
+        self.work_queue = work_queue
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.concurrency = concurrency
+        self.interval = interval
+        self.on_exit = on_exit
+
+        self.processes: list[Process] = []
+        self.retiring = 0 # RETIRE items queued that no worker has exited on yet
+        self.busy = None # busy seconds and pages fetched at the last resize
+
+    def size(self):
+        return len(self.processes) - self.retiring
+
+    def start(self, n: int):
+        for _ in range(n):
+            process = Process(target=self.target, args=self.args)
+            process.start()
+            self.processes.append(process)
+        self.metrics.increment("workers_started", n)
+
+    def retire(self, n: int):
+        self.work_queue.put_many([RETIRE] * n)
+        self.retiring += n
+
+    def reap(self):
+        """
+        Forgets the workers that exited, retired or not. Only a worker that returned, with exit code 0, popped a
+        RETIRE item; one that crashed leaves the RETIRE items queued for the workers that are left.
+        """
+        exited = [process for process in self.processes if not process.is_alive()]
+
+        for process in exited:
+            process.join()
+            if self.on_exit is not None:
+                self.on_exit(process.pid)
+
+        self.processes = [process for process in self.processes if process not in exited]
+        self.retiring = max(0, self.retiring - sum(1 for process in exited if process.exitcode == 0))
+
+        if exited:
+            self.metrics.increment("workers_stopped", len(exited))
+
+    def sustainable_rate(self):
+        """
+        Gets the request rate the rate limits allow over the next interval: the tokens left in every bucket spread
+        over the interval, plus its refill rate, in the tightest bucket.
+        """
+        available = self.rate_limiter.available()
+        return min(tokens / self.interval + limit / period for tokens, limit, period in zip(available, self.rate_limiter.limits, PERIODS))
+
+    def page_seconds(self):
+        """
+        Gets the mean time a worker spent on a page since the last call, None without fetches in between.
+        """
+        stages = self.metrics.snapshot()["stages"]
+
+        busy = (sum(stages[stage]["seconds"] for stage in BUSY_STAGES), stages["fetch"]["count"])
+        previous, self.busy = self.busy, busy
+
+        if previous is None or busy[1] <= previous[1]:
+            return None
+
+        return (busy[0] - previous[0]) / (busy[1] - previous[1])
+
+    def desired(self):
+        """
+        Gets the number of workers to resize to, moving at most a quarter of the pool at once.
+        """
+        current = self.size()
+        queued = len(self.work_queue) - self.retiring
+        seconds = self.page_seconds()
+
+        if queued <= 0:
+            desired = current - 1 # no work waiting, the workers that are left keep up with what arrives
+        elif seconds is None:
+            desired = current
+        else:
+            desired = ceil(self.sustainable_rate() * seconds / self.concurrency)
+            desired = min(desired, current + ceil(queued / self.concurrency)) # not more than there is work for
+
+        step = max(1, current // 4)
+
+        return min(self.max_workers, max(self.min_workers, current - step, min(current + step, desired)))
+
+    def resize(self):
+        self.reap()
+
+        desired = self.desired()
+        current = self.size()
+
+        if desired > current:
+            self.start(desired - current)
+        elif desired < current:
+            self.retire(current - desired)
+
+    def run(self, workers: int):
+        """
+        Starts workers processes and resizes the pool every interval, forever.
+        """
+        self.start(min(self.max_workers, max(self.min_workers, workers)))
+
+        while True:
+            sleep(self.interval)
+            self.resize()
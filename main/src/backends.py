@@ -0,0 +1,161 @@
+from itertools import count
+
+from sqlalchemy import column, event, insert, select, table as table_clause, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL", # readers no longer block the writer and vice versa
+    "synchronous": "NORMAL", # durable at checkpoints, safe with WAL
+    "cache_size": "-65536", # 64 MiB page cache per connection
+    "temp_store": "MEMORY",
+    "busy_timeout": "10000",
+}
+
+COPY_MIN_ROWS = 100 # below this, an executemany is cheaper than a temporary table
+
+
+def set_sqlite_pragmas(connection, connection_record):
+    cursor = connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute("PRAGMA %s=%s" % (name, value))
+    cursor.close()
+
+
+class SQLiteBackend:
+
+    """
+    Storage backend of a local SQLite file, in WAL mode. Every process opens connections as it needs them, and the
+    single writer of the crawl is the only one writing, so claims need no row locks.
+    """
+
+    name = "sqlite"
+    dialect = sqlite
+
+    def engine_options(self, pool_size: int, max_overflow: int):
+        return {"max_overflow": -1} # connections to a file are cheap, never wait for one
+
+    def configure(self, engine):
+        event.listen(engine, "connect", set_sqlite_pragmas)
+
+    def snapshot(self, connection):
+        """
+        Starts a transaction every read of which sees the same snapshot. pysqlite only begins transactions before
+        writes, so it is begun explicitly; in WAL mode the snapshot is taken at the first read.
+        """
+        connection.exec_driver_sql("BEGIN")
+
+    def insert_ignore(self, table):
+        """
+        Gets an insert of a table that skips the rows whose unique key is taken.
+        """
+        return insert(table).prefix_with("OR IGNORE")
+
+    def upsert(self, table, key: str, columns: tuple):
+        """
+        Gets an insert of a table that updates the given columns of the row whose key is taken.
+        """
+        statement = self.dialect.insert(table)
+        return statement.on_conflict_do_update(index_elements=[key], set_={name: statement.excluded[name] for name in columns if name != key})
+
+    def insert_rows(self, connection, table, columns: tuple, rows: list[dict], conflict: str = None, key: str = None):
+        """
+        Inserts rows of the same columns into a table, in the current transaction.
+
+        Args:
+            connection (Connection): The connection of the transaction.
+            table (Table): The table.
+            columns (tuple): The columns of every row.
+            rows (list[dict]): The rows.
+            conflict (str): None to fail on a taken unique key, ignore to skip the row, or update to update the row
+                whose key is taken, the last row of the key winning.
+            key (str): The unique key the rows are updated by.
+        """
+        if conflict == "ignore":
+            statement = self.insert_ignore(table)
+        elif conflict == "update":
+            statement = self.upsert(table, key, columns)
+        else:
+            statement = insert(table)
+
+        connection.execute(statement, rows)
+
+
+class PostgresBackend(SQLiteBackend):
+
+    """
+    Storage backend of a PostgreSQL server, for crawls with more fetchers than a single SQLite writer keeps up with.
+    Every process keeps a pool of pool_size connections, growing by up to max_overflow under load, so the server
+    needs max_connections of at least that many per process. Rows are bulk loaded with COPY into a temporary table
+    and moved from there with a single INSERT ... SELECT, which takes the same ON CONFLICT clause as a plain insert.
+    COPY needs the psycopg (3) driver, postgresql+psycopg:// URLs; other drivers fall back to executemany.
+    """
+
+    name = "postgresql"
+    dialect = postgresql
+
+    def __init__(self) -> None:
+        self.temporary = count()
+
+    def engine_options(self, pool_size: int, max_overflow: int):
+        return {"pool_size": pool_size, "max_overflow": max_overflow, "pool_pre_ping": True, "pool_recycle": 3600}
+
+    def configure(self, engine):
+        pass
+
+    def snapshot(self, connection):
+        connection.exec_driver_sql("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ") # first statement of the transaction
+
+    def insert_ignore(self, table):
+        return self.dialect.insert(table).on_conflict_do_nothing()
+
+    def insert_rows(self, connection, table, columns: tuple, rows: list[dict], conflict: str = None, key: str = None):
+
+        driver_connection = connection.connection.driver_connection
+
+        if len(rows) < COPY_MIN_ROWS or not hasattr(getattr(driver_connection, "cursor_factory", None), "copy"):
+            return super().insert_rows(connection, table, columns, rows, conflict, key)
+
+        if conflict == "update": # one row per key, as ON CONFLICT DO UPDATE cannot update a row twice in a statement
+            rows = list({row[key]: row for row in rows}.values())
+
+        name = "copy_%d" % next(self.temporary)
+        quoted = ", ".join('"%s"' % i for i in columns)
+
+        connection.execute(text('CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM "%s" WITH NO DATA' % (name, quoted, table.name)))
+
+        with driver_connection.cursor() as cursor:
+            with cursor.copy("COPY %s (%s) FROM STDIN" % (name, quoted)) as copy:
+                for row in rows:
+                    copy.write_row([row[i] for i in columns])
+
+        loaded = table_clause(name, *[column(i) for i in columns])
+
+        statement = self.dialect.insert(table).from_select(list(columns), select(*[loaded.c[i] for i in columns]))
+
+        if conflict == "ignore":
+            statement = statement.on_conflict_do_nothing()
+        elif conflict == "update":
+            statement = statement.on_conflict_do_update(index_elements=[key], set_={i: statement.excluded[i] for i in columns if i != key})
+
+        connection.execute(statement)
+
+
+BACKENDS = {backend.name: backend for backend in (SQLiteBackend(), PostgresBackend())}
+
+
+def get_backend(bind):
+    """
+    Gets the backend of a database, by the dialect of its engine or connection, or by the name of the dialect.
+
+    Raises:
+        ValueError: If the database is neither SQLite nor PostgreSQL.
+
+    Returns:
+        SQLiteBackend | PostgresBackend: The backend.
+    """
+    name = bind if isinstance(bind, str) else bind.dialect.name
+
+    if name not in BACKENDS:
+        raise ValueError("Unsupported database %s, DATABASE_URL must be a sqlite or postgresql URL." % name)
+
+    return BACKENDS[name]
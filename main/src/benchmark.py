@@ -0,0 +1,189 @@
+from argparse import ArgumentParser
+import json
+from os import environ, killpg, makedirs, path, setsid
+import shutil
+from signal import SIGKILL, SIGTERM
+import subprocess
+import sys
+from tempfile import mkdtemp
+from time import monotonic, perf_counter, sleep
+from urllib.request import urlopen
+
+from wikiserver import PageGenerator, WikiServer
+
+SOURCE = path.dirname(path.abspath(__file__))
+
+
+def best_of(function, corpus: list, repeat: int):
+    """
+    Times function over every item of corpus, repeat times.
+
+    Returns:
+        float: Seconds of the fastest run.
+    """
+    best = float("inf")
+
+    for _ in range(repeat):
+        start = perf_counter()
+        for item in corpus:
+            function(item)
+        best = min(best, perf_counter() - start)
+
+    return best
+
+
+def micro(num_pages: int = 200, repeat: int = 3, seed: int = 0):
+    """
+    Times the extraction functions over a fixed corpus of generated pages.
+
+    Returns:
+        dict[str, dict]: Seconds per page and pages per second of every function.
+    """
+    import utils # reads config.env, like the crawler
+
+    generator = PageGenerator(seed=seed)
+    corpus = [generator.page(i) for i in range(num_pages)]
+    pages_hyperlinks = [utils.get_hyperlinks_from_page(page) for page in corpus]
+
+    functions = {
+        "get_hyperlinks_from_page": (utils.get_hyperlinks_from_page, corpus),
+        "get_content_from_page": (utils.get_content_from_page, corpus),
+        "extract_page": (utils.extract_page, corpus),
+        "screen_hyperlinks": (lambda links: utils.screen_hyperlinks(utils.WIKI_SEED_URL, links), pages_hyperlinks),
+    }
+
+    results = {}
+
+    for name, (function, items) in functions.items():
+        seconds = best_of(function, items, repeat)
+        results[name] = {"seconds_per_page": seconds / len(items), "pages_per_second": len(items) / seconds}
+
+    return results
+
+
+def crawl(duration: float, num_pages: int, latency: float, error_rate: float, overrides: dict, sample_seconds: float = 5, seed: int = 0):
+    """
+    Crawls a local synthetic wiki for duration seconds with the crawler of this directory, in a scratch directory
+    with its own database, and samples its metrics and database size.
+
+    Args:
+        duration (float): Seconds to crawl for.
+        num_pages (int): Size of the synthetic wiki.
+        latency (float): Mean added latency of the synthetic wiki in seconds.
+        error_rate (float): Fraction of requests the synthetic wiki answers with a 503.
+        overrides (dict[str, str]): Settings to run with, over those of config.env.
+        sample_seconds (float): Seconds between samples.
+        seed (int): Seed of the synthetic wiki.
+
+    Returns:
+        dict: Pages per second, the stage latencies and the samples.
+    """
+    server = WikiServer(PageGenerator(num_pages, seed=seed), 0, latency, error_rate).start()
+
+    directory = mkdtemp(prefix="crawl-benchmark-")
+    makedirs(path.join(directory, "data"))
+    shutil.copy(path.join(SOURCE, "config.env"), directory)
+
+    port = int(overrides.get("METRICS_PORT", "9109"))
+
+    # settings in the environment take precedence over config.env
+    env = dict(environ, WIKI_SEED_URL=server.url(), METRICS_SNAPSHOT="", JOURNAL_DIRECTORY="data/journal")
+    env.update(overrides, METRICS_PORT=str(port))
+    main = [sys.executable, path.join(SOURCE, "main.py")]
+
+    subprocess.run(main + ["seed"], cwd=directory, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    crawler = subprocess.Popen(main + ["crawl"], cwd=directory, env=env, stdout=subprocess.DEVNULL, preexec_fn=setsid)
+
+    samples = []
+    start = monotonic()
+
+    try:
+        while monotonic() - start < duration:
+
+            sleep(sample_seconds)
+
+            try:
+                snapshot = json.load(urlopen("http://127.0.0.1:%d/metrics.json" % port, timeout=5))
+            except OSError:
+                continue # not serving yet
+
+            samples.append({
+                "seconds": monotonic() - start,
+                "pages_scraped": snapshot["counters"]["pages_scraped"],
+                "database_bytes": database_bytes(directory),
+                "snapshot": snapshot,
+            })
+    finally:
+        killpg(crawler.pid, SIGTERM)
+        try:
+            crawler.wait(10)
+        except subprocess.TimeoutExpired:
+            killpg(crawler.pid, SIGKILL)
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if len(samples) < 2:
+        raise RuntimeError("The crawler did not serve its metrics, see its output.")
+
+    first, last = samples[0], samples[-1]
+    elapsed = last["seconds"] - first["seconds"]
+    pages = last["pages_scraped"] - first["pages_scraped"]
+
+    return {
+        "pages_per_second": pages / elapsed,
+        "database_bytes_per_page": (last["database_bytes"] - first["database_bytes"]) / pages if pages else None,
+        "stages": last["snapshot"]["stages"],
+        "counters": last["snapshot"]["counters"],
+        "requests": server.requests,
+        "samples": [{key: value for key, value in sample.items() if key != "snapshot"} for sample in samples],
+    }
+
+
+def database_bytes(directory: str):
+    """
+    Gets the size of the database of a crawl, with its write-ahead log.
+    """
+    files = [path.join(directory, "data", name) for name in ("database.db", "database.db-wal")]
+    return sum(path.getsize(file) for file in files if path.exists(file))
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Benchmark the crawler offline, against a local synthetic wiki.")
+    parser.add_argument("--output", help="also write the results as JSON to this file, to compare runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    micro_parser = subparsers.add_parser("micro", help="time the extraction functions over a fixed corpus")
+    micro_parser.add_argument("--pages", type=int, default=200)
+    micro_parser.add_argument("--repeat", type=int, default=3)
+
+    crawl_parser = subparsers.add_parser("crawl", help="crawl a local synthetic wiki end to end")
+    crawl_parser.add_argument("--duration", type=float, default=60)
+    crawl_parser.add_argument("--pages", type=int, default=100000, help="size of the synthetic wiki")
+    crawl_parser.add_argument("--latency", type=float, default=0.05, help="mean added latency in seconds")
+    crawl_parser.add_argument("--error-rate", type=float, default=0.01, help="fraction of requests answered with a 503")
+    crawl_parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="crawler setting, e.g. NUM_SCRAPER_PROCESSES=8")
+
+    args = parser.parse_args()
+
+    if args.command == "micro":
+
+        results = micro(args.pages, args.repeat)
+
+        for name, result in results.items():
+            print("%-26s %9.1f us/page %9.1f pages/s" % (name, result["seconds_per_page"] * 1e6, result["pages_per_second"]))
+
+    else:
+
+        results = crawl(args.duration, args.pages, args.latency, args.error_rate, dict(i.split("=", 1) for i in args.set))
+
+        print("%.2f pages/s, %s bytes of database per page, %d requests served." % (results["pages_per_second"], "%.0f" % results["database_bytes_per_page"] if results["database_bytes_per_page"] else "-", results["requests"]))
+
+        for stage, latency in results["stages"].items():
+            if latency["count"]:
+                print("%-12s %8d runs %10.2f ms mean %10.2f ms p50 %10.2f ms p99" % (stage, latency["count"], latency["mean"] * 1e3, latency["p50"] * 1e3, latency["p99"] * 1e3))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
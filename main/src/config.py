@@ -0,0 +1,69 @@
+from os import environ
+
+from dotenv import dotenv_values
+
+CONFIG_PATH = "config.env"
+
+CONFIG = None
+
+
+class Config:
+
+    """
+    Settings of the crawl, read from a dotenv file, with the environment taking precedence over it. Unlike
+    load_dotenv, reading the settings does not write them into the environment, so every process that imports the
+    crawler reads the same file the same way, and a setting is parsed where it is asked for.
+
+    Args:
+        path (str): The dotenv file, which may not exist.
+        overrides (dict): Settings taking precedence over the file, the environment by default.
+    """
+
+    def __init__(self, path: str = CONFIG_PATH, overrides: dict = None) -> None:
+
+        self.path = path
+        self.values = {name: value for name, value in dotenv_values(path).items() if value is not None}
+        self.values.update(environ if overrides is None else overrides)
+
+    def string(self, name: str, default: str = None):
+        value = self.values.get(name, default)
+        return value.strip() if value is not None else None
+
+    def choice(self, name: str, default: str = None):
+        """
+        Gets a setting that is one of a set of names, which are matched in lowercase.
+        """
+        value = self.string(name, default)
+        return value.lower() if value is not None else None
+
+    def integer(self, name: str, default: int = None):
+        value = self.string(name)
+        return int(value) if value is not None else default
+
+    def number(self, name: str, default: float = None):
+        value = self.string(name)
+        return float(value) if value is not None else default
+
+    def flag(self, name: str, default: bool = False):
+        value = self.choice(name)
+        return value == "true" if value is not None else default
+
+    def integers(self, name: str, default: list[int] = None):
+        value = self.string(name)
+        return [int(i) for i in value.split(",")] if value is not None else default
+
+
+def get_config():
+    """
+    Gets the settings of the current process, reading them on first use from the file named by CRAWLER_CONFIG, or
+    config.env.
+
+    Returns:
+        Config: The settings.
+    """
+    global CONFIG
+
+    if CONFIG is None:
+        CONFIG = Config(environ.get("CRAWLER_CONFIG", CONFIG_PATH))
+
+    return CONFIG
@@ -1,6 +1,12 @@
-from sqlalchemy import create_engine
+from os import getpid
+
+from sqlalchemy import create_engine, inspect, make_url, text
 from sqlalchemy.orm import sessionmaker
 from models import Models
+from backends import get_backend
+from config import get_config
+
+DATABASE_URL = "sqlite+pysqlite:///data/database.db"
 
 class Database:
 
@@ -14,13 +20,64 @@ class Database:
                                     self.checkedout())
     """
 
-    def __init__(self) -> None:
-        self.ENGINE = create_engine("sqlite+pysqlite:///data/database.db", max_overflow=-1) #pool_size=10
-        self.SESSION = sessionmaker(bind=self.ENGINE)
+    def __init__(self, url: str = None, pool_size: int = None, max_overflow: int = None) -> None:
+        config = get_config()
+        self.URL = url or config.string("DATABASE_URL", DATABASE_URL)
+        self.POOL_SIZE = pool_size if pool_size is not None else config.integer("DATABASE_POOL_SIZE", 5)
+        self.MAX_OVERFLOW = max_overflow if max_overflow is not None else config.integer("DATABASE_MAX_OVERFLOW", 10)
+        self.BACKEND = get_backend(make_url(self.URL).get_backend_name()) # sqlite or postgresql, by the URL
+        self.SESSION = sessionmaker()
         self.MODELS = Models()
+        self.engine = None # per process, created lazily after the fork
+        self.pid = None
+
+    @property
+    def ENGINE(self):
+        """
+        Gets the engine of the current process, creating it on first use. A process forked from one that used the
+        engine gets its own, and leaves the pooled connections of its parent alone.
+        """
+        if self.engine is None or self.pid != getpid():
+
+            if self.engine is not None:
+                self.engine.dispose(close=False)
+
+            self.engine = create_engine(self.URL, **self.BACKEND.engine_options(self.POOL_SIZE, self.MAX_OVERFLOW))
+            self.BACKEND.configure(self.engine)
+            self.SESSION.configure(bind=self.engine)
+            self.pid = getpid()
+
+        return self.engine
 
     def createSession(self):
-        return self.SESSION()
+        return self.SESSION(bind=self.ENGINE)
     
     def createTables(self):
-        self.MODELS.getBase().metadata.create_all(bind=self.ENGINE)
\ No newline at end of file
+        self.MODELS.getBase().metadata.create_all(bind=self.ENGINE)
+        self.upgradeTables()
+
+    def upgradeTables(self):
+        """
+        Brings tables created by an older version of the models up to date, adding missing columns and indexes and
+        dropping the indexes the models no longer declare.
+        """
+        inspector = inspect(self.ENGINE)
+
+        with self.ENGINE.begin() as connection:
+
+            for table in self.MODELS.getBase().metadata.sorted_tables:
+
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+                for column in table.columns:
+                    if column.name not in existing:
+                        connection.execute(text('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (table.name, column.name, column.type.compile(self.ENGINE.dialect))))
+
+                declared = {index.name for index in table.indexes}
+
+                for index in inspector.get_indexes(table.name):
+                    if index["name"].startswith("ix_") and index["name"] not in declared:
+                        connection.execute(text('DROP INDEX "%s"' % index["name"]))
+
+                for index in table.indexes:
+                    index.create(bind=connection, checkfirst=True)
\ No newline at end of file
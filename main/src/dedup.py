@@ -0,0 +1,144 @@
+from multiprocessing import Lock, RawArray, Value
+import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MARKUP = re.compile(r"</?(?:text|h2|h3)>")
+WORD = re.compile(r"\w+")
+
+SHINGLE = 3 # words per feature
+SEED = 0x9e3779b9 # of the second crc32, for the high half of a 64 bit feature hash
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("DUPLICATE_DETECTION = true requires the numpy package.")
+
+
+def simhash(content: str):
+    """
+    Gets the 64 bit SimHash fingerprint of the content of a page, over its distinct word 3-shingles: pages whose
+    shingles mostly agree get fingerprints that differ in few bits.
+
+    Returns:
+        int: The fingerprint, unsigned and never 0.
+    """
+    require_numpy()
+
+    words = WORD.findall(MARKUP.sub(" ", content).lower())
+
+    features = {" ".join(words[i:i+SHINGLE]).encode() for i in range(max(1, len(words) - SHINGLE + 1))}
+
+    hashes = np.fromiter((zlib.crc32(i) | zlib.crc32(i, SEED) << 32 for i in features), dtype=np.uint64, count=len(features))
+
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little") # one row of 64 bits per feature
+
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(features)
+
+    return int(np.packbits(majority, bitorder="little").view(np.uint64)[0]) or 1 # 0 marks empty slots of the index
+
+
+def to_signed(fingerprint: int):
+    """
+    Gets the fingerprint as the signed 64 bit integer SQLite stores.
+    """
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+class DuplicateIndex:
+
+    """
+    LSH index of the SimHash fingerprints of the pages scraped, kept in shared memory so that every worker process
+    checks new pages against all of them without a round trip to the database.
+
+    Fingerprints within distance bits of each other agree exactly in at least one of distance + 1 bands of the 64
+    bits, so every band has a table keyed by it, and a page is checked against the fingerprints sharing one of its
+    bands only. The tables are open addressing hash tables of fingerprints, sized for twice capacity; once capacity
+    fingerprints are in, pages are still checked but no longer added.
+
+    Args:
+        capacity (int): Number of fingerprints the index is sized for.
+        distance (int): Most bits a near-duplicate fingerprint differs in.
+    """
+
+    def __init__(self, capacity: int, distance: int = 3) -> None:
+
+        self.distance = distance
+        self.num_bands = distance + 1
+        self.band_bits = 64 // self.num_bands
+        self.num_slots = 2 * capacity
+        self.capacity = capacity
+
+        self.tables = [RawArray("Q", self.num_slots) for _ in range(self.num_bands)] # 0 is an empty slot
+        self.count = Value("q", 0, lock=False)
+        self.lock = Lock() # serialises writers, readers never block
+
+    def band(self, fingerprint: int, i: int):
+        return (fingerprint >> (i * self.band_bits)) & ((1 << self.band_bits) - 1)
+
+    def start(self, band: int, i: int):
+        """
+        Gets the slot the probe for a band value starts at, spreading the values of the band over the table.
+        """
+        return (band * 0x9e3779b97f4a7c15 + i) % (1 << 64) % self.num_slots
+
+    def find(self, fingerprint: int, exclude: int = None):
+        """
+        Gets a fingerprint in the index within distance bits of fingerprint, other than exclude.
+
+        Returns:
+            int: The near-duplicate fingerprint, None if there is none.
+        """
+        for i, table in enumerate(self.tables):
+
+            band = self.band(fingerprint, i)
+            slot = self.start(band, i)
+
+            for _ in range(self.num_slots):
+
+                stored = table[slot]
+
+                if stored == 0:
+                    break
+
+                if stored != exclude and self.band(stored, i) == band and bin(stored ^ fingerprint).count("1") <= self.distance:
+                    return stored
+
+                slot = (slot + 1) % self.num_slots
+
+        return None
+
+    def add(self, fingerprint: int, exclude: int = None):
+        """
+        Adds a fingerprint unless the index holds a near-duplicate of it. The check and the add are atomic across
+        processes, so of two workers adding near-duplicate pages only one finds none.
+
+        A refreshed page passes the fingerprint of its stored version as exclude, which it is not a duplicate of.
+        That fingerprint stays in the index, as entries are never removed.
+
+        Returns:
+            int: The near-duplicate fingerprint in the index, None if there was none and fingerprint was added.
+        """
+        with self.lock:
+
+            duplicate = self.find(fingerprint, exclude)
+
+            if duplicate is not None or fingerprint == exclude or self.count.value >= self.capacity:
+                return duplicate
+
+            for i, table in enumerate(self.tables):
+
+                slot = self.start(self.band(fingerprint, i), i)
+
+                while table[slot] != 0:
+                    slot = (slot + 1) % self.num_slots
+
+                table[slot] = fingerprint
+
+            self.count.value += 1
+
+        return None
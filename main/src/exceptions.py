@@ -5,11 +5,13 @@ class WebpageError(Exception):
     Args:
         error_code (int): Error code for the exception.
         message (str): Message to be displayed with the error.
+        retry_after (float): Seconds the server asked to wait before retrying, from its Retry-After header.
     """
 
-    def __init__(self, error_code: int, message: str =""):
+    def __init__(self, error_code: int, message: str ="", retry_after: float = None):
         super().__init__(message)
         self.error_code = error_code
+        self.retry_after = retry_after
 
     def __str__(self):
         return f"(Error Code: {self.error_code})"
@@ -26,6 +28,7 @@ class HyperlinksScrapeError(Exception):
 
     def __init__(self, message: str ="Error in scraping hyperlinks."):
         super().__init__(message)
+        self.message = message
 
     def __str__(self):
         return f"{self.message}"
@@ -41,6 +44,7 @@ class ContentScrapeError(Exception):
 
     def __init__(self, message: str ="Error in scraping content."):
         super().__init__(message)
+        self.message = message
 
     def __str__(self):
         return f"{self.message}"
\ No newline at end of file
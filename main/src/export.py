@@ -0,0 +1,276 @@
+from argparse import ArgumentParser
+from functools import partial
+import gzip
+import json
+from multiprocessing import Pool, cpu_count
+from os import makedirs, path, replace
+import re
+from threading import BoundedSemaphore
+from time import time
+
+from sqlalchemy import bindparam, text, select, func
+
+from database import Database
+from models import Models
+from storage import ContentStore
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ("parquet", "jsonl")
+EXTENSIONS = {"parquet": ".parquet", "jsonl": ".jsonl.gz"}
+MANIFEST = "manifest.json"
+
+SECTION = re.compile(r"<(h2|h3|text)>(.*?)</\1>", re.S)
+
+# column names are quoted, as PostgreSQL folds unquoted ones to lowercase; rows written before the WRITTEN column
+# existed are windowed by their TIMESTAMP
+PAGES = text(
+    'SELECT p."ID", p."HYPERLINK", p."URL_ID", p."TITLE", p."HEADING", p."CONTENT", p."TIMESTAMP", c."CODEC", c."DICTIONARY_ID", c."DATA", '
+    'COALESCE(c."SIZE", LENGTH(p."CONTENT"), 0) FROM "Pages" p LEFT JOIN "Contents" c ON c."HASH" = p."CONTENT_HASH" '
+    'WHERE (p."WRITTEN" > :since AND p."WRITTEN" <= :until) OR (p."WRITTEN" IS NULL AND p."TIMESTAMP" > :since AND p."TIMESTAMP" <= :until) '
+    'ORDER BY COALESCE(p."WRITTEN", p."TIMESTAMP"), p."ID"'
+)
+
+LINKS = text(
+    'SELECT e."SOURCE_ID", u."URL" FROM "Edges" e JOIN "Urls" u ON u."ID" = e."TARGET_ID" WHERE e."SOURCE_ID" IN :ids'
+).bindparams(bindparam("ids", expanding=True))
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("Exporting to Parquet requires the pyarrow package.")
+
+
+def schema(sections: bool, links: bool):
+    """
+    Gets the Parquet schema of the pages shards.
+    """
+    fields = [
+        ("id", pa.int64()), ("url", pa.string()), ("title", pa.string()), ("heading", pa.string()),
+        ("timestamp", pa.float64()), ("content", pa.string()),
+    ]
+
+    if sections:
+        fields.append(("sections", pa.list_(pa.struct([("level", pa.int8()), ("heading", pa.string()), ("text", pa.string())]))))
+
+    if links:
+        fields.append(("links", pa.list_(pa.string())))
+
+    return pa.schema(fields)
+
+
+def parse_sections(content: str):
+    """
+    Splits the <h2>, <h3> and <text> markup of a page into its sections: the text under every heading, in order, the
+    lead section being the one with level 1 and no heading.
+
+    Returns:
+        list[dict]: Level, heading and text of every section with text or a heading.
+    """
+    sections = [{"level": 1, "heading": None, "text": []}]
+
+    for tag, value in SECTION.findall(content or ""):
+        if tag == "text":
+            sections[-1]["text"].append(value)
+        else:
+            sections.append({"level": int(tag[1]), "heading": value, "text": []})
+
+    return [dict(section, text="\n".join(section["text"])) for section in sections if section["text"] or section["heading"]]
+
+
+def read_links(connection, rows: list[tuple]):
+    """
+    Gets the out-links of a batch of Pages rows.
+
+    Returns:
+        dict[int, list[str]]: URLs linked, by URL_ID of the linking page.
+    """
+    out_links: dict[int, list[str]] = {}
+
+    url_ids = [row[2] for row in rows if row[2] is not None]
+
+    for i in range(0, len(url_ids), 500):
+        for source, url in connection.execute(LINKS, {"ids": url_ids[i:i+500]}):
+            out_links.setdefault(source, []).append(url)
+
+    return out_links
+
+
+def write_shard(directory: str, export_format: str, sections: bool, links: bool, shard: tuple[str, list[tuple], dict[int, list[str]]]):
+    """
+    Process pool task: decompresses the content of a batch of Pages rows, adds their sections and out-links and
+    writes them as one shard.
+
+    Returns:
+        dict: Name, number of rows and size in bytes of the shard.
+    """
+    name, rows, out_links = shard
+
+    content_store = ContentStore(Database())
+
+    records = []
+
+    for page_id, hyperlink, url_id, title, heading, content, timestamp, codec, dictionary_id, data, _ in rows:
+
+        if content is None and data is not None:
+            content = content_store.decompress(Models.Content(CODEC=codec, DICTIONARY_ID=dictionary_id, DATA=data)).decode()
+
+        record = {
+            "id": page_id,
+            "url": hyperlink,
+            "title": title,
+            "heading": heading if heading is not None else title, # compressed mode only stores a heading that differs
+            "timestamp": timestamp,
+            "content": content,
+        }
+
+        if sections:
+            record["sections"] = parse_sections(content)
+
+        if links:
+            record["links"] = out_links.get(url_id, [])
+
+        records.append(record)
+
+    file = path.join(directory, name)
+
+    if export_format == "parquet":
+        pq.write_table(pa.Table.from_pylist(records, schema=schema(sections, links)), file + ".tmp", compression="zstd")
+    else:
+        with gzip.open(file + ".tmp", "wt", encoding="utf-8", compresslevel=6) as out:
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    replace(file + ".tmp", file) # a shard is either complete or absent
+
+    return {"name": name, "rows": len(records), "bytes": path.getsize(file)}
+
+
+def read_manifest(directory: str):
+    """
+    Gets the manifest of the exports to directory, listing every export with its window and shards.
+    """
+    manifest_path = path.join(directory, MANIFEST)
+
+    if not path.exists(manifest_path):
+        return {"watermark": 0, "exports": []}
+
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def export(database: Database, directory: str, export_format: str = "parquet", processes: int = 1, shard_bytes: int = 67108864, sections: bool = False, incremental: bool = False, since: float = 0, lag: float = 60, chunk_size: int = 1000):
+    """
+    Exports the Pages table, with the out-links of every page if the link graph has any, to shards of about
+    shard_bytes of content each. Rows and their out-links are read in one snapshot transaction, so the export is
+    consistent, and a process pool decompresses and writes the shards while the next ones are read, with a bounded
+    number of shards in flight.
+
+    Exports cover the rows whose WRITTEN time, set by the database writer, falls in a window that ends lag seconds
+    before the export started, to leave out flushes that may not be committed yet. The end of the window is recorded
+    in the manifest as the watermark, and an incremental export starts its window there, so every row is exported
+    once; a refreshed page, or a page replayed from the journal after a crash, is written again and so exported again.
+    Rows written before the WRITTEN column existed are windowed by their TIMESTAMP.
+
+    Args:
+        database (Database): The database to export.
+        directory (str): Directory of the shards and the manifest.
+        export_format (str): parquet or jsonl, which is gzip compressed.
+        processes (int): Number of processes writing shards.
+        shard_bytes (int): Uncompressed content per shard, at which a shard is cut.
+        sections (bool): Whether to add the sections parsed from the markup of the content.
+        incremental (bool): Whether to only export the rows newer than the watermark of the last export.
+        since (float): Time after which written rows are exported, when not incremental.
+        lag (float): Seconds before the start of the export at which its window ends.
+        chunk_size (int): Rows read per fetch.
+
+    Returns:
+        dict: The manifest entry of the export.
+    """
+    if export_format == "parquet":
+        require_pyarrow()
+
+    makedirs(directory, exist_ok=True)
+
+    manifest = read_manifest(directory)
+    run = len(manifest["exports"])
+
+    window = (manifest["watermark"] if incremental else since, time() - lag)
+
+    with database.ENGINE.connect() as connection:
+        links = connection.execute(select(func.count()).select_from(select(Models.Edge.SOURCE_ID).limit(1).subquery())).scalar() > 0
+
+    entry = {"run": run, "since": window[0], "until": window[1], "format": export_format, "sections": sections, "links": links}
+
+    in_flight = BoundedSemaphore(processes + 1) # shards read ahead of the writers, the bound on memory
+
+    def shards():
+
+        with database.ENGINE.connect() as connection:
+
+            database.BACKEND.snapshot(connection)
+
+            result = connection.execution_options(stream_results=True).execute(PAGES, {"since": window[0], "until": window[1]})
+
+            shard, size, number = [], 0, 0
+
+            while rows := result.fetchmany(chunk_size):
+
+                for row in rows:
+
+                    shard.append(tuple(row))
+                    size += row[-1]
+
+                    if size >= shard_bytes:
+                        in_flight.acquire()
+                        yield "pages-%05d-%06d%s" % (run, number, EXTENSIONS[export_format]), shard, read_links(connection, shard) if links else {}
+                        shard, size, number = [], 0, number + 1
+
+            if shard:
+                in_flight.acquire()
+                yield "pages-%05d-%06d%s" % (run, number, EXTENSIONS[export_format]), shard, read_links(connection, shard) if links else {}
+
+    written = []
+
+    with Pool(processes) as pool:
+        for shard in pool.imap(partial(write_shard, directory, export_format, sections, links), shards()):
+            in_flight.release()
+            written.append(shard)
+            print("%s: %d rows, %d bytes." % (shard["name"], shard["rows"], shard["bytes"]))
+
+    entry["shards"] = written
+    entry["rows"] = sum(shard["rows"] for shard in written)
+
+    if window[0] <= manifest["watermark"]: # no gap after the rows exported so far
+        manifest["watermark"] = max(manifest["watermark"], window[1])
+
+    manifest["exports"].append(entry)
+
+    with open(path.join(directory, MANIFEST + ".tmp"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    replace(path.join(directory, MANIFEST + ".tmp"), path.join(directory, MANIFEST))
+
+    return entry
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Export the scraped pages to Parquet or compressed JSONL shards.")
+    parser.add_argument("--directory", default="data/export")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--processes", type=int, default=cpu_count())
+    parser.add_argument("--shard-bytes", type=int, default=67108864, help="uncompressed content per shard")
+    parser.add_argument("--sections", action="store_true", help="add the sections parsed from the content markup")
+    parser.add_argument("--incremental", action="store_true", help="only export the pages newer than the watermark of the last export")
+    parser.add_argument("--since", type=float, default=0, help="time after which written pages are exported, when not incremental")
+    parser.add_argument("--lag", type=float, default=60, help="seconds before now at which the export window ends")
+
+    args = parser.parse_args()
+
+    entry = export(Database(), args.directory, args.format, args.processes, args.shard_bytes, args.sections, args.incremental, args.since, args.lag)
+
+    print("%d pages exported to %d shards in %s, up to %.0f." % (entry["rows"], len(entry["shards"]), args.directory, entry["until"]))
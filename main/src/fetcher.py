@@ -0,0 +1,75 @@
+from exceptions import WebpageError
+from utils import Fetched, conditional_headers, retry_after
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncFetcher:
+
+    """
+    Fetches pages concurrently over a single keep-alive connection pool, to be used from within one event loop.
+
+    Args:
+        pool_size (int): Maximum number of pooled connections shared by all concurrent fetches.
+    """
+
+    def __init__(self, pool_size: int) -> None:
+
+        if aiohttp is None:
+            raise ImportError("FETCH_MODE = async requires the aiohttp package.")
+
+        self.pool_size = pool_size
+        self.session = None
+
+    async def __aenter__(self):
+
+        connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size, keepalive_timeout=60)
+
+        self.session = aiohttp.ClientSession(connector=connector)
+
+        return self
+
+    async def __aexit__(self, *args):
+
+        await self.session.close()
+
+    async def fetch_page(self, page_url: str, etag: str = None, last_modified: str = None):
+
+        """
+        Fetches a page, conditionally if validators of an earlier fetch are given, raises a WebpageError if not possible.
+
+        Raises:
+            WebpageError: Error is raised if the status code of the get request is not 200, or 304 for a conditional one.
+
+        Returns:
+            Fetched: The status, content and validators.
+        """
+
+        async with self.session.get(page_url, headers=conditional_headers(etag, last_modified)) as response:
+
+            if response.status == 304 and (etag or last_modified):
+                return Fetched(304, None, response.headers.get("ETag", etag), response.headers.get("Last-Modified", last_modified), str(response.url))
+
+            if response.status != 200:
+                raise WebpageError(response.status, retry_after=retry_after(response.headers.get("Retry-After")))
+
+            content: bytes = await response.read()
+
+            return Fetched(200, content, response.headers.get("ETag"), response.headers.get("Last-Modified"), str(response.url))
+
+    async def get_bytes_from_page(self, page_url: str):
+
+        """
+        Gets the HTML content of the page in bytes, raises a WebpageError if not possible.
+
+        Raises:
+            WebpageError: Error is raised if the status code of the get request is not 200 (successfull).
+
+        Returns:
+            content (bytes): The HTML content of the page in bytes.
+        """
+
+        return (await self.fetch_page(page_url)).content
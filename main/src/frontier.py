@@ -0,0 +1,243 @@
+from array import array
+from hashlib import blake2b
+from math import log2
+
+from workitem import HyperlinkItem
+
+EPOCH = 1704067200 # 2024-01-01, discovery times are counted from here to keep scores small
+
+
+class CountMinSketch:
+
+    """
+    Count-min sketch of how often every hyperlink has been seen linked, the estimate of its in-degree: depth rows
+    of width counters, every hyperlink counting in one counter per row, read as the smallest of its counters. An
+    estimate is never below the true count, and with conservative updates only counters at that minimum are raised,
+    which keeps the overestimate from collisions small.
+
+    Args:
+        width (int): Counters per row.
+        depth (int): Number of rows.
+    """
+
+    def __init__(self, width: int = 1048576, depth: int = 4) -> None:
+
+        self.width = width
+        self.depth = depth
+        self.counters = array("I", bytes(4 * width * depth))
+
+    def positions(self, hyperlink: str):
+        """
+        Gets the counters of a hyperlink, one per row, using double hashing over a single 128 bit digest.
+        """
+        digest = blake2b(hyperlink.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [i * self.width + (h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, hyperlink: str, count: int = 1):
+        """
+        Counts a hyperlink, conservatively.
+
+        Returns:
+            int: The new estimate of its count.
+        """
+        positions = self.positions(hyperlink)
+        estimate = min(self.counters[i] for i in positions) + count
+
+        for i in positions:
+            if self.counters[i] < estimate:
+                self.counters[i] = min(estimate, 0xFFFFFFFF)
+
+        return estimate
+
+    def estimate(self, hyperlink: str):
+        return min(self.counters[i] for i in self.positions(hyperlink))
+
+
+class IndexedHeap:
+
+    """
+    Binary max-heap of keys by priority, with the position of every key indexed, so the priority of a key in the
+    heap can be changed in place (decrease-key, here raising it towards the top) and a key is only held once.
+    """
+
+    def __init__(self) -> None:
+        self.heap: list[list] = [] # [priority, key, value] entries
+        self.index: dict = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def swap(self, i: int, j: int):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.index[heap[i][1]] = i
+        self.index[heap[j][1]] = j
+
+    def sift_up(self, i: int):
+        heap = self.heap
+        while i > 0 and heap[(i - 1) // 2][0] < heap[i][0]:
+            self.swap(i, (i - 1) // 2)
+            i = (i - 1) // 2
+
+    def sift_down(self, i: int):
+        heap = self.heap
+        while True:
+            largest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap) and heap[child][0] > heap[largest][0]:
+                    largest = child
+            if largest == i:
+                return
+            self.swap(i, largest)
+            i = largest
+
+    def push(self, key, priority: float, value = None):
+        """
+        Adds a key, or changes its priority if it is in the heap already.
+        """
+        if key in self.index:
+            self.update(key, priority)
+            return
+
+        self.heap.append([priority, key, value])
+        self.index[key] = len(self.heap) - 1
+        self.sift_up(len(self.heap) - 1)
+
+    def update(self, key, priority: float):
+        i = self.index[key]
+        old = self.heap[i][0]
+        self.heap[i][0] = priority
+        if priority > old:
+            self.sift_up(i)
+        else:
+            self.sift_down(i)
+
+    def pop(self):
+        """
+        Pops the entry of highest priority.
+
+        Returns:
+            tuple: Priority, key and value.
+        """
+        self.swap(0, len(self.heap) - 1)
+        priority, key, value = self.heap.pop()
+        del self.index[key]
+        if self.heap:
+            self.sift_down(0)
+        return priority, key, value
+
+    def pop_lowest(self, n: int):
+        """
+        Pops the n entries of lowest priority, rebuilding the heap from the rest.
+        """
+        self.heap.sort(key= lambda x: x[0], reverse=True) # a sorted list is a valid max-heap
+
+        lowest = self.heap[len(self.heap) - n:] if n > 0 else []
+        del self.heap[len(self.heap) - len(lowest):]
+
+        self.index = {entry[1]: i for i, entry in enumerate(self.heap)}
+
+        return [tuple(entry) for entry in lowest]
+
+
+class SizeScorer:
+
+    """
+    Ranks hyperlinks by the size of the page they were found on, the order of the crawl before scoring.
+    """
+
+    def score(self, hyperlink: HyperlinkItem, in_degree: int):
+        return float(hyperlink.PARENT_PRIORITY or 0)
+
+
+class PopularityScorer:
+
+    """
+    Ranks hyperlinks by their estimated in-degree, the number of pages found linking to them so far, on a log scale,
+    less a cost per link of depth from the seed, and earliest found first. The discovery time stands in for age:
+    every hyperlink ages at the same rate, so ranking earlier discoveries higher orders them by age without scores
+    going stale.
+
+    Args:
+        in_degree_weight (float): Score per doubling of the in-degree.
+        depth_weight (float): Score lost per link of depth from the seed.
+        age_weight (float): Score per hour of age.
+    """
+
+    def __init__(self, in_degree_weight: float = 1.0, depth_weight: float = 0.5, age_weight: float = 0.1) -> None:
+        self.in_degree_weight = in_degree_weight
+        self.depth_weight = depth_weight
+        self.age_weight = age_weight
+
+    def score(self, hyperlink: HyperlinkItem, in_degree: int):
+        return (
+            self.in_degree_weight * log2(1 + in_degree)
+            - self.depth_weight * (hyperlink.DEPTH or 0)
+            - self.age_weight * ((hyperlink.TIMESTAMP or EPOCH) - EPOCH) / 3600
+        )
+
+
+class Frontier:
+
+    """
+    In-memory frontier of the overseer: the best scored unscraped hyperlinks in an indexed heap, scored as links to
+    them are seen. Every hyperlink linked from a scraped page is counted in the in-degree sketch, and those in the
+    heap are rescored in place. Past capacity the lowest scored hyperlinks are spilled to the database with their
+    score, to be claimed back by it when the heap runs low.
+
+    Args:
+        scorer (SizeScorer | PopularityScorer): Scorer of hyperlinks, any object with the score method.
+        capacity (int): Most hyperlinks held in memory.
+        sketch (CountMinSketch): In-degree estimates.
+    """
+
+    def __init__(self, scorer, capacity: int, sketch: CountMinSketch) -> None:
+        self.scorer = scorer
+        self.capacity = capacity
+        self.sketch = sketch
+        self.heap = IndexedHeap()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def observe(self, hyperlinks: list[str]):
+        """
+        Counts the links of a scraped page to hyperlinks, rescoring those in the heap.
+        """
+        for hyperlink in hyperlinks:
+
+            in_degree = self.sketch.add(hyperlink)
+
+            if hyperlink in self.heap:
+                entry = self.heap.heap[self.heap.index[hyperlink]]
+                entry[2].SCORE = self.scorer.score(entry[2], in_degree)
+                self.heap.update(hyperlink, entry[2].SCORE)
+
+    def push_many(self, hyperlinks: list[HyperlinkItem]):
+        """
+        Adds hyperlinks to the heap, scored by the in-degree seen so far, at least the one link they were found by.
+        """
+        for hyperlink in hyperlinks:
+            if hyperlink.HYPERLINK not in self.heap:
+                hyperlink.SCORE = self.scorer.score(hyperlink, max(1, self.sketch.estimate(hyperlink.HYPERLINK)))
+                self.heap.push(hyperlink.HYPERLINK, hyperlink.SCORE, hyperlink)
+
+    def pop_many(self, n: int):
+        """
+        Pops the n best scored hyperlinks.
+        """
+        return [self.heap.pop()[2] for _ in range(min(n, len(self.heap)))]
+
+    def spill(self):
+        """
+        Pops the lowest scored hyperlinks past capacity, down to three quarters of it, to be written back.
+        """
+        if len(self.heap) <= self.capacity:
+            return []
+
+        return [entry[2] for entry in self.heap.pop_lowest(len(self.heap) - self.capacity * 3 // 4)]
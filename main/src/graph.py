@@ -0,0 +1,305 @@
+from argparse import ArgumentParser
+from os import makedirs, path
+
+from sqlalchemy import text, select, func
+
+from config import get_config
+from database import Database
+from models import Models
+from urls import UrlDictionary, canonicalize_url, get_base
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The link graph analytics require the numpy package.")
+
+
+class LinkGraph:
+
+    """
+    Store of the link graph of the crawl: every hyperlink is interned to its ID in the Urls table and every
+    (source, target) pair found on a page is an Edges row of two IDs.
+
+    Args:
+        database (Database): The database holding the graph.
+        url_dictionary (UrlDictionary): Dictionary to intern hyperlinks with, shared with the other resolvers.
+    """
+
+    def __init__(self, database: Database, url_dictionary: UrlDictionary = None) -> None:
+        self.database = database
+        self.urls = url_dictionary or UrlDictionary()
+
+    @staticmethod
+    def edges_row(source: str, targets: list[str]):
+        """
+        Gets the item to queue for the database writer for the out-links of a page.
+
+        Args:
+            source (str): Hyperlink of the page.
+            targets (list[str]): Hyperlinks found on the page.
+
+        Returns:
+            tuple[str, dict]: Table name and row, resolved to IDs by resolve_edges.
+        """
+        return (Models.Edge.__tablename__, {"_SOURCE": source, "_TARGETS": list(targets)})
+
+    def resolve_edges(self, connection, rows: list[dict]):
+        """
+        Database writer resolver of the Edges table: turns queued (source, targets) rows into ID pairs.
+        """
+        urls = []
+        for row in rows:
+            urls.append(row["_SOURCE"])
+            urls.extend(row["_TARGETS"])
+
+        ids = self.urls.intern(connection, urls)
+
+        return [{"SOURCE_ID": ids[row["_SOURCE"]], "TARGET_ID": ids[target]} for row in rows for target in row["_TARGETS"]]
+
+    def export_csr(self, directory: str, chunk_size: int = 1000000):
+        """
+        Exports the graph to CSR adjacency arrays, streamed from the Edges table in primary key (source) order.
+        Writes indptr.npy and indices.npy to directory, to be memory-mapped by CSRGraph.load. The node count, edge
+        count and edges are read in one snapshot transaction, so rows the crawler writes meanwhile are left out, and
+        edges between IDs past the node count are never exported.
+
+        Args:
+            directory (str): Directory to write to.
+            chunk_size (int): Edges read per fetch.
+
+        Returns:
+            CSRGraph: The exported graph, memory-mapped.
+        """
+        require_numpy()
+
+        makedirs(directory, exist_ok=True)
+
+        with self.database.ENGINE.connect() as connection:
+
+            self.database.BACKEND.snapshot(connection)
+
+            num_nodes = (connection.execute(select(func.max(Models.Url.ID))).scalar() or 0) + 1
+
+            in_range = (Models.Edge.SOURCE_ID < num_nodes) & (Models.Edge.TARGET_ID < num_nodes)
+
+            num_edges = connection.execute(select(func.count()).select_from(Models.Edge).where(in_range)).scalar()
+
+            indices = np.lib.format.open_memmap(path.join(directory, "indices.npy"), mode="w+", dtype=np.int32 if num_nodes < 2**31 else np.int64, shape=(num_edges,))
+            counts = np.zeros(num_nodes, dtype=np.int64)
+
+            result = connection.execution_options(stream_results=True).execute(text(
+                'SELECT "SOURCE_ID", "TARGET_ID" FROM "Edges" WHERE "SOURCE_ID" < :nodes AND "TARGET_ID" < :nodes ORDER BY "SOURCE_ID", "TARGET_ID"'
+            ), {"nodes": num_nodes})
+
+            position = 0
+
+            while rows := result.fetchmany(chunk_size):
+
+                chunk = np.array(rows, dtype=np.int64)
+
+                chunk = chunk[:num_edges - position] # never more than the arrays are sized for
+
+                indices[position:position + len(chunk)] = chunk[:, 1]
+                counts += np.bincount(chunk[:, 0], minlength=num_nodes)
+
+                position += len(chunk)
+
+                if position >= num_edges:
+                    break
+
+            indices.flush()
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        np.save(path.join(directory, "indptr.npy"), indptr)
+
+        return CSRGraph.load(directory)
+
+
+class CSRGraph:
+
+    """
+    Directed graph in compressed sparse row form: the out-neighbours of node i are indices[indptr[i]:indptr[i+1]].
+    All analytics are vectorized over the edge arrays.
+
+    Args:
+        indptr (np.ndarray): Offsets of the out-neighbours of every node, of length num_nodes + 1.
+        indices (np.ndarray): Concatenated out-neighbours.
+    """
+
+    def __init__(self, indptr, indices) -> None:
+        require_numpy()
+        self.indptr = indptr
+        self.indices = indices
+        self.num_nodes = len(indptr) - 1
+
+    @classmethod
+    def load(cls, directory: str):
+        """
+        Memory-maps a graph written by LinkGraph.export_csr.
+        """
+        require_numpy()
+        return cls(np.load(path.join(directory, "indptr.npy"), mmap_mode="r"), np.load(path.join(directory, "indices.npy"), mmap_mode="r"))
+
+    def out_degree(self):
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        return np.bincount(self.indices, minlength=self.num_nodes)
+
+    def sources(self):
+        """
+        Gets the source node of every edge, aligned with indices.
+        """
+        return np.repeat(np.arange(self.num_nodes, dtype=self.indices.dtype), self.out_degree())
+
+    def pagerank(self, damping: float = 0.85, tolerance: float = 1e-6, max_iterations: int = 100):
+        """
+        Computes PageRank by power iteration; the rank of dangling nodes is spread uniformly.
+
+        Returns:
+            np.ndarray: Rank of every node, summing to 1.
+        """
+        n = self.num_nodes
+        out_degree = self.out_degree()
+        dangling = out_degree == 0
+        inverse_degree = np.where(dangling, 0, 1 / np.maximum(out_degree, 1))
+        sources = self.sources()
+
+        rank = np.full(n, 1 / n)
+
+        for _ in range(max_iterations):
+
+            contribution = (rank * inverse_degree)[sources]
+
+            new_rank = np.bincount(self.indices, weights=contribution, minlength=n)
+            new_rank = damping * (new_rank + rank[dangling].sum() / n) + (1 - damping) / n
+
+            converged = np.abs(new_rank - rank).sum() < tolerance
+            rank = new_rank
+
+            if converged:
+                break
+
+        return rank
+
+    def neighbours(self, nodes):
+        """
+        Gets the out-neighbours of a set of nodes, concatenated.
+        """
+        starts = self.indptr[nodes]
+        lengths = self.indptr[nodes + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return self.indices[offsets]
+
+    def bfs(self, source: int):
+        """
+        Computes the BFS distance of every node from source, level by level.
+
+        Returns:
+            np.ndarray: Distance in links, -1 for unreachable nodes.
+        """
+        distance = np.full(self.num_nodes, -1, dtype=np.int32)
+        distance[source] = 0
+
+        frontier = np.array([source], dtype=np.int64)
+        level = 0
+
+        while len(frontier):
+            level += 1
+            reached = self.neighbours(frontier)
+            reached = np.unique(reached[distance[reached] == -1])
+            distance[reached] = level
+            frontier = reached
+
+        return distance
+
+    def connected_components(self):
+        """
+        Labels the weakly connected components with hooking and pointer jumping over the edge arrays.
+
+        Returns:
+            np.ndarray: Component label of every node, the smallest node ID in its component.
+        """
+        parent = np.arange(self.num_nodes, dtype=np.int64)
+        sources = self.sources().astype(np.int64)
+        targets = np.asarray(self.indices, dtype=np.int64)
+
+        while True:
+
+            a, b = parent[sources], parent[targets]
+            low, high = np.minimum(a, b), np.maximum(a, b)
+            mask = low != high
+
+            if not mask.any():
+                return parent
+
+            low, high = low[mask], high[mask]
+
+            # hook every root to the smallest root it is linked to
+            order = np.lexsort((low, high))
+            high, low = high[order], low[order]
+            first = np.r_[True, high[1:] != high[:-1]]
+            parent[high[first]] = np.minimum(parent[high[first]], low[first])
+
+            # pointer jumping until every node points at its root
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Export and analyse the link graph of the crawl.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="export the Edges table to CSR arrays")
+    export.add_argument("--directory", default="data/graph")
+
+    stats = subparsers.add_parser("stats", help="print PageRank, degree, BFS and component statistics")
+    stats.add_argument("--directory", default="data/graph")
+    stats.add_argument("--top", type=int, default=10)
+
+    args = parser.parse_args()
+
+    database = Database()
+
+    if args.command == "export":
+
+        graph = LinkGraph(database).export_csr(args.directory)
+
+        print("%d nodes, %d edges exported to %s." % (graph.num_nodes, len(graph.indices), args.directory))
+
+    else:
+
+        graph = CSRGraph.load(args.directory)
+
+        rank = graph.pagerank()
+        in_degree = graph.in_degree()
+        components = graph.connected_components()
+
+        top = np.argsort(-rank)[:args.top]
+
+        with database.createSession() as session:
+            urls = dict(session.query(Models.Url.ID, Models.Url.URL).filter(Models.Url.ID.in_([int(i) for i in top])).all())
+            seed = session.query(Models.Url.ID).filter(Models.Url.URL == canonicalize_url(get_config().string("WIKI_SEED_URL"), get_base(get_config().string("WIKI_SEED_URL")))).scalar()
+
+        for i in top:
+            print("%.6f  %6d in  %s" % (rank[i], in_degree[i], urls.get(int(i))))
+
+        components = components[1:] # IDs start at 1, node 0 is unused
+
+        print("%d components, largest has %d nodes." % (len(np.unique(components)), np.bincount(components).max()))
+
+        if seed is not None:
+            distance = graph.bfs(seed)
+            reached = distance[distance >= 0]
+            print("%d nodes reachable from the seed, mean distance %.2f, max %d." % (len(reached), reached.mean(), reached.max()))
@@ -0,0 +1,168 @@
+from hashlib import sha256
+from mmap import mmap, ACCESS_READ
+from os import makedirs, path, getpid
+from socket import gethostname
+from time import time
+import zlib
+
+from models import Models
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER = 8 # length and crc32 of a record, before its payload
+SUFFIX = ".pack"
+
+
+class HtmlCache:
+
+    """
+    Content-addressed store of the raw HTML of the pages fetched, so pages can be extracted again without fetching
+    them again. Every process appends the compressed pages it fetches to pack files of its own, named
+    <host>-<pid>-<time>.<number>.pack, starting a new pack when the current one reaches pack_bytes; packs are never
+    rewritten. The HtmlPages table indexes every distinct page by the sha256 of its bytes, with its pack, offset and
+    size, and Hyperlinks.HTML_HASH holds the latest page of every hyperlink. Packs are read through mmap. A page whose
+    hash the process wrote recently is not appended again, its earlier record is indexed instead.
+
+    Args:
+        directory (str): Directory of the pack files.
+        codec (str): zlib or zstd.
+        level (int): Compression level.
+        pack_bytes (int): Size at which a process starts a new pack.
+        enabled (bool): Whether to store pages at all.
+        written_size (int): Number of index rows of recently written pages kept in memory.
+    """
+
+    def __init__(self, directory: str, codec: str = "zlib", level: int = 6, pack_bytes: int = 1073741824, enabled: bool = True, written_size: int = 100000) -> None:
+
+        if enabled and codec == "zstd" and zstandard is None:
+            raise ImportError("HTML_CACHE_CODEC = zstd requires the zstandard package.")
+
+        self.directory = directory
+        self.codec = codec
+        self.level = level
+        self.pack_bytes = pack_bytes
+        self.enabled = enabled
+        self.written_size = written_size
+
+        self.pid = None # per process state, opened lazily after the fork
+        self.file = None
+        self.pack = None
+        self.packs = 0
+        self.maps: dict[str, mmap] = {}
+        self.written: dict[str, dict] = {} # index rows of the pages this process wrote, by hash
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pid"] = None
+        state["file"] = None
+        state["pack"] = None
+        state["maps"] = {}
+        state["written"] = {}
+        return state
+
+    def compress(self, data: bytes):
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+    @staticmethod
+    def decompress(codec: str, data: bytes):
+        if codec == "zstd":
+            if zstandard is None:
+                raise ImportError("Reading zstd packs requires the zstandard package.")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def open_pack(self):
+        """
+        Starts a new pack of this process.
+        """
+        if self.file is not None and self.pid == getpid():
+            self.file.close()
+
+        if self.pid != getpid():
+            self.pid = getpid()
+            self.packs = 0
+            self.written = {}
+
+        self.packs += 1
+
+        makedirs(self.directory, exist_ok=True)
+        self.pack = "%s-%d-%d.%06d%s" % (gethostname(), getpid(), time(), self.packs, SUFFIX)
+        self.file = open(path.join(self.directory, self.pack), "ab")
+
+    def put(self, content: bytes):
+        """
+        Appends a page to the pack of this process, unless the process wrote the same page recently.
+
+        Returns:
+            tuple[str, dict]: Table name and row of the HtmlPages table indexing the page, for the database writer.
+        """
+        if self.pid != getpid() or self.file.tell() >= self.pack_bytes:
+            self.open_pack()
+
+        digest = sha256(content).hexdigest()
+
+        if digest in self.written:
+            return (Models.HtmlPage.__tablename__, self.written[digest].copy())
+
+        payload = self.compress(content)
+
+        offset = self.file.tell()
+
+        self.file.write(len(payload).to_bytes(4, "little") + zlib.crc32(payload).to_bytes(4, "little") + payload)
+        self.file.flush() # readable by other processes once its index row is written
+
+        row = {
+            "HASH": digest,
+            "PACK": self.pack,
+            "OFFSET": offset,
+            "SIZE": HEADER + len(payload),
+            "LENGTH": len(content),
+            "CODEC": self.codec,
+            "TIMESTAMP": time(),
+        }
+
+        if len(self.written) >= self.written_size:
+            self.written.clear()
+
+        self.written[digest] = row
+
+        return (Models.HtmlPage.__tablename__, row.copy())
+
+    def get(self, pack: str, offset: int, size: int, codec: str = None):
+        """
+        Reads a page back from its pack, mapping the pack into memory once per process, or again if it grew past the
+        mapping.
+
+        Raises:
+            ValueError: If the record is torn or corrupt.
+
+        Returns:
+            bytes: The raw HTML of the page.
+        """
+        mapped = self.maps.get(pack)
+
+        if mapped is None or offset + size > len(mapped):
+            if mapped is not None:
+                mapped.close()
+            with open(path.join(self.directory, pack), "rb") as file:
+                mapped = self.maps[pack] = mmap(file.fileno(), 0, access=ACCESS_READ)
+
+        record = mapped[offset:offset + size]
+
+        length = int.from_bytes(record[:4], "little")
+        payload = record[HEADER:HEADER + length]
+
+        if len(payload) != length or zlib.crc32(payload) != int.from_bytes(record[4:HEADER], "little"):
+            raise ValueError("Corrupt record at offset %d of %s." % (offset, pack))
+
+        return self.decompress(codec or self.codec, payload)
+
+    def close(self):
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
@@ -0,0 +1,413 @@
+from argparse import ArgumentParser
+import bz2
+from functools import partial
+import gzip
+from html import escape, unescape
+import json
+from multiprocessing import Pool, cpu_count
+from os import path
+import re
+from threading import BoundedSemaphore
+from time import monotonic, time
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+import main
+import utils
+from exceptions import ContentScrapeError
+from graph import LinkGraph
+from models import Models
+from search import SearchIndex
+from urls import title_to_url
+
+FORMATS = ("xml", "html")
+
+# page markup the extraction functions expect, around the body of a dump record
+PAGE = (
+    '<!DOCTYPE html>\n<html><head><meta charset="UTF-8"><title>%s</title></head><body>'
+    '<h1 id="firstHeading" class="firstHeading mw-first-heading"><span class="mw-page-title-main">%s</span></h1>'
+    '<div id="mw-content-text" class="mw-body-content"><div class="mw-content-ltr mw-parser-output" lang="en" dir="ltr">'
+    '%s</div></div></body></html>'
+)
+
+# Parsoid HTML of the Enterprise HTML dumps
+BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S | re.I)
+SECTION = re.compile(r"</?section\b[^>]*>", re.I)
+HEADING_ELEMENT = re.compile(r"<h([2-6])\b([^>]*)>(.*?)</h\1>", re.S | re.I)
+RELATIVE_HREF = re.compile(r'href="\./')
+
+# wikitext of the XML dumps
+COMMENT = re.compile(r"<!--.*?-->", re.S)
+REF = re.compile(r"<ref\b[^>]*/>|<ref\b[^>]*>.*?</ref>", re.S | re.I)
+EXTENSION = re.compile(r"<(math|chem|gallery|syntaxhighlight|source|score|timeline|imagemap|graph|mapframe)\b[^>]*>.*?</\1>", re.S | re.I)
+TEMPLATE = re.compile(r"\{\{[^{}]*\}\}") # innermost, removed until none is left
+TABLE = re.compile(r"\{\|(?:(?!\{\|).)*?\|\}", re.S) # innermost, likewise
+FILE_LINK = re.compile(r"\[\[\s*(?:File|Image|Category)\s*:[^\[\]]*(?:\[\[[^\[\]]*\]\][^\[\]]*)*\]\]", re.I)
+TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+MAGIC_WORD = re.compile(r"__[A-Z]+__")
+EXTERNAL_LINK = re.compile(r"\[(?:https?:)?//[^\s\]]+(?:\s+([^\]]*))?\]")
+EMPHASIS = re.compile(r"'{2,}")
+LINK = re.compile(r"\[\[([^\[\]|]+)(?:\|([^\[\]]*))?\]\]([a-z]*)")
+HEADING = re.compile(r"^(={2,6})\s*(.*?)\s*\1$")
+
+
+def open_dump(dump: str):
+    """
+    Opens a dump file for streaming, decompressing it on the fly if it is bz2 or gzip compressed.
+
+    Returns:
+        tuple[BinaryIO, BinaryIO]: The decompressed stream, and the raw file under it, whose position is the progress
+        through the file.
+    """
+    raw = open(dump, "rb")
+
+    if dump.endswith(".bz2"):
+        return bz2.BZ2File(raw), raw
+
+    if dump.endswith(".gz"):
+        return gzip.GzipFile(fileobj=raw), raw
+
+    return raw, raw
+
+
+def guess_format(dump: str):
+    """
+    Guesses the format of a dump from its name: xml for the pages-articles XML dumps, html for the NDJSON files of
+    the Enterprise HTML dumps.
+    """
+    name = re.sub(r"\.(bz2|gz)$", "", dump)
+
+    if name.endswith(".xml"):
+        return "xml"
+
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "html"
+
+    raise ValueError("Cannot tell the format of %s, pass --format." % dump)
+
+
+def read_records(stream, dump_format: str, offset: int = 0):
+    """
+    Splits a decompressed dump into records, without parsing them: lines of NDJSON, or <page> elements of XML.
+
+    Args:
+        stream (BinaryIO): The decompressed dump.
+        dump_format (str): xml or html.
+        offset (int): Decompressed byte offset to start at, the end of a record of an earlier run.
+
+    Yields:
+        tuple[bytes, int]: A record and the decompressed byte offset of its end.
+    """
+    if offset:
+        stream.seek(offset) # decompresses up to the offset, but nothing before it is parsed
+
+    if dump_format == "html":
+        for line in stream:
+            offset += len(line)
+            if line.strip():
+                yield line, offset
+        return
+
+    page = None
+
+    for line in stream:
+
+        offset += len(line)
+        stripped = line.strip()
+
+        if stripped == b"<page>":
+            page = [line]
+
+        elif page is not None:
+            page.append(line)
+            if stripped == b"</page>":
+                yield b"".join(page), offset
+                page = None
+
+
+def read_chunks(records, chunk_records: int):
+    """
+    Groups records into chunks for the process pool.
+
+    Yields:
+        tuple[list[bytes], int]: The records of a chunk and the decompressed byte offset of its end.
+    """
+    chunk = []
+
+    for record, end in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_records:
+            yield chunk, end
+            chunk = []
+
+    if chunk:
+        yield chunk, end
+
+
+def parsoid_page(record: bytes):
+    """
+    Gets the title and page markup of an Enterprise HTML dump record. Parsoid HTML is brought to the markup of the
+    rendered page: sections are unwrapped, headings put in mw-heading divs and ./Title links made /wiki/Title links.
+
+    Returns:
+        tuple[str, bytes]: Title and page, None if the record is not an article.
+    """
+    data = json.loads(record)
+
+    if data.get("namespace", {}).get("identifier", 0) != 0:
+        return None
+
+    html = data["article_body"]["html"]
+
+    body = BODY.search(html)
+    html = SECTION.sub("", body.group(1) if body else html)
+
+    if "mw-heading" not in html:
+        html = HEADING_ELEMENT.sub(lambda m: '<div class="mw-heading mw-heading%s"><h%s%s>%s</h%s></div>' % (m[1], m[1], m[2], m[3], m[1]), html)
+
+    html = RELATIVE_HREF.sub('href="/wiki/', html)
+
+    return data["name"], (PAGE % (escape(data["name"]), escape(data["name"]), html)).encode()
+
+
+def wikitext_page(record: bytes):
+    """
+    Gets the title and page markup of an XML dump <page>. The wikitext is converted to the markup of the rendered page
+    approximately: templates, tables, references, files and formatting are dropped, headings and paragraphs kept and
+    [[links]] made /wiki/ links. Redirects and pages outside the article namespace are skipped.
+
+    Returns:
+        tuple[str, bytes]: Title and page, None if the record is not an article.
+    """
+    element = ElementTree.fromstring(record)
+
+    if element.findtext("ns", "0") != "0" or element.find("redirect") is not None:
+        return None
+
+    title = element.findtext("title")
+    text = element.findtext("revision/text") or ""
+
+    for pattern in (COMMENT, REF, EXTENSION):
+        text = pattern.sub("", text)
+
+    for pattern in (TEMPLATE, TABLE, FILE_LINK):
+        count = 1
+        while count:
+            text, count = pattern.subn("", text)
+
+    text = MAGIC_WORD.sub("", TAG.sub("", text)).replace("<", "&lt;").replace(">", "&gt;") # entities are markup in wikitext too
+    text = EMPHASIS.sub("", EXTERNAL_LINK.sub(lambda m: m[1] or "", text))
+    text = LINK.sub(lambda m: '<a href="/wiki/%s">%s%s</a>' % (quote(unescape(m[1]).strip().replace(" ", "_")), m[2] or m[1], m[3]), text)
+
+    blocks, paragraph = [], []
+
+    for line in text.split("\n"):
+
+        line = line.strip()
+        heading = HEADING.match(line)
+
+        if heading or not line or line[0] in "*#:;|!{}-":
+            if paragraph: # lists, indents, rules and blank lines end a paragraph, as they do in the rendered page
+                blocks.append("<p>%s</p>" % " ".join(paragraph))
+                paragraph = []
+
+        if heading:
+            level = len(heading[1])
+            blocks.append('<div class="mw-heading mw-heading%d"><h%d>%s</h%d></div>' % (level, level, heading[2], level))
+
+        elif line and line[0] not in "*#:;|!{}-":
+            paragraph.append(line)
+
+    if paragraph:
+        blocks.append("<p>%s</p>" % " ".join(paragraph))
+
+    return title, (PAGE % (escape(title), escape(title), "\n".join(blocks))).encode()
+
+
+PAGE_READERS = {"xml": wikitext_page, "html": parsoid_page}
+
+
+def page_rows(title: str, page: bytes):
+    """
+    Extracts a page of a dump with the extraction functions of the crawl and gets the rows to write for it: the page,
+    its hyperlink, marked as scraped so the crawl does not fetch it, and its out-links if the link graph is enabled.
+
+    Returns:
+        list[tuple[str, dict]]: Table name and row pairs for the database writer.
+    """
+    url = title_to_url(title, utils.WIKI_BASE)
+
+    if url is None:
+        return []
+
+    hyperlinks, heading, content = utils.extract_page(page)
+
+    if heading is None or content is None:
+        raise ContentScrapeError()
+
+    out = Models.Page(HYPERLINK=url, TITLE=heading, HEADING=heading, CONTENT=content, TIMESTAMP=time())
+
+    rows = main.CONTENT_STORE.page_rows(out)
+
+    if main.SEARCH_INDEX_ENABLED:
+        for table, row in rows:
+            if table == out.__tablename__:
+                row["_SEARCH"] = SearchIndex.document(out.HYPERLINK, out.TITLE, out.CONTENT)
+
+    rows.append(main.scraped_row(url, len(page), out.TIMESTAMP))
+
+    if main.LINK_GRAPH_ENABLED:
+        rows.append(LinkGraph.edges_row(url, utils.screen_hyperlinks(url, hyperlinks)))
+
+    return rows
+
+
+def ingest_chunk(dump_format: str, chunk: tuple[list[bytes], int]):
+    """
+    Process pool task: extracts the records of a chunk.
+
+    Returns:
+        tuple[list, int, int, int, int, int]: The rows, the number of records, of pages, of records skipped as not articles
+        and of records that could not be extracted, and the end offset of the chunk.
+    """
+    records, end = chunk
+
+    rows, pages, skipped, errors = [], 0, 0, 0
+
+    for record in records:
+        try:
+            page = PAGE_READERS[dump_format](record)
+
+            if page is None:
+                skipped += 1
+                continue
+
+            record_rows = page_rows(*page)
+
+            if record_rows:
+                rows.extend(record_rows)
+                pages += 1
+            else:
+                skipped += 1
+
+        except Exception:
+            errors += 1
+
+    return rows, len(records), pages, skipped, errors, end
+
+
+def checkpoint_stream(dump: str):
+    """
+    Gets the name of the checkpoint of a dump, kept in the Checkpoints table next to those of the journal.
+    """
+    return "ingest:" + path.abspath(dump)
+
+
+def get_checkpoint(dump: str):
+    """
+    Gets the decompressed byte offset up to which a dump is ingested, 0 if it is not.
+    """
+    Checkpoint = main.DATABASE.MODELS.Checkpoint
+
+    with main.DATABASE.createSession() as session:
+        checkpoint = session.get(Checkpoint, checkpoint_stream(dump))
+        return checkpoint.SEQUENCE if checkpoint is not None else 0
+
+
+def ingest(dump: str, dump_format: str, processes: int, chunk_records: int = 100, offset: int = 0, report_seconds: float = 10):
+    """
+    Ingests a dump into the Pages table and the link tables. The dump is streamed and split into chunks of records
+    that a process pool extracts, while this process writes their rows in transactions of WRITER_FLUSH_ROWS rows,
+    each with the offset of the end of its last chunk as the checkpoint of the dump.
+
+    Args:
+        dump (str): Path of the dump, optionally bz2 or gzip compressed.
+        dump_format (str): xml or html.
+        processes (int): Number of extracting processes.
+        chunk_records (int): Number of records per task of the pool.
+        offset (int): Decompressed byte offset to start at.
+        report_seconds (float): Seconds between progress reports.
+
+    Returns:
+        int: Number of pages written.
+    """
+    stream, raw = open_dump(dump)
+    size = path.getsize(dump)
+
+    writer = main.create_writer(None, None)
+    stream_name = checkpoint_stream(dump)
+
+    pending: dict[str, list[dict]] = {}
+    count = records = pages = skipped = errors = 0
+
+    start = last_report = monotonic()
+
+    window = BoundedSemaphore(processes * 4) # chunks in flight, so the reader stays bounded ahead of the writer
+
+    def chunks():
+        for chunk in read_chunks(read_records(stream, dump_format, offset), chunk_records):
+            window.acquire()
+            yield chunk
+
+    def report(end: int):
+        elapsed = monotonic() - start
+        print(
+            "%d records, %d pages, %d skipped, %d errors, %.1f%% of the file, %.1f pages/s, at offset %d." % (
+                records, pages, skipped, errors, 100 * raw.tell() / size if size else 100, pages / elapsed if elapsed else 0, end
+            )
+        )
+
+    with stream, Pool(processes) as pool:
+
+        end = offset
+
+        for rows, chunk_count, chunk_pages, chunk_skipped, chunk_errors, end in pool.imap(partial(ingest_chunk, dump_format), chunks()):
+
+            window.release()
+
+            for name, row in rows:
+                pending.setdefault(name, []).append(row)
+
+            count += len(rows)
+            records += chunk_count
+            pages += chunk_pages
+            skipped += chunk_skipped
+            errors += chunk_errors
+
+            if count >= main.WRITER_FLUSH_ROWS: # chunks come back in order, so every record before end is in the flush
+                writer.flush(pending, {stream_name: end})
+                pending, count = {}, 0
+
+            if monotonic() - last_report >= report_seconds:
+                report(end)
+                last_report = monotonic()
+
+        writer.flush(pending, {stream_name: end})
+
+    report(end)
+
+    return pages
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Ingest a Wikipedia dump into the database, without crawling.")
+    parser.add_argument("dump", help="pages-articles XML dump, or NDJSON file of an Enterprise HTML dump, optionally .bz2 or .gz")
+    parser.add_argument("--format", choices=FORMATS, help="format of the dump, guessed from its name by default")
+    parser.add_argument("--processes", type=int, default=cpu_count())
+    parser.add_argument("--chunk-records", type=int, default=100, help="records per task of the process pool")
+    parser.add_argument("--offset", type=int, help="decompressed byte offset to start at, the checkpoint of an earlier run by default")
+    parser.add_argument("--restart", action="store_true", help="start from the beginning, ignoring the checkpoint")
+
+    args = parser.parse_args()
+
+    main.create_tables()
+
+    offset = args.offset if args.offset is not None else 0 if args.restart else get_checkpoint(args.dump)
+
+    if offset:
+        print("Resuming at offset %d." % offset)
+
+    pages = ingest(args.dump, args.format or guess_format(args.dump), args.processes, args.chunk_records, offset)
+
+    print("%d pages ingested." % pages)
@@ -0,0 +1,271 @@
+from multiprocessing import Value
+from os import listdir, makedirs, path, remove, getpid, fsync
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from socket import gethostname
+from time import time
+from zlib import crc32
+
+HEADER = 8 # length and crc32 of a record, before its payload
+SUFFIX = ".journal"
+REJECTED_SUFFIX = ".rejected"
+
+
+class Journal:
+
+    """
+    Write-ahead journal of the rows sent to the database writer. Every batch is appended to the journal stream of
+    the sending process before it is queued, under a sequence number from a counter shared by all processes, and the
+    writer records the last sequence number of every stream it has committed in the Checkpoints table, in the same
+    transaction as the rows. After a crash only the records past the checkpoint of their stream are replayed.
+
+    A stream is a series of segment files named <stream>.<first sequence number>.journal; a segment is started when
+    the current one reaches segment_bytes, and deleted by the writer once a later record of its stream is committed,
+    so the journal only holds the tail that is not in the database yet. The stream of a process that exited is
+    closed through the queue of the writer, which deletes its last segment too once every record in it is committed.
+
+    Args:
+        directory (str): Directory of the segment files.
+        segment_bytes (int): Size at which a stream starts a new segment.
+        sync (bool): Whether to fsync every append; without it the journal survives the crash of any process, but
+        not of the machine.
+        enabled (bool): Whether to journal at all; when disabled batches are only queued.
+    """
+
+    RECORD = "JOURNALED" # table name of queued journal records, which carry (stream, sequence, rows)
+    CLOSED = "CLOSED" # table name of queued items closing the stream they carry, of a process that exited
+    PREFIX = "journal-" # of the names of journal streams, to tell their checkpoints from those of other writers
+
+    def __init__(self, directory: str, segment_bytes: int = 67108864, sync: bool = False, enabled: bool = True) -> None:
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        self.enabled = enabled
+
+        self.run_id = "%s-%d-%d" % (gethostname(), getpid(), time())
+        self.sequence = Value("Q", 0)
+
+        self.pid = None # per process state, opened lazily after the fork
+        self.file = None
+
+        makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pid"] = None
+        state["file"] = None
+        return state
+
+    def stream(self, pid: int = None):
+        return "%s%s-%d" % (self.PREFIX, self.run_id, pid or getpid())
+
+    def next_sequence(self):
+        with self.sequence.get_lock():
+            self.sequence.value += 1
+            return self.sequence.value
+
+    def append(self, rows: list):
+        """
+        Appends a batch of rows to the stream of this process.
+
+        Returns:
+            tuple[str, int]: The stream and sequence number of the record.
+        """
+        sequence = self.next_sequence()
+
+        payload = dumps((sequence, rows), protocol=HIGHEST_PROTOCOL)
+
+        if self.pid != getpid() or self.file.tell() >= self.segment_bytes:
+            if self.file is not None and self.pid == getpid():
+                self.file.close()
+            self.pid = getpid()
+            self.file = open(path.join(self.directory, "%s.%020d%s" % (self.stream(), sequence, SUFFIX)), "ab")
+
+        self.file.write(len(payload).to_bytes(4, "little") + crc32(payload).to_bytes(4, "little") + payload)
+        self.file.flush()
+
+        if self.sync:
+            fsync(self.file.fileno())
+
+        return self.stream(), sequence
+
+    def reject(self, rows: list):
+        """
+        Keeps rows the database writer could not write, in a file of the records format named
+        <stream>.rejected, which is never replayed or deleted; its records can be read with read.
+        """
+        payload = dumps((time(), rows), protocol=HIGHEST_PROTOCOL)
+
+        with open(path.join(self.directory, self.stream() + REJECTED_SUFFIX), "ab") as file:
+            file.write(len(payload).to_bytes(4, "little") + crc32(payload).to_bytes(4, "little") + payload)
+
+    def put_many(self, write_queue, rows: list):
+        """
+        Journals a batch of (table name, row) items and queues it for the database writer as one item, so the writer
+        commits the batch and its checkpoint together.
+
+        Args:
+            write_queue (WorkQueue): The queue of the database writer.
+            rows (list[tuple[str, dict]]): The items.
+        """
+        if not rows:
+            return
+
+        if not self.enabled:
+            write_queue.put_many(rows)
+            return
+
+        stream, sequence = self.append(rows)
+
+        write_queue.put_many([(self.RECORD, (stream, sequence, rows))])
+
+    def close(self, write_queue, pid: int):
+        """
+        Closes the stream of a process that exited, queueing the close for the database writer behind every record
+        the process queued.
+
+        Args:
+            write_queue (WorkQueue): The queue of the database writer.
+            pid (int): The process.
+        """
+        if self.enabled:
+            write_queue.put_many([(self.CLOSED, self.stream(pid))])
+
+    def remove(self, stream: str, committed: int):
+        """
+        Deletes the segments of a closed stream, if its last record is committed. A process that crashed between
+        appending a record and queueing it leaves a record that is not, and the stream is kept to be recovered.
+
+        Args:
+            stream (str): The closed stream.
+            committed (int): The committed sequence number of the stream, 0 if none is.
+
+        Returns:
+            bool: Whether the stream was deleted.
+        """
+        segments = self.segments().get(stream, [])
+
+        if segments and max((sequence for sequence, _ in self.read(segments[-1][1])), default=0) > committed:
+            return False
+
+        for _, segment in segments:
+            remove(segment)
+
+        return True
+
+    def segments(self):
+        """
+        Gets the segment files in the directory.
+
+        Returns:
+            dict[str, list[tuple[int, str]]]: First sequence number and path of the segments of every stream, in order.
+        """
+        streams: dict[str, list[tuple[int, str]]] = {}
+
+        for name in listdir(self.directory):
+            if name.endswith(SUFFIX):
+                stream, first = name[:-len(SUFFIX)].rsplit(".", 1)
+                streams.setdefault(stream, []).append((int(first), path.join(self.directory, name)))
+
+        for segments in streams.values():
+            segments.sort()
+
+        return streams
+
+    @staticmethod
+    def read(segment: str):
+        """
+        Reads the records of a segment, stopping at a torn or corrupt tail.
+
+        Returns:
+            list[tuple[int, list]]: Sequence number and rows of every record.
+        """
+        records = []
+
+        with open(segment, "rb") as file:
+            data = file.read()
+
+        offset = 0
+
+        while offset + HEADER <= len(data):
+
+            size = int.from_bytes(data[offset:offset+4], "little")
+            checksum = int.from_bytes(data[offset+4:offset+HEADER], "little")
+            payload = data[offset+HEADER:offset+HEADER+size]
+
+            if len(payload) < size or crc32(payload) != checksum:
+                break
+
+            records.append(loads(payload))
+            offset += HEADER + size
+
+        return records
+
+    def truncate(self, checkpoints: dict[str, int]):
+        """
+        Deletes the segments whose records are all committed, given the committed sequence number of streams.
+        """
+        for stream, segments in self.segments().items():
+
+            if stream not in checkpoints:
+                continue
+
+            for (first, segment), (next_first, _) in zip(segments, segments[1:]):
+                if next_first <= checkpoints[stream]:
+                    remove(segment)
+
+    def recover(self, writer, checkpoints: dict[str, int], batch_size: int = 1000):
+        """
+        Replays the records of earlier runs that are past the checkpoint of their stream, in sequence number order,
+        and deletes their segments. Afterwards the sequence numbers of this run continue from the highest seen.
+
+        Args:
+            writer (DatabaseWriter): Writer to apply the records with, with the hooks and resolvers of the crawl.
+            checkpoints (dict[str, int]): Committed sequence number of every stream.
+            batch_size (int): Number of rows applied per transaction.
+
+        Returns:
+            int: Number of rows replayed.
+        """
+        records = []
+        replayed = 0
+        highest = max(checkpoints.values(), default=0)
+
+        streams = {stream: segments for stream, segments in self.segments().items() if not stream.startswith(self.PREFIX + self.run_id)}
+
+        for stream, segments in streams.items():
+            for _, segment in segments:
+                for sequence, rows in self.read(segment):
+                    highest = max(highest, sequence)
+                    if sequence > checkpoints.get(stream, 0):
+                        records.append((sequence, stream, rows))
+
+        records.sort(key= lambda x: x[0]) # causally related records of different streams are applied in order
+
+        pending, committed, count = {name: [] for name in writer.tables}, {}, 0 # in the table order of the writer
+
+        for sequence, stream, rows in records:
+
+            for name, row in rows:
+                pending.setdefault(name, []).append(row)
+
+            committed[stream] = sequence
+            count += len(rows)
+
+            if count >= batch_size:
+                writer.flush(pending, committed)
+                replayed += count
+                pending, committed, count = {name: [] for name in writer.tables}, {}, 0
+
+        if count:
+            writer.flush(pending, committed)
+            replayed += count
+
+        for segments in streams.values():
+            for _, segment in segments:
+                remove(segment)
+
+        with self.sequence.get_lock():
+            self.sequence.value = max(self.sequence.value, highest)
+
+        return replayed
@@ -1,26 +1,124 @@
-from multiprocessing import Process
+import asyncio
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import Process, set_start_method, set_forkserver_preload
 from multiprocessing.managers import SyncManager
 
-from database import Database
+from database import Database, DATABASE_URL
+from config import get_config
 import utils
 from models import Models
-from exceptions import WebpageError, HyperlinksScrapeError, ContentScrapeError
-from time import time
-from os import getenv
-from dotenv import load_dotenv
-
-load_dotenv(dotenv_path="config.env")
-WIKI_SEED_URL = getenv("WIKI_SEED_URL")
-RATELIMITS = [int(i) for i in getenv("RATELIMITS").split(",")]
-HYPERLINK_BUFFER_SIZE = int(getenv("HYPERLINK_BUFFER_SIZE"))
-CONTENT_BUFFER_SIZE = int(getenv("CONTENT_BUFFER_SIZE"))
-OVERSEER_FREQUENCY = float(getenv("OVERSEER_FREQUENCY"))
-PROCESS_FREQUENCY = float(getenv("PROCESS_FREQUENCY"))
-NUM_SCRAPER_PROCESS = int(getenv("NUM_SCRAPER_PROCESSES"))
+from exceptions import HyperlinksScrapeError, ContentScrapeError
+from ratelimit import RateLimiter
+from seen import SeenFilter
+from workqueue import WorkQueue
+from writer import DatabaseWriter
+from workitem import HyperlinkItem
+from storage import ContentStore
+from search import SearchIndex
+from graph import LinkGraph
+from journal import Journal
+from metrics import Metrics
+from autoscale import Autoscaler, RETIRE
+from dedup import DuplicateIndex, simhash, to_signed
+from retry import RetryScheduler, DelayQueue, classify, dead_letter_row, PARSE
+from htmlcache import HtmlCache
+from frontier import Frontier, CountMinSketch, SizeScorer, PopularityScorer
+from urls import UrlDictionary, canonicalize_url, get_base
+from time import time, monotonic, sleep
+from os import getpid
+from socket import gethostname
+from sqlalchemy import exists, func, insert, select, update
+
+CONFIG = get_config()
+DATABASE_URL = CONFIG.string("DATABASE_URL", DATABASE_URL)
+DATABASE_POOL_SIZE = CONFIG.integer("DATABASE_POOL_SIZE", 5)
+DATABASE_MAX_OVERFLOW = CONFIG.integer("DATABASE_MAX_OVERFLOW", 10)
+START_METHOD = CONFIG.choice("START_METHOD", "forkserver")
+WIKI_SEED_URL = CONFIG.string("WIKI_SEED_URL")
+RATELIMITS = CONFIG.integers("RATELIMITS")
+HYPERLINK_BUFFER_SIZE = CONFIG.integer("HYPERLINK_BUFFER_SIZE")
+CONTENT_STORAGE = CONFIG.choice("CONTENT_STORAGE", "plain")
+CONTENT_CODEC = CONFIG.choice("CONTENT_CODEC", "zlib")
+CONTENT_COMPRESSION_LEVEL = CONFIG.integer("CONTENT_COMPRESSION_LEVEL", 6)
+SEARCH_INDEX_ENABLED = CONFIG.flag("SEARCH_INDEX")
+LINK_GRAPH_ENABLED = CONFIG.flag("LINK_GRAPH")
+WRITER_FLUSH_ROWS = CONFIG.integer("WRITER_FLUSH_ROWS", 1000)
+WRITER_FLUSH_SECONDS = CONFIG.number("WRITER_FLUSH_SECONDS", 2)
+WRITER_FLUSH_ATTEMPTS = CONFIG.integer("WRITER_FLUSH_ATTEMPTS", 3)
+JOURNAL_ENABLED = CONFIG.flag("JOURNAL", True)
+JOURNAL_DIRECTORY = CONFIG.string("JOURNAL_DIRECTORY", "data/journal")
+JOURNAL_SEGMENT_BYTES = CONFIG.integer("JOURNAL_SEGMENT_BYTES", 67108864)
+JOURNAL_FSYNC = CONFIG.flag("JOURNAL_FSYNC")
+METRICS_PORT = CONFIG.integer("METRICS_PORT", 0)
+METRICS_SLOTS = CONFIG.integer("METRICS_SLOTS", 256)
+METRICS_SNAPSHOT = CONFIG.string("METRICS_SNAPSHOT", "")
+METRICS_SNAPSHOT_SECONDS = CONFIG.number("METRICS_SNAPSHOT_SECONDS", 30)
+OVERSEER_FREQUENCY = CONFIG.number("OVERSEER_FREQUENCY")
+NUM_SCRAPER_PROCESS = CONFIG.integer("NUM_SCRAPER_PROCESSES")
+AUTOSCALE = CONFIG.flag("AUTOSCALE", True)
+MIN_WORKER_PROCESSES = CONFIG.integer("MIN_WORKER_PROCESSES", 1)
+MAX_WORKER_PROCESSES = CONFIG.integer("MAX_WORKER_PROCESSES", 32)
+AUTOSCALE_SECONDS = CONFIG.number("AUTOSCALE_SECONDS", 5)
+FRONTIER_BATCH_SIZE = CONFIG.integer("FRONTIER_BATCH_SIZE", 10)
+FRONTIER_LEASE_SECONDS = CONFIG.number("FRONTIER_LEASE_SECONDS", 600)
+FRONTIER_SCORER = CONFIG.choice("FRONTIER_SCORER", "popularity")
+FRONTIER_HEAP_SIZE = CONFIG.integer("FRONTIER_HEAP_SIZE", 100000)
+FRONTIER_SKETCH_WIDTH = CONFIG.integer("FRONTIER_SKETCH_WIDTH", 1048576)
+FRONTIER_SKETCH_DEPTH = CONFIG.integer("FRONTIER_SKETCH_DEPTH", 4)
+FRONTIER_IN_DEGREE_WEIGHT = CONFIG.number("FRONTIER_IN_DEGREE_WEIGHT", 1.0)
+FRONTIER_DEPTH_WEIGHT = CONFIG.number("FRONTIER_DEPTH_WEIGHT", 0.5)
+FRONTIER_AGE_WEIGHT = CONFIG.number("FRONTIER_AGE_WEIGHT", 0.1)
+RECRAWL = CONFIG.flag("RECRAWL")
+REFRESH_MIN_SECONDS = CONFIG.number("REFRESH_MIN_SECONDS", 86400)
+REFRESH_MAX_SECONDS = CONFIG.number("REFRESH_MAX_SECONDS", 2592000)
+FETCH_MODE = CONFIG.choice("FETCH_MODE", "sync")
+NUM_EVENT_LOOPS = CONFIG.integer("NUM_EVENT_LOOPS", 1)
+ASYNC_CONCURRENCY = CONFIG.integer("ASYNC_CONCURRENCY", 100)
+CONNECTION_POOL_SIZE = CONFIG.integer("CONNECTION_POOL_SIZE", 10)
+WORK_QUEUE_BYTES = CONFIG.integer("WORK_QUEUE_BYTES", 16777216)
+SEEN_FILTER_CAPACITY = CONFIG.integer("SEEN_FILTER_CAPACITY", 10000000)
+SEEN_FILTER_ERROR_RATE = CONFIG.number("SEEN_FILTER_ERROR_RATE", 0.001)
+DUPLICATE_DETECTION = CONFIG.flag("DUPLICATE_DETECTION")
+DUPLICATE_INDEX_CAPACITY = CONFIG.integer("DUPLICATE_INDEX_CAPACITY", 1000000)
+DUPLICATE_DISTANCE = CONFIG.integer("DUPLICATE_DISTANCE", 3)
+RETRY_MAX_ATTEMPTS = CONFIG.integer("RETRY_MAX_ATTEMPTS", 5)
+RETRY_PARSE_ATTEMPTS = CONFIG.integer("RETRY_PARSE_ATTEMPTS", 2)
+RETRY_BASE_SECONDS = CONFIG.number("RETRY_BASE_SECONDS", 10)
+RETRY_MAX_SECONDS = CONFIG.number("RETRY_MAX_SECONDS", 3600)
+RETRY_HOLD_SECONDS = CONFIG.number("RETRY_HOLD_SECONDS", 120)
+HTML_CACHE_ENABLED = CONFIG.flag("HTML_CACHE")
+HTML_CACHE_DIRECTORY = CONFIG.string("HTML_CACHE_DIRECTORY", "data/html")
+HTML_CACHE_CODEC = CONFIG.choice("HTML_CACHE_CODEC", "zlib")
+HTML_CACHE_LEVEL = CONFIG.integer("HTML_CACHE_LEVEL", 6)
+HTML_CACHE_PACK_BYTES = CONFIG.integer("HTML_CACHE_PACK_BYTES", 1073741824)
+RETRY_OWNER = "retry" # lease owner of the hyperlinks waiting in the database for a retry
+
+
+DATABASE = Database(DATABASE_URL, DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW) # connects on first use, tables are created by the commands that write
+
+CONTENT_STORE = ContentStore(DATABASE, CONTENT_STORAGE, CONTENT_CODEC, CONTENT_COMPRESSION_LEVEL)
+
+SEARCH_INDEX = SearchIndex(DATABASE)
+
+HTML_CACHE = HtmlCache(HTML_CACHE_DIRECTORY, HTML_CACHE_CODEC, HTML_CACHE_LEVEL, HTML_CACHE_PACK_BYTES, HTML_CACHE_ENABLED)
+
+# size ranks by the size of the parent page, as the crawl did before scoring
+SCORER = PopularityScorer(FRONTIER_IN_DEGREE_WEIGHT, FRONTIER_DEPTH_WEIGHT, FRONTIER_AGE_WEIGHT) if FRONTIER_SCORER == "popularity" else SizeScorer()
+
+RETRY_SCHEDULER = RetryScheduler(RETRY_MAX_ATTEMPTS, RETRY_PARSE_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS)
+
+
+def create_tables():
 
+    """
+    Creates the tables, and the search index if it is enabled, or brings them up to date. Run by the commands that
+    write to the database rather than on import, so importing the crawler opens no database.
+    """
+    DATABASE.createTables()
 
-DATABASE = Database()
-DATABASE.createTables()
+    if SEARCH_INDEX_ENABLED:
+        SEARCH_INDEX.create()
 
 
 
@@ -29,260 +127,941 @@ def insert_seed_url():
     """
     Inserts the seed URL into the Database to initiate scraping.
     """
-    seed_hyperlink = Models.Hyperlink(
-        HYPERLINK=WIKI_SEED_URL,
+    seed_url = canonicalize_url(WIKI_SEED_URL, get_base(WIKI_SEED_URL))
+
+    seed_hyperlink = HyperlinkItem(
+        HYPERLINK=seed_url,
         ATTEMPTS=0,
         HYPERLINKS_SCRAPED=False,
         CONTENT_SCRAPED=False,
         PARENT_HYPERLINK=None,
         PARENT_PRIORITY=0,
-        TIMESTAMP=time()
+        TIMESTAMP=time(),
+        DEPTH=0
     )
 
+    seed_hyperlink.SCORE = SCORER.score(seed_hyperlink, 0)
+
+    with DATABASE.ENGINE.begin() as connection:
+
+        seed_hyperlink.URL_ID = UrlDictionary().intern(connection, [seed_url])[seed_url]
+
+        connection.execute(insert(Models.Hyperlink.__table__), [seed_hyperlink.row()])
+
+
+def search_database_for_hyperlinks(hyperlinks: list[str]):
+    
+    """
+    Checks which of the given hyperlinks already exist in the database, in one query per 500 hyperlinks, looked up
+    through the unique index of the URL dictionary.
+
+    Args:
+        hyperlinks (list[str]): The hyperlinks to search for.
+
+    Returns:
+        set[str]: The hyperlinks that exist.
+    """
+    found = set()
+
     with DATABASE.createSession() as session:
 
-        session.add(seed_hyperlink)
+        for i in range(0, len(hyperlinks), 500):
 
-        session.commit()
+            rows = session.query(DATABASE.MODELS.Url.URL).join(
+                DATABASE.MODELS.Hyperlink, DATABASE.MODELS.Hyperlink.URL_ID == DATABASE.MODELS.Url.ID
+            ).filter(
+                DATABASE.MODELS.Url.URL.in_(hyperlinks[i:i+500])
+            ).all()
+
+            found.update(row[0] for row in rows)
+
+    return found
+
+def warm_seen_filter(seen_filter: SeenFilter):
+    
+    """
+    Adds every hyperlink in the database to the seen filter.
+
+    Args:
+        seen_filter (SeenFilter): The filter to warm.
+    """
+    with DATABASE.createSession() as session:
 
+        batch = []
 
-def search_database_for_hyperlink(hyperlink: str):
+        for row in session.query(DATABASE.MODELS.Hyperlink.HYPERLINK).yield_per(10000):
+
+            batch.append(row[0])
+
+            if len(batch) >= 10000:
+                seen_filter.add_many(batch)
+                batch = []
+
+        seen_filter.add_many(batch)
+
+def search_database_for_scraped(hyperlink: str):
     
     """
-    Checks if a given hyperlink already exists in the database.
+    Checks if the page of a given hyperlink is already scraped.
 
     Args:
         hyperlink (str): The hyperlink to search for.
 
     Returns:
-        bool: True if the hyperlink exists, False otherwise.
+        bool: True if its content is scraped, False otherwise.
     """
     with DATABASE.createSession() as session:
 
-        exists = session.query(DATABASE.MODELS.Hyperlink).filter(
-            DATABASE.MODELS.Hyperlink.HYPERLINK == hyperlink
+        exists = session.query(DATABASE.MODELS.Url.ID).join(
+            DATABASE.MODELS.Hyperlink, DATABASE.MODELS.Hyperlink.URL_ID == DATABASE.MODELS.Url.ID
+        ).filter(
+            DATABASE.MODELS.Url.URL == hyperlink,
+            DATABASE.MODELS.Hyperlink.CONTENT_SCRAPED == True
         ).first()
 
         return exists is not None
 
-def add_page_to_pages(pages: list[Models.Page]):
+def search_database_for_fingerprint(hyperlink: str):
+    
     """
-    Bulk inserts a list of Page models into the database.
+    Gets the SimHash fingerprint of the page stored under a given hyperlink.
 
     Args:
-        pages (List[Models.Page]): List of Page objects to insert.
+        hyperlink (str): The hyperlink of the page.
+
+    Returns:
+        int: The unsigned fingerprint, None if no page with one is stored.
     """
     with DATABASE.createSession() as session:
 
-        session.bulk_save_objects(pages)
+        row = session.query(DATABASE.MODELS.Page.SIMHASH).join(
+            DATABASE.MODELS.Url, DATABASE.MODELS.Url.ID == DATABASE.MODELS.Page.URL_ID
+        ).filter(
+            DATABASE.MODELS.Url.URL == hyperlink
+        ).first()
 
-        session.commit()
+        return row[0] % (1 << 64) if row is not None and row[0] is not None else None # stored signed
 
-def load_hyperlink_from_hyperlinks(n: int):
+def warm_duplicate_index(duplicate_index: DuplicateIndex):
+    
     """
-    Retrieves a list of uns scraped hyperlinks from the database.
+    Adds the SimHash fingerprint of every page in the database to the duplicate index.
 
     Args:
-        n (int): Number of hyperlinks to retrieve.
+        duplicate_index (DuplicateIndex): The index to warm.
+    """
+    with DATABASE.createSession() as session:
+
+        query = session.query(DATABASE.MODELS.Page.SIMHASH).filter(DATABASE.MODELS.Page.SIMHASH != None)
+
+        for row in query.yield_per(10000):
+            duplicate_index.add(row[0] % (1 << 64)) # stored signed
+
+def filter_new_hyperlinks(hyperlinks: list[str], seen_filter: SeenFilter, database_hits: int, buffer_hits: int):
+    
+    """
+    Filters a batch of hyperlinks down to the ones that have not been come across before, marking them as seen.
+    Only the hyperlinks the seen filter may have seen are confirmed against the database, in a single batch. One the
+    database does not confirm is either on its way to the database writer or a false positive of the filter, and is
+    returned apart: it is written as a discovery, which the writer drops if its row is there by then, and left to be
+    claimed from the database, so a false positive is still crawled and one in flight is not crawled twice.
+
+    Args:
+        hyperlinks (list[str]): The hyperlinks to filter.
+        seen_filter (SeenFilter): The shared seen filter.
+        database_hits (int): metric for matches of hyperlink in database
+        buffer_hits (int): metric for matches of hyperlink in buffer (seen, but not in the database yet)
 
     Returns:
-        List[Models.Hyperlink]: List of Hyperlink objects.
+        tuple[list[str], list[str]]: The new hyperlinks, and those the database did not confirm as seen.
     """
-    with DATABASE.createSession() as session:
+    hyperlinks = list(hyperlinks)
 
-        query = session.query(DATABASE.MODELS.Hyperlink).filter(
-            (DATABASE.MODELS.Hyperlink.HYPERLINKS_SCRAPED == False) |
-            (DATABASE.MODELS.Hyperlink.CONTENT_SCRAPED == False)
-        )
+    present = seen_filter.add_many(hyperlinks)
+
+    maybe_seen = [link for link, seen in zip(hyperlinks, present) if seen]
+
+    in_database = set()
+
+    if maybe_seen:
+
+        in_database = search_database_for_hyperlinks(maybe_seen)
+
+        database_hits.value += len(in_database)
+
+        buffer_hits.value += len(maybe_seen) - len(in_database)
+
+    return [link for link, seen in zip(hyperlinks, present) if not seen], [link for link in maybe_seen if link not in in_database]
+
+def claim_hyperlinks_from_hyperlinks(n: int, owner: str):
+    """
+    Claims the n unscraped hyperlinks of highest score from the database, leasing them to owner for
+    FRONTIER_LEASE_SECONDS. Rows stay in the table; a lease that is not released in time expires and the rows
+    become claimable again. Each flag combination is read with an indexed ORDER BY ... LIMIT, so the cost does not
+    grow with the table. On PostgreSQL the rows are locked with FOR UPDATE SKIP LOCKED until their lease is written,
+    so overseers claiming at once skip each other's rows instead of waiting on them. With RECRAWL, scraped pages
+    that are due for a refresh are claimed first, the most overdue first, and pages scraped before refreshes were
+    scheduled count as due.
+
+    Args:
+        n (int): Number of hyperlinks to claim.
+        owner (str): Identifier of the claiming process.
+
+    Returns:
+        List[HyperlinkItem]: The hyperlinks, due refreshes first, then highest score first.
+    """
+    Hyperlink = DATABASE.MODELS.Hyperlink.__table__
+    DeadLetter = DATABASE.MODELS.DeadLetter.__table__
+
+    now = time()
+
+    with DATABASE.ENGINE.begin() as connection:
+
+        alive = ~exists().where(DeadLetter.c.URL_ID == Hyperlink.c.URL_ID) # not dead-lettered
+
+        unleased = (Hyperlink.c.LEASE_EXPIRES == None) | (Hyperlink.c.LEASE_EXPIRES < now)
+
+        due = []
+
+        if RECRAWL:
+
+            for refresh in (Hyperlink.c.NEXT_REFRESH == None, Hyperlink.c.NEXT_REFRESH <= now):
+
+                due += connection.execute(select(Hyperlink).where(
+                    Hyperlink.c.CONTENT_SCRAPED == True,
+                    refresh,
+                    unleased,
+                    alive
+                ).order_by(Hyperlink.c.NEXT_REFRESH).limit(n - len(due)).with_for_update(of=Hyperlink, skip_locked=True)).all()
+
+        candidates = []
+
+        for hyperlinks_scraped in (False, True): # CONTENT_SCRAPED implies HYPERLINKS_SCRAPED
+
+            candidates += connection.execute(select(Hyperlink).where(
+                Hyperlink.c.CONTENT_SCRAPED == False,
+                Hyperlink.c.HYPERLINKS_SCRAPED == hyperlinks_scraped,
+                unleased,
+                alive
+            ).order_by(Hyperlink.c.SCORE.desc()).limit(n).with_for_update(of=Hyperlink, skip_locked=True)).all()
+
+        claimed = [HyperlinkItem.from_row(row) for row in due + sorted(candidates, key= lambda x: x.SCORE or 0, reverse=True)[:n - len(due)]]
+
+        if claimed:
+
+            connection.execute(update(Hyperlink).where(
+                Hyperlink.c.ID.in_([i.ID for i in claimed])
+            ).values(LEASE_OWNER=owner, LEASE_EXPIRES=now + FRONTIER_LEASE_SECONDS))
+
+        for i in claimed:
+            i.LEASE_OWNER = owner
+            i.LEASE_EXPIRES = now + FRONTIER_LEASE_SECONDS
+
+        return claimed
+
+def hyperlink_row(hyperlink: HyperlinkItem):
+    """
+    Converts a hyperlink to an item for the database writer, which updates it, or inserts it if it is not in the
+    database yet. The parent hyperlink is passed on to be interned, not written as a string.
+
+    Args:
+        hyperlink (HyperlinkItem): The hyperlink.
 
-        hyperlinks = query.all()
+    Returns:
+        tuple[str, dict]: Table name and row.
+    """
+    row = hyperlink.row()
+
+    row["_PARENT"] = row.pop("PARENT_HYPERLINK")
+    row["_CANONICAL"] = hyperlink._CANONICAL # set by scrape_page on aliases
+    row["_DUPLICATE_OF"] = hyperlink._DUPLICATE_OF
+
+    return (Models.Hyperlink.__tablename__, row)
+
+def discovery_row(hyperlink: HyperlinkItem):
+    """
+    Converts a hyperlink found on a page to an item for the database writer, which inserts it unless its URL has a
+    row already, so finding a hyperlink again never resets the state of its crawl.
+
+    Args:
+        hyperlink (HyperlinkItem): The hyperlink found.
+
+    Returns:
+        tuple[str, dict]: Table name and row.
+    """
+    name, row = hyperlink_row(hyperlink)
+
+    row["_DISCOVERED"] = True
+
+    return (name, row)
+
+def scraped_row(hyperlink: str, priority: int, timestamp: float):
+    """
+    Gets an item for the database writer marking the hyperlink of a page scraped through another hyperlink, or read
+    from elsewhere, as scraped so the crawl does not fetch it. Only the columns known are given, so the upsert leaves
+    the validators of a crawled hyperlink alone.
+
+    Args:
+        hyperlink (str): The hyperlink of the page.
+        priority (int): Size of the page.
+        timestamp (float): Time the page was scraped.
+
+    Returns:
+        tuple[str, dict]: Table name and row.
+    """
+    return (Models.Hyperlink.__tablename__, {
+        "HYPERLINK": hyperlink,
+        "_PARENT": None,
+        "ATTEMPTS": 0,
+        "HYPERLINKS_SCRAPED": True,
+        "CONTENT_SCRAPED": True,
+        "PARENT_PRIORITY": priority,
+        "TIMESTAMP": timestamp,
+    })
+
+def release_row(hyperlink: HyperlinkItem):
+    """
+    Releases the lease of a hyperlink and converts it to an item for the database writer.
 
-        temp = sorted(hyperlinks[0:n+1], key= lambda x: x.PARENT_PRIORITY, reverse=True)
+    Args:
+        hyperlink (HyperlinkItem): The hyperlink to release.
+
+    Returns:
+        tuple[str, dict]: Table name and row.
+    """
+    hyperlink.LEASE_OWNER = None
+    hyperlink.LEASE_EXPIRES = None
+
+    return hyperlink_row(hyperlink)
 
-        query.delete()
+def release_leases():
+    """
+    Releases every lease in the database. The crawl is the only one using the database, so when it starts every
+    lease left is one of an earlier run, whose hyperlinks need not wait for their lease to expire. Hyperlinks waiting
+    for a retry keep theirs, which expires when they are due.
+
+    Returns:
+        int: Number of leases released.
+    """
+    Hyperlink = DATABASE.MODELS.Hyperlink
+
+    with DATABASE.createSession() as session:
+
+        released = session.query(Hyperlink).filter(
+            Hyperlink.LEASE_OWNER != None,
+            Hyperlink.LEASE_OWNER != RETRY_OWNER
+        ).update({Hyperlink.LEASE_OWNER: None, Hyperlink.LEASE_EXPIRES: None}, synchronize_session=False)
 
         session.commit()
 
-        return temp
+        return released
 
-def add_hyperlink_to_hyperlinks(hyperlinks: list[Models.Hyperlink]):
+def recover_crawl(journal: Journal):
     """
-    Bulk inserts a list of Hyperlink models into the database.
+    Brings the database up to date with the journal of an earlier run that did not stop cleanly, then releases its
+    leases, so the crawl continues where it stopped.
 
     Args:
-        hyperlinks (List[Models.Hyperlink]): List of Hyperlink objects to insert.
+        journal (Journal): The journal of this run.
     """
+    Checkpoint = DATABASE.MODELS.Checkpoint
+
     with DATABASE.createSession() as session:
+        checkpoints = dict(session.query(Checkpoint.STREAM, Checkpoint.SEQUENCE).all())
 
-        session.bulk_save_objects(hyperlinks)
-        
+    replayed = journal.recover(create_writer(None, journal), checkpoints, WRITER_FLUSH_ROWS)
+
+    with DATABASE.createSession() as session:
+        session.query(Checkpoint).filter(Checkpoint.STREAM.startswith(Journal.PREFIX)).delete(synchronize_session=False) # the streams of earlier runs are gone
         session.commit()
 
-def process(rate_limits: list[int], last_refreshed_rate_limits: list[float], content_buffer: list, hyperlink_buffer: list, scraped_count: int, average_hyperlinks_per_page: float, database_hits: int, buffer_hits: int):
+    released = release_leases()
+
+    print("%d journaled rows replayed, %d leases released." % (replayed, released))
+
+def schedule_retry(hyperlink: HyperlinkItem, error: Exception, write_queue: WorkQueue, journal: Journal, retry_queue: WorkQueue, metrics: Metrics):
+    """
+    Schedules a hyperlink that failed to be fetched or scraped to be tried again, after the delay RETRY_SCHEDULER
+    gives for its failure, or dead-letters it. A retry due within RETRY_HOLD_SECONDS, and within the lease of the
+    hyperlink, waits in the delay queue of the overseer; a later one waits in the database, under a lease that
+    expires when it is due. Either way it does not hold up the work behind it.
+
+    Args:
+        hyperlink (HyperlinkItem): The hyperlink that failed.
+        error (Exception): The exception it failed with.
+        write_queue (WorkQueue): queue of rows for the database writer
+        journal (Journal): journal of the rows sent to the database writer
+        retry_queue (WorkQueue): queue of (due time, hyperlink) items for the delay queue of the overseer
+        metrics (Metrics): shared latency histograms and counters
+    """
+    failure = classify(error)
+
+    hyperlink.ATTEMPTS = (hyperlink.ATTEMPTS or 0) + 1
+
+    print(hyperlink.HYPERLINK, failure.upper(), "ERROR", str(error))
+
+    if failure != PARSE: # counted by scrape_page
+        metrics.increment("fetch_errors")
+
+    delay = RETRY_SCHEDULER.delay(failure, hyperlink.ATTEMPTS, getattr(error, "retry_after", None))
+
+    if delay is None:
+        journal.put_many(write_queue, [dead_letter_row(hyperlink, failure, error), release_row(hyperlink)])
+        metrics.increment("dead_letters")
+        return
+
+    due = time() + delay
+
+    metrics.increment("retries_scheduled")
+
+    if delay <= RETRY_HOLD_SECONDS and hyperlink.LEASE_EXPIRES is not None and due < hyperlink.LEASE_EXPIRES:
+
+        retry_queue.put_many([(due, hyperlink)])
+
+    else:
+
+        hyperlink.LEASE_OWNER = RETRY_OWNER
+        hyperlink.LEASE_EXPIRES = due
+
+        journal.put_many(write_queue, [hyperlink_row(hyperlink)])
+
+def pop_hyperlink(hyperlink_buffer: WorkQueue, timeout: float = None):
+    """
+    Pops the next hyperlink to be scraped from hyperlink_buffer, blocking until one arrives.
+
+    Args:
+        hyperlink_buffer (WorkQueue): buffer of scraped hyperlinks that are to be scraped
+        timeout (float): seconds to wait for a hyperlink, None to wait indefinitely
+
+    Returns:
+        HyperlinkItem: The hyperlink to scrape, RETIRE if the worker is to exit, or None if none arrived in time.
+    """
+    hyperlinks = hyperlink_buffer.get_many(1, timeout=timeout)
+
+    return hyperlinks[0] if hyperlinks else None
+
+def validators(hyperlink: HyperlinkItem):
+    """
+    Gets the validators to fetch a hyperlink conditionally with, only for pages that are completely scraped.
+
+    Returns:
+        tuple[str, str]: The ETag and Last-Modified of the last fetch, or None.
+    """
+    if hyperlink.HYPERLINKS_SCRAPED and hyperlink.CONTENT_SCRAPED:
+        return hyperlink.ETAG, hyperlink.LAST_MODIFIED
+    return None, None
+
+def revisit(hyperlink: HyperlinkItem, fetched: utils.Fetched, metrics: Metrics):
+    """
+    Records the validators and body hash of a fetch and schedules the next refresh of the hyperlink, after the mean
+    time between the changes seen since it was found, clamped to REFRESH_MIN_SECONDS and REFRESH_MAX_SECONDS. A
+    refreshed page that changed is marked unscraped, to be extracted again.
+
+    Args:
+        hyperlink (HyperlinkItem): The fetched hyperlink.
+        fetched (utils.Fetched): The result of the fetch.
+        metrics (Metrics): Shared latency histograms and counters.
+
+    Returns:
+        bool: Whether the page has to be scraped, False if it did not change since it was scraped.
+    """
+    now = time()
+
+    refreshed = hyperlink.HYPERLINKS_SCRAPED and hyperlink.CONTENT_SCRAPED
+
+    changed = fetched.status != 304
+
+    if changed:
+        body_hash = utils.body_hash(fetched.content)
+        changed = body_hash != hyperlink.BODY_HASH
+        hyperlink.BODY_HASH = body_hash
+
+    hyperlink.ETAG = fetched.etag
+    hyperlink.LAST_MODIFIED = fetched.last_modified
+    hyperlink.FETCHED = now
+
+    if refreshed:
+
+        hyperlink.CHECKS = (hyperlink.CHECKS or 0) + 1
+
+        if changed:
+            hyperlink.CHANGES = (hyperlink.CHANGES or 0) + 1
+            hyperlink.HYPERLINKS_SCRAPED = False
+            hyperlink.CONTENT_SCRAPED = False
+
+    interval = (now - (hyperlink.TIMESTAMP or now)) / ((hyperlink.CHANGES or 0) + 1)
+
+    hyperlink.NEXT_REFRESH = now + min(max(interval, REFRESH_MIN_SECONDS), REFRESH_MAX_SECONDS)
+
+    metrics.increment("pages_fetched")
+
+    if fetched.status == 304:
+        metrics.increment("pages_not_modified")
+    elif refreshed and not changed:
+        metrics.increment("pages_unchanged")
+
+    return changed or not refreshed
+
+def scrape_page(hyperlink: HyperlinkItem, fetched: utils.Fetched, write_queue: WorkQueue, journal: Journal, frontier_queue: WorkQueue, scraped_count: int, average_hyperlinks_per_page: float, database_hits: int, buffer_hits: int, seen_filter: SeenFilter, duplicate_index: DuplicateIndex, metrics: Metrics):
+    """
+    Scrapes the fetched bytes of a hyperlink, first for child hyperlinks, then for content. Updates HYPERLINKS_SCRAPED 
+    and CONTENT_SCRAPED on the hyperlink.
+
+    A hyperlink whose canonical link or redirect leads to another URL is an alias: the page is stored under the
+    canonical URL, and not parsed at all if that is scraped already. With a duplicate index, a page whose content is a
+    near-duplicate of a scraped page is not stored, and its hyperlink becomes an alias of that page. With HTML_CACHE,
+    the raw HTML of the page is kept before it is parsed, to be extracted again without fetching it.
+
+    Args:
+        hyperlink (HyperlinkItem): the hyperlink the bytes were fetched from
+        fetched (utils.Fetched): the response, with the HTML content of the page in bytes
+        write_queue (WorkQueue): queue of rows for the database writer
+        journal (Journal): journal of the rows sent to the database writer
+        frontier_queue (WorkQueue): queue of the hyperlinks of scraped pages for the frontier of the overseer
+        scraped_count (int): total hyperlinks processed so far
+        average_hyperlinks_per_page (float): metric
+        database_hits (int): metric for matches of hyperlink in database
+        buffer_hits (int): metric for matches of hyperlink in buffer
+        seen_filter (SeenFilter): shared filter of hyperlinks already come across
+        duplicate_index (DuplicateIndex): shared SimHash index of the pages scraped, None without duplicate detection
+        metrics (Metrics): shared latency histograms and counters
+
+    Raises:
+        HyperlinksScrapeError: If the page could not be parsed or its hyperlinks not be scraped.
+        ContentScrapeError: If the content of the page could not be scraped.
+    """
+    data = fetched.content
+
+    url = utils.page_url(hyperlink.HYPERLINK, fetched.url, utils.canonical_link(data))
+
+    if url != hyperlink.HYPERLINK:
+
+        hyperlink._CANONICAL = url # passed on to the database writer by hyperlink_row
+
+        metrics.increment("pages_aliased")
+
+        if search_database_for_scraped(url): # the page is stored under its canonical URL already
+
+            hyperlink.HYPERLINKS_SCRAPED = True
+            hyperlink.CONTENT_SCRAPED = True
+            return
+
+    if HTML_CACHE.enabled:
+
+        cached = HTML_CACHE.put(data)
+
+        hyperlink.HTML_HASH = cached[1]["HASH"]
+
+        journal.put_many(write_queue, [cached])
+
+    try:
+        with metrics.timer("parse"):
+            page_hyperlinks, heading, content = utils.extract_page(data) # single parse for links and content
+
+        if not hyperlink.HYPERLINKS_SCRAPED:
+            
+            with metrics.timer("hyperlinks"):
+                out_links = utils.screen_hyperlinks(url, page_hyperlinks)
+
+            metrics.increment("hyperlinks_found", len(out_links))
+
+            average_hyperlinks_per_page.value =average_hyperlinks_per_page.value*0.1 + 0.9*len(out_links)
+
+            rows = [LinkGraph.edges_row(url, out_links)] if LINK_GRAPH_ENABLED else [] # every edge, not only new targets
+
+            new_hyperlinks = []
+
+            with metrics.timer("seen_check"):
+                fresh_links, unconfirmed_links = filter_new_hyperlinks(out_links, seen_filter, database_hits, buffer_hits)
+
+            metrics.increment("hyperlinks_new", len(fresh_links))
+
+            fresh, unconfirmed = set(fresh_links), []
+
+            for link in fresh_links + unconfirmed_links:
+
+                new_hyperlink = HyperlinkItem(
+                    PARENT_HYPERLINK=url,
+                    ATTEMPTS=0,
+                    HYPERLINKS_SCRAPED=False,
+                    CONTENT_SCRAPED=False,
+                    HYPERLINK=link,
+                    PARENT_PRIORITY=len(data),
+                    TIMESTAMP=time(),
+                    LEASE_OWNER=journal.run_id,
+                    LEASE_EXPIRES=time() + FRONTIER_LEASE_SECONDS,
+                    DEPTH=(hyperlink.DEPTH or 0) + 1
+                )
+
+                new_hyperlink.SCORE = SCORER.score(new_hyperlink, 1) # rescored by the overseer as more links are seen
+
+                if link in fresh:
+                    new_hyperlinks.append(new_hyperlink)
+                else: # not leased, claimed from the database unless its row is there already
+                    new_hyperlink.LEASE_OWNER = None
+                    new_hyperlink.LEASE_EXPIRES = None
+                    unconfirmed.append(new_hyperlink)
+
+            # written leased before they are buffered, so a crash loses none of them and they are not claimed twice
+            journal.put_many(write_queue, rows + [discovery_row(i) for i in new_hyperlinks + unconfirmed])
+
+            # every link counts towards the in-degree of its target, new or not
+            frontier_queue.put_many([(out_links, new_hyperlinks)])
+
+            hyperlink.HYPERLINKS_SCRAPED = True #update in database
+            
+        if not hyperlink.CONTENT_SCRAPED:
+            try: # now content scraping -- add to content buffer
+            
+                if heading is None or content is None:
+                    raise ContentScrapeError()
+
+                fingerprint = None
+
+                if duplicate_index is not None:
+
+                    with metrics.timer("dedup"):
+                        fingerprint = simhash(content)
+                        own = search_database_for_fingerprint(url) if hyperlink.CHECKS else None # of the version a refresh replaces
+                        duplicate = duplicate_index.add(fingerprint, own)
+
+                    if duplicate is not None:
+
+                        hyperlink._DUPLICATE_OF = to_signed(duplicate) # resolved to the stored page by the writer
+                        hyperlink.HTML_HASH = None # not extracted again, over the page it duplicates
+                        hyperlink.CONTENT_SCRAPED = True
+
+                        metrics.increment("pages_duplicate")
+                        return
+                
+                with metrics.timer("content"):
+
+                    out = Models.Page()
+                    out.HYPERLINK = url
+                    out.TITLE = heading
+                    out.HEADING = heading
+                    out.CONTENT = content
+                    out.TIMESTAMP = time()
+                    out.SIMHASH = to_signed(fingerprint) if fingerprint is not None else None
+
+                    rows = CONTENT_STORE.page_rows(out) # compressed here, in parallel, when enabled
+
+                    if SEARCH_INDEX_ENABLED:
+                        for table, row in rows:
+                            if table == out.__tablename__:
+                                row["_SEARCH"] = SearchIndex.document(out.HYPERLINK, out.TITLE, out.CONTENT)
+
+                    if url != hyperlink.HYPERLINK: # the canonical URL is scraped with its alias, and not fetched again
+                        rows.append(scraped_row(url, len(data), out.TIMESTAMP))
+
+                    journal.put_many(write_queue, rows)
+
+                hyperlink.CONTENT_SCRAPED = True #update in database
+
+                scraped_count.value = scraped_count.value + 1
+
+                metrics.increment("pages_scraped")
+    
+            except ContentScrapeError:
+                metrics.increment("scrape_errors")
+                raise
+
+            except Exception as e:
+                metrics.increment("scrape_errors")
+                raise ContentScrapeError(str(e)) from e
+            
+    except ContentScrapeError:
+        raise
+
+    except Exception as e:
+        metrics.increment("scrape_errors")
+        raise HyperlinksScrapeError(str(e)) from e
+
+def process(rate_limiter: RateLimiter, write_queue: WorkQueue, journal: Journal, hyperlink_buffer: WorkQueue, scraped_count: int, average_hyperlinks_per_page: float, database_hits: int, buffer_hits: int, seen_filter: SeenFilter, duplicate_index: DuplicateIndex, retry_queue: WorkQueue, frontier_queue: WorkQueue, metrics: Metrics):
     """
     Scrapes the hyperlinks in hyperlink_buffer, first for child hyperlinks, then for content. Also updates HYPERLINKS_SCRAPED 
-    and CONTENT_SCRAPED columns in database.
+    and CONTENT_SCRAPED columns in database. Failed hyperlinks are retried later, or dead-lettered, by schedule_retry.
+    Returns when it pops RETIRE.
 
     Args:
-        rate_limits (list[int]): current rate limits for requests, per second, minute, and hour
-        last_refreshed_rate_limits (list[float]): timestamps when rate_limits were last refreshed, per second, minute, and hour
-        content_buffer (list): buffer of scraped content (to be flushed to database when CONTENT_BUFFER_SIZE reached)
-        hyperlink_buffer (list): buffer of scraped hyperlinks that are to be scraped (excess dumped when HYPERLINK_BUFFER_SIZE reached)
+        rate_limiter (RateLimiter): shared rate limits for requests, per second, minute, and hour
+        write_queue (WorkQueue): queue of rows for the database writer (flushed in batches of WRITER_FLUSH_ROWS)
+        journal (Journal): journal of the rows sent to the database writer
+        hyperlink_buffer (WorkQueue): buffer of scraped hyperlinks that are to be scraped (excess dumped when HYPERLINK_BUFFER_SIZE reached)
         scraped_count (int): total hyperlinks processed so far
         average_hyperlinks_per_page (float): metric
         database_hits (int): metric for matches of hyperlink in database
         buffer_hits (int): metric for matches of hyperlink in buffer
+        seen_filter (SeenFilter): shared filter of hyperlinks already come across
+        duplicate_index (DuplicateIndex): shared SimHash index of the pages scraped, None without duplicate detection
+        retry_queue (WorkQueue): queue of failed hyperlinks for the delay queue of the overseer
+        frontier_queue (WorkQueue): queue of the hyperlinks of scraped pages for the frontier of the overseer
+        metrics (Metrics): shared latency histograms and counters
     """    
 
-    while(utils.wait(PROCESS_FREQUENCY)):
+    while True:
+
+        hyperlink: HyperlinkItem = pop_hyperlink(hyperlink_buffer) # sleeps until work arrives
 
-        if len(hyperlink_buffer) > 0:
+        if hyperlink == RETIRE:
+            return
 
-            hyperlink: Models.Hyperlink = hyperlink_buffer.pop(0)
+        if hyperlink is not None:
 
             try:
                 
-                utils.makeBlockingCall(RATELIMITS, rate_limits, last_refreshed_rate_limits)
+                with metrics.timer("rate_limit"):
+                    rate_limiter.acquire()
                 
-                data = utils.get_bytes_from_page(hyperlink.HYPERLINK) 
-                try:
-                    if not hyperlink.HYPERLINKS_SCRAPED:
+                with metrics.timer("fetch"):
+                    fetched = utils.fetch_page(hyperlink.HYPERLINK, *validators(hyperlink))
+
+                if revisit(hyperlink, fetched, metrics): # unchanged pages are not parsed again
+
+                    scrape_page(hyperlink, fetched, write_queue, journal, frontier_queue, scraped_count, average_hyperlinks_per_page, database_hits, buffer_hits, seen_filter, duplicate_index, metrics)
                         
-                        out_links = utils.screen_hyperlinks(hyperlink.HYPERLINK, utils.get_hyperlinks_from_page(data))
+            except Exception as e:
+                schedule_retry(hyperlink, e, write_queue, journal, retry_queue, metrics)
+
+            else:
+                journal.put_many(write_queue, [release_row(hyperlink)]) # completed, update in database
+
+def async_process(rate_limiter: RateLimiter, write_queue: WorkQueue, journal: Journal, hyperlink_buffer: WorkQueue, scraped_count: int, average_hyperlinks_per_page: float, database_hits: int, buffer_hits: int, seen_filter: SeenFilter, duplicate_index: DuplicateIndex, retry_queue: WorkQueue, frontier_queue: WorkQueue, metrics: Metrics):
+    """
+    Async counterpart of process: runs one event loop with ASYNC_CONCURRENCY concurrent fetches over a shared
+    keep-alive connection pool. Arguments are the same as for process. Returns when it pops RETIRE, once the
+    hyperlinks it has already popped are done.
+    """
+    from fetcher import AsyncFetcher # imports aiohttp, which sync workers do without
 
-                        average_hyperlinks_per_page.value =average_hyperlinks_per_page.value*0.1 + 0.9*len(out_links)
+    async def dispatch_loop(pending: asyncio.Queue):
 
-                        new_hyperlinks = []
+        loop = asyncio.get_running_loop()
 
-                        for link in out_links:
+        while True:
 
-                            if not search_database_for_hyperlink(link):
+            # pop as many hyperlinks as there are idle fetchers in one call, sleeping until work arrives
+            hyperlinks = await loop.run_in_executor(None, hyperlink_buffer.get_many, max(1, pending.maxsize - pending.qsize()))
 
-                                new_hyperlink = Models.Hyperlink(
-                                    PARENT_HYPERLINK=hyperlink.HYPERLINK,
-                                    ATTEMPTS=0,
-                                    HYPERLINKS_SCRAPED=False,
-                                    CONTENT_SCRAPED=False,
-                                    HYPERLINK=link,
-                                    PARENT_PRIORITY=len(data),
-                                    TIMESTAMP=time()
-                                )
+            for index, i in enumerate(hyperlinks):
 
-                                new_hyperlinks.append(new_hyperlink)
+                if i == RETIRE:
+                    await loop.run_in_executor(None, hyperlink_buffer.put_many, hyperlinks[index + 1:]) # back to the other workers
+                    return
 
-                            else:
+                await pending.put(i)
 
-                                database_hits.value += 1
+    async def fetch_loop(fetcher: AsyncFetcher, pending: asyncio.Queue):
 
-                        if new_hyperlinks:
+        loop = asyncio.get_running_loop()
 
-                            for i in new_hyperlinks:
+        while True:
 
-                                hyperlink_buffer.insert(0, i)
+            hyperlink: HyperlinkItem = await pending.get()
 
-                        hyperlink.HYPERLINKS_SCRAPED = True #update in database
-                        
-                    if not hyperlink.CONTENT_SCRAPED:
-                        try: # now content scraping -- add to content buffer
-                        
-                            heading, content = utils.get_content_from_page(data)
-                            
-                            out = Models.Page()
-                            out.HYPERLINK = hyperlink.HYPERLINK
-                            out.TITLE = heading
-                            out.HEADING = heading
-                            out.CONTENT = content
-                            out.TIMESTAMP = time()
+            try:
 
-                            content_buffer.insert(0, out)
+                with metrics.timer("rate_limit"):
+                    await rate_limiter.acquire_async()
 
-                            hyperlink.CONTENT_SCRAPED = True #update in database
+                with metrics.timer("fetch"):
+                    fetched = await fetcher.fetch_page(hyperlink.HYPERLINK, *validators(hyperlink))
+
+                # parsing and database lookups are blocking, keep them off the event loop
+                if revisit(hyperlink, fetched, metrics): # unchanged pages are not parsed again
+
+                    await loop.run_in_executor(None, scrape_page, hyperlink, fetched, write_queue, journal, frontier_queue, scraped_count, average_hyperlinks_per_page, database_hits, buffer_hits, seen_filter, duplicate_index, metrics)
 
-                            scraped_count.value = scraped_count.value + 1
-                
-                        except Exception as e:
-                            print(hyperlink.HYPERLINK, "CONTENT ERROR" + str(e))
-                            hyperlink.ATTEMPTS += 1
-                        
-                except Exception as e:
-                    print(hyperlink.HYPERLINK, "HYPERLINKS ERROR" + str(e))
-                    hyperlink.ATTEMPTS += 1     
-                        
             except Exception as e:
-                print(hyperlink.HYPERLINK, "BYTES ERROR" + str(e))
-                hyperlink.ATTEMPTS += 1
+                await loop.run_in_executor(None, schedule_retry, hyperlink, e, write_queue, journal, retry_queue, metrics)
 
-            
-            hyperlink_buffer.append(hyperlink)
+            else:
+                await loop.run_in_executor(None, journal.put_many, write_queue, [release_row(hyperlink)]) # completed, update in database
+
+            pending.task_done()
+
+    async def run():
+
+        pending = asyncio.Queue(maxsize=ASYNC_CONCURRENCY)
+
+        async with AsyncFetcher(CONNECTION_POOL_SIZE) as fetcher:
+
+            fetchers = [asyncio.create_task(fetch_loop(fetcher, pending)) for _ in range(ASYNC_CONCURRENCY)]
+
+            await dispatch_loop(pending)
+
+            await pending.join() # the hyperlinks already popped are done before the worker exits
+
+            for task in fetchers:
+                task.cancel()
+
+    asyncio.run(run())
           
-def overseer(content_buffer: list, hyperlink_buffer: list, scraped_count: int, average_hyperlinks_per_page:float, ratelimits: list[int], database_hits: int, buffer_hits: int):
+def overseer(write_queue: WorkQueue, journal: Journal, hyperlink_buffer: WorkQueue, retry_queue: WorkQueue, frontier_queue: WorkQueue, scraped_count: int, average_hyperlinks_per_page:float, rate_limiter: RateLimiter, database_hits: int, buffer_hits: int, metrics: Metrics):
         """
-        Oversees the scraping process - flushes the buffers, implements wait, disposes of open database connections to return
-        them to SQLAlchemy pool of connections
+        Oversees the scraping process - refills the hyperlink buffer from the frontier as the workers drain it, and the
+        frontier from the database as it runs low, and dumps the excess of both to the database writer. The frontier
+        ranks the hyperlinks the workers find by SCORER, rescoring them as more links to them are seen. Failed
+        hyperlinks are held in a delay queue until their retry is due, then queued behind the work already buffered.
+        Also serves the metrics on METRICS_PORT and writes their snapshot to METRICS_SNAPSHOT.
 
         Args:
-            content_buffer (list): buffer of content scraped
-            hyperlink_buffer (list): buffer of hyperlinks scraped to be scraped
+            write_queue (WorkQueue): queue of rows for the database writer
+            journal (Journal): journal of the rows sent to the database writer
+            hyperlink_buffer (WorkQueue): buffer of hyperlinks scraped to be scraped
+            retry_queue (WorkQueue): queue of (due time, hyperlink) items of failed hyperlinks
+            frontier_queue (WorkQueue): queue of (hyperlinks linked, new hyperlinks) items of scraped pages
             scraped_count (int): number of pages scraped/processed
             average_hyperlinks_per_page (float): metric
-            ratelimits (list[int]): current rate limits
+            rate_limiter (RateLimiter): shared rate limits
             database_hits (int): metric for matches of hyperlink in database
             buffer_hits (int): metric for matches of hyperlink in buffer
+            metrics (Metrics): shared latency histograms and counters
 
         """
-        # content buffer needs to be flushed at max len, hyperlink buffer be dumped if over max len, 
-        # -- check content buffer
-        # -- flush content buffer
-        # same for others
+        def gauges():
+            return {
+                "write_queue_items": len(write_queue),
+                "hyperlink_buffer_items": len(hyperlink_buffer),
+                "delayed_retries": len(delayed),
+                "frontier_items": len(frontier),
+                "scraped_count": scraped_count.value,
+                "average_hyperlinks_per_page": average_hyperlinks_per_page.value,
+                "rate_limit_tokens_per_second": rate_limiter.available()[0],
+                "database_hits": database_hits.value,
+                "buffer_hits": buffer_hits.value,
+            }
+
+        if METRICS_PORT:
+            metrics.serve(METRICS_PORT, gauges)
+
+        last_snapshot = time()
+
+        delayed = DelayQueue()
+
+        frontier = Frontier(SCORER, FRONTIER_HEAP_SIZE, CountMinSketch(FRONTIER_SKETCH_WIDTH, FRONTIER_SKETCH_DEPTH))
+
+        # hyperlink buffer be refilled when drained to half a batch, dumped if over max len
         count = 0
+        tick = 1 / OVERSEER_FREQUENCY
+        last_tick = monotonic()
+        starved = False
 
-        while(utils.wait(OVERSEER_FREQUENCY)):
-            
-            if len(content_buffer) > CONTENT_BUFFER_SIZE: # if content buffer too big
+        while True:
 
-                temp = [] 
-                
-                while len(content_buffer) > 0: #while we haven't emptied it
+            # woken as soon as the workers drain the buffer, otherwise once a tick; the frontier is not claimed from
+            # again until a tick after it came up empty
+            if starved:
+                sleep(tick)
+                low = len(hyperlink_buffer) <= FRONTIER_BATCH_SIZE // 2
+            else:
+                low = hyperlink_buffer.wait_for_length(FRONTIER_BATCH_SIZE // 2, tick)
 
-                    temp.append(content_buffer.pop())
+            if len(frontier_queue):
+                for hyperlinks, new_hyperlinks in frontier_queue.get_many(len(frontier_queue), timeout=0):
+                    frontier.observe(hyperlinks)
+                    frontier.push_many(new_hyperlinks)
 
-                add_page_to_pages(temp) # saves entire content_buffere (in a temp list of Models.Page) to the database
+            if len(retry_queue):
+                for due, hyperlink in retry_queue.get_many(len(retry_queue), timeout=0):
+                    delayed.push(due, hyperlink)
 
-            
-            if len(hyperlink_buffer) == 0:
+            retries = delayed.pop_due(time())
+
+            if retries:
+                hyperlink_buffer.put_many(retries)
+
+            if low:
+
+                if len(frontier) < FRONTIER_BATCH_SIZE:
 
-                temp = load_hyperlink_from_hyperlinks(n=10)
+                    with metrics.timer("refill"):
+                        temp = claim_hyperlinks_from_hyperlinks(n=FRONTIER_BATCH_SIZE, owner="%s:%d" % (gethostname(), getpid()))
 
-                for i in temp:
+                    hyperlink_buffer.put_many([i for i in temp if i.CONTENT_SCRAPED]) # due refreshes go first
 
-                    hyperlink_buffer.append(i)
+                    frontier.push_many([i for i in temp if not i.CONTENT_SCRAPED])
 
+                batch = frontier.pop_many(FRONTIER_BATCH_SIZE)
+
+                hyperlink_buffer.put_many(batch)
+
+                starved = not batch
+
+            spilled = frontier.spill()
+
+            if spilled:
+                journal.put_many(write_queue, [release_row(i) for i in spilled]) # with their score, to be claimed back
+
+            if monotonic() - last_tick < tick:
+                continue
+
+            last_tick = monotonic()
 
             if len(hyperlink_buffer) > HYPERLINK_BUFFER_SIZE:
 
-                temp = [] 
-                
-                while len(hyperlink_buffer) > HYPERLINK_BUFFER_SIZE: #while we haven't reduced it to the size
+                # reduce it to the size, dumping the most recently added hyperlinks
+                temp = hyperlink_buffer.get_many(len(hyperlink_buffer) - HYPERLINK_BUFFER_SIZE, timeout=0, from_tail=True)
+
+                journal.put_many(write_queue, [release_row(i) for i in temp if i != RETIRE])
 
-                    temp.append(hyperlink_buffer.pop())
+                hyperlink_buffer.put_many([i for i in temp if i == RETIRE]) # still owed to the workers
 
-                add_hyperlink_to_hyperlinks(temp)
+            if METRICS_SNAPSHOT and time() - last_snapshot >= METRICS_SNAPSHOT_SECONDS:
+                metrics.write_snapshot(METRICS_SNAPSHOT, gauges())
+                last_snapshot = time()
 
             count += 1
             if count >= 15:
                 print(
-                    f"{len(content_buffer)} -> elements in content buffer.\n",
+                    f"{len(write_queue)} -> rows waiting for the database writer.\n",
                     f"{len(hyperlink_buffer)} -> elements in hyperlink buffer.\n",
                     f"{scraped_count.value} -> total hyperlinks processed so far.\n",
                     f"{average_hyperlinks_per_page.value:.2f} -> average hyperlinks per page.\n",
-                    f"{ratelimits} -> rate limits.\n",
+                    f"{rate_limiter.available()} -> rate limits.\n",
                     f"{database_hits.value} -> total database hits.\n",
                     f"{buffer_hits.value} -> total buffer hits.\n",
                     f"{database_hits.value / (buffer_hits.value + 1):.2f} -> ratio of database to buffer hits."
                 )
                 count = 0
 
-            DATABASE.ENGINE.dispose()
+def create_writer(write_queue: WorkQueue, journal: Journal, metrics: Metrics = None):
+    """
+    Creates the database writer of the crawl, with the hooks and resolvers of the enabled features.
+
+    Args:
+        write_queue (WorkQueue): queue of rows for the database writer
+        journal (Journal): journal of the rows sent to the database writer
+        metrics (Metrics): shared latency histograms and counters
+
+    Returns:
+        DatabaseWriter: The writer.
+    """
+    hooks = {Models.Page.__tablename__: [SEARCH_INDEX.index_rows]} if SEARCH_INDEX_ENABLED else {}
+
+    url_dictionary = UrlDictionary()
+
+    resolvers = {
+        Models.Page.__tablename__: url_dictionary.resolve_pages,
+        Models.Hyperlink.__tablename__: url_dictionary.resolve_hyperlinks,
+        Models.DeadLetter.__tablename__: url_dictionary.resolve_dead_letters,
+    }
+
+    if LINK_GRAPH_ENABLED:
+        resolvers[Models.Edge.__tablename__] = LinkGraph(DATABASE, url_dictionary).resolve_edges
+
+    return DatabaseWriter(DATABASE, write_queue, WRITER_FLUSH_ROWS, WRITER_FLUSH_SECONDS, hooks, resolvers, journal, metrics, WRITER_FLUSH_ATTEMPTS, [url_dictionary])
+
+def writer(write_queue: WorkQueue, journal: Journal, metrics: Metrics):
+    """
+    Runs the single database writer of the crawl.
+
+    Args:
+        write_queue (WorkQueue): queue of rows for the database writer
+        journal (Journal): journal of the rows sent to the database writer
+        metrics (Metrics): shared latency histograms and counters
+    """
+    create_writer(write_queue, journal, metrics).run()
 
 class Manager(SyncManager):
     pass
@@ -296,15 +1075,23 @@ class WikiScraper:
 
         self.manager = self.spawnManager()
 
-        self.hyperlink_buffer = self.manager.list() # hyperlinks to be scraped
+        self.hyperlink_buffer = WorkQueue(WORK_QUEUE_BYTES) # hyperlinks to be scraped
+
+        self.write_queue = WorkQueue(WORK_QUEUE_BYTES) # rows to be written by the database writer
+
+        self.retry_queue = WorkQueue(WORK_QUEUE_BYTES) # failed hyperlinks for the delay queue of the overseer
+
+        self.frontier_queue = WorkQueue(WORK_QUEUE_BYTES) # hyperlinks found by the workers for the frontier of the overseer
+
+        self.journal = Journal(JOURNAL_DIRECTORY, JOURNAL_SEGMENT_BYTES, JOURNAL_FSYNC, JOURNAL_ENABLED)
 
-        self.content_buffer = self.manager.list()
+        recover_crawl(self.journal) # before the seen filter is warmed, from the recovered database
 
-        self.rate_limits = self.manager.list(RATELIMITS)
+        self.rate_limiter = RateLimiter(RATELIMITS)
 
-        self.last_refreshed_rate_limits = self.manager.list([time(), time(), time()])
+        self.metrics = Metrics(METRICS_SLOTS)
 
-        self.process_list = []
+        self.autoscaler = None
 
         self.overseer = None
 
@@ -316,6 +1103,15 @@ class WikiScraper:
 
         self.database_hits = self.manager.Value("d", 0)
 
+        self.seen_filter = SeenFilter(SEEN_FILTER_CAPACITY, SEEN_FILTER_ERROR_RATE)
+
+        warm_seen_filter(self.seen_filter)
+
+        self.duplicate_index = DuplicateIndex(DUPLICATE_INDEX_CAPACITY, DUPLICATE_DISTANCE) if DUPLICATE_DETECTION else None
+
+        if self.duplicate_index is not None:
+            warm_duplicate_index(self.duplicate_index)
+
 # buffer <> -> P1 -> Links -> Content -> status
 #           -> P2 ->        -> Content -> 
 #                       1       1
@@ -330,23 +1126,103 @@ class WikiScraper:
 
     def run(self):
 
-        OVERSEER = Process(target=overseer, args=(self.content_buffer, self.hyperlink_buffer, self.scraped_count, self.average_hyperlinks_per_page, self.rate_limits, self.database_hits, self.buffer_hits))
+        WRITER = Process(target=writer, args=(self.write_queue, self.journal, self.metrics))
+        WRITER.start()
+
+        OVERSEER = Process(target=overseer, args=(self.write_queue, self.journal, self.hyperlink_buffer, self.retry_queue, self.frontier_queue, self.scraped_count, self.average_hyperlinks_per_page, self.rate_limiter, self.database_hits, self.buffer_hits, self.metrics))
         OVERSEER.start()
         
-        for i in range(NUM_SCRAPER_PROCESS):
-            PROCESS = Process(target=process, args=(self.rate_limits, self.last_refreshed_rate_limits, self.content_buffer, self.hyperlink_buffer, self.scraped_count, self.average_hyperlinks_per_page, self.database_hits, self.buffer_hits))
-            PROCESS.start()
-            self.process_list.append(PROCESS)
-        
-        self.manager.join()
+        if FETCH_MODE == "async":
+            target, num_processes, concurrency = async_process, NUM_EVENT_LOOPS, ASYNC_CONCURRENCY
+        else:
+            target, num_processes, concurrency = process, NUM_SCRAPER_PROCESS, 1
+
+        # without autoscaling the pool stays at its initial size, and only replaces workers that exit
+        min_processes, max_processes = (MIN_WORKER_PROCESSES, MAX_WORKER_PROCESSES) if AUTOSCALE else (num_processes, num_processes)
+
+        self.autoscaler = Autoscaler(
+            target, (self.rate_limiter, self.write_queue, self.journal, self.hyperlink_buffer, self.scraped_count, self.average_hyperlinks_per_page, self.database_hits, self.buffer_hits, self.seen_filter, self.duplicate_index, self.retry_queue, self.frontier_queue, self.metrics),
+            self.hyperlink_buffer, self.rate_limiter, self.metrics, min_processes, max_processes, concurrency, AUTOSCALE_SECONDS,
+            partial(self.journal.close, self.write_queue) # the last segment of an exited worker is deleted once committed
+        )
+
+        self.autoscaler.run(num_processes)
 
         
 
+def crawl_stats():
+    """
+    Counts the hyperlinks of the crawl by state, and the pages and dead letters.
+
+    Returns:
+        dict[str, int]: Count by name.
+    """
+    Hyperlink = DATABASE.MODELS.Hyperlink.__table__
+
+    now = time()
+
+    with DATABASE.ENGINE.connect() as connection:
+
+        hyperlinks, scraped, leased, retrying = connection.execute(select(
+            func.count(),
+            func.count().filter(Hyperlink.c.CONTENT_SCRAPED == True),
+            func.count().filter(Hyperlink.c.LEASE_EXPIRES >= now, Hyperlink.c.LEASE_OWNER != RETRY_OWNER),
+            func.count().filter(Hyperlink.c.LEASE_OWNER == RETRY_OWNER)
+        )).one()
+
+        pages = connection.execute(select(func.count()).select_from(DATABASE.MODELS.Page.__table__)).scalar()
+
+        dead_letters = connection.execute(select(func.count()).select_from(DATABASE.MODELS.DeadLetter.__table__)).scalar()
+
+    return {
+        "hyperlinks": hyperlinks,
+        "scraped": scraped,
+        "unscraped": hyperlinks - scraped,
+        "leased": leased,
+        "waiting_retry": retrying,
+        "dead_letters": dead_letters,
+        "pages": pages,
+    }
+
+def crawl():
+    """
+    Runs the crawl until it is stopped. Processes are started with START_METHOD; with forkserver, the fork server
+    imports the crawler once, and every process after it, workers started by the autoscaler included, is forked from
+    it with the modules already imported and nothing else inherited.
+    """
+    set_start_method(START_METHOD)
+
+    if START_METHOD == "forkserver":
+        set_forkserver_preload(["__main__"])
+
+    create_tables()
+
+    WikiScraper().run()
+
+
 if __name__ == "__main__":
-    c = input()
-    if "a" in c:
+
+    parser = ArgumentParser(description="Crawl the wiki of WIKI_SEED_URL. Settings are read from config.env, or the file named by CRAWLER_CONFIG, and the environment.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("seed", help="insert the seed URL, to start a crawl")
+    subparsers.add_parser("crawl", help="crawl, continuing where the last crawl stopped")
+    subparsers.add_parser("stats", help="print the number of hyperlinks by state, and of pages and dead letters")
+
+    args = parser.parse_args()
+
+    if args.command == "seed":
+
+        create_tables()
         insert_seed_url()
+
+    elif args.command == "crawl":
+
+        crawl()
+
     else:
-        test = WikiScraper()
-        test.run()
 
+        create_tables()
+
+        for name, number in crawl_stats().items():
+            print("%-14s %d" % (name, number))
@@ -0,0 +1,297 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from multiprocessing import Lock, RawArray
+from os import getpid, kill, replace
+from threading import Lock as ThreadLock, Thread
+from time import perf_counter, time
+
+STAGES = (
+    "rate_limit", # waiting for a rate limit token
+    "fetch", # the request, until the whole body is read
+    "parse", # the single pass extracting hyperlinks and content
+    "hyperlinks", # screening and canonicalizing the hyperlinks of a page
+    "content", # building, compressing and queueing the rows of a page
+    "seen_check", # seen filter and database confirmation of hyperlinks
+    "dedup", # SimHash fingerprint and near-duplicate lookup of a page
+    "flush", # a database writer transaction
+    "refill", # claiming a batch from the frontier
+)
+
+COUNTERS = (
+    "pages_fetched",
+    "pages_not_modified",
+    "pages_unchanged",
+    "pages_scraped",
+    "pages_aliased",
+    "pages_duplicate",
+    "fetch_errors",
+    "scrape_errors",
+    "retries_scheduled",
+    "dead_letters",
+    "hyperlinks_found",
+    "hyperlinks_new",
+    "rows_written",
+    "flush_errors",
+    "rows_rejected",
+    "workers_started",
+    "workers_stopped",
+)
+
+# upper bounds of the latency buckets in seconds, the last bucket is +Inf
+BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HISTOGRAM = len(BOUNDS) + 2 # bucket counts, then the sum of the observations
+SLOT = len(STAGES) * HISTOGRAM + len(COUNTERS)
+
+
+class Metrics:
+
+    """
+    Latency histograms of the stages of the crawl and throughput counters, in shared memory. Every process records
+    into a slot of its own, without IPC, its threads taking turns under a lock of the process; readers sum the slots.
+    The slot of a process that exited is taken over by the next process that needs one, which adds on to its counts,
+    so the totals keep what exited processes recorded however many come and go.
+
+    Args:
+        num_slots (int): Number of slots, one per live recording process; processes beyond it share the last slot,
+        where concurrent updates may be lost.
+    """
+
+    def __init__(self, num_slots: int = 256) -> None:
+
+        self.num_slots = num_slots
+        self.values = RawArray("d", num_slots * SLOT)
+        self.owners = RawArray("i", num_slots) # pid of the process of every slot, 0 if it has none
+        self.lock = Lock() # serialises the assignment of slots
+
+        self.pid = None # per process slot, assigned lazily after the fork
+        self.offset = None
+        self.thread_lock = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pid"] = None
+        state["offset"] = None
+        state["thread_lock"] = None
+        return state
+
+    def slot(self):
+        """
+        Gets the offset of the slot of the calling process, taking a free one, or one of an exited process, on first
+        use.
+        """
+        if self.pid != getpid():
+
+            self.pid = getpid()
+            self.thread_lock = ThreadLock()
+
+            with self.lock:
+                index = next((i for i, owner in enumerate(self.owners) if owner == 0 or not is_alive(owner)), self.num_slots - 1)
+                self.owners[index] = self.pid
+
+            self.offset = index * SLOT
+
+        return self.offset
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Records the latency of one run of a stage.
+        """
+        offset = self.slot() + STAGES.index(stage) * HISTOGRAM
+        with self.thread_lock:
+            self.values[offset + bisect_left(BOUNDS, seconds)] += 1
+            self.values[offset + HISTOGRAM - 1] += seconds
+
+    @contextmanager
+    def timer(self, stage: str):
+        """
+        Records the latency of the enclosed block as a run of stage, whether it raises or not.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def increment(self, counter: str, n: int = 1):
+        offset = self.slot() + len(STAGES) * HISTOGRAM + COUNTERS.index(counter)
+        with self.thread_lock:
+            self.values[offset] += n
+
+    def totals(self):
+        """
+        Sums the slots.
+
+        Returns:
+            list[float]: The totals, laid out as a slot.
+        """
+        values = self.values[:] # one copy, then pure python
+        return [sum(values[i::SLOT]) for i in range(SLOT)]
+
+    def snapshot(self, gauges: dict = None):
+        """
+        Gets the totals, with estimated quantiles of every stage.
+
+        Args:
+            gauges (dict[str, float]): Current values to include, e.g. queue lengths.
+
+        Returns:
+            dict: Stages, counters and gauges.
+        """
+        totals = self.totals()
+
+        stages = {}
+
+        for i, stage in enumerate(STAGES):
+
+            buckets = totals[i * HISTOGRAM:(i + 1) * HISTOGRAM - 1]
+            count = sum(buckets)
+            total = totals[(i + 1) * HISTOGRAM - 1]
+
+            stages[stage] = {
+                "count": int(count),
+                "seconds": total,
+                "mean": total / count if count else None,
+                "p50": quantile(buckets, 0.5),
+                "p90": quantile(buckets, 0.9),
+                "p99": quantile(buckets, 0.99),
+            }
+
+        counters = {counter: int(totals[len(STAGES) * HISTOGRAM + i]) for i, counter in enumerate(COUNTERS)}
+
+        return {"timestamp": time(), "stages": stages, "counters": counters, "gauges": gauges or {}}
+
+    def prometheus(self, gauges: dict = None):
+        """
+        Renders the totals in the Prometheus text exposition format.
+
+        Args:
+            gauges (dict[str, float]): Current values to include, e.g. queue lengths.
+
+        Returns:
+            str: The exposition.
+        """
+        totals = self.totals()
+
+        lines = [
+            "# HELP crawler_stage_seconds Latency of the stages of the crawl.",
+            "# TYPE crawler_stage_seconds histogram",
+        ]
+
+        for i, stage in enumerate(STAGES):
+
+            cumulative = 0
+
+            for j, bound in enumerate(BOUNDS + (float("inf"),)):
+                cumulative += totals[i * HISTOGRAM + j]
+                lines.append('crawler_stage_seconds_bucket{stage="%s",le="%s"} %d' % (stage, "+Inf" if j == len(BOUNDS) else repr(bound), cumulative))
+
+            lines.append('crawler_stage_seconds_sum{stage="%s"} %r' % (stage, totals[(i + 1) * HISTOGRAM - 1]))
+            lines.append('crawler_stage_seconds_count{stage="%s"} %d' % (stage, cumulative))
+
+        for i, counter in enumerate(COUNTERS):
+            lines.append("# TYPE crawler_%s_total counter" % counter)
+            lines.append("crawler_%s_total %d" % (counter, totals[len(STAGES) * HISTOGRAM + i]))
+
+        for name, value in (gauges or {}).items():
+            lines.append("# TYPE crawler_%s gauge" % name)
+            lines.append("crawler_%s %r" % (name, float(value)))
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, gauges = None):
+        """
+        Serves /metrics in the Prometheus format, and the JSON snapshot at /metrics.json, on a daemon thread.
+
+        Args:
+            port (int): Local port to listen on.
+            gauges (Callable[[], dict]): Called on every request for the current gauges.
+
+        Returns:
+            ThreadingHTTPServer: The server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+
+                current = gauges() if gauges else {}
+
+                if self.path == "/metrics":
+                    body, content_type = metrics.prometheus(current).encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.snapshot(current)).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+    def write_snapshot(self, path: str, gauges: dict = None):
+        """
+        Writes the JSON snapshot to path, replacing the previous one atomically.
+        """
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.snapshot(gauges), file, indent=2)
+        replace(path + ".tmp", path)
+
+
+def is_alive(pid: int):
+    """
+    Checks whether a process of this machine is running, or exited without being joined yet.
+    """
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def quantile(buckets: list[float], q: float):
+    """
+    Estimates a quantile from bucket counts, interpolating linearly within the bucket it falls in.
+
+    Returns:
+        float: The estimate in seconds, None without observations; the bound of the last finite bucket if it falls in
+        the +Inf one.
+    """
+    count = sum(buckets)
+
+    if not count:
+        return None
+
+    rank = q * count
+    cumulative = 0
+
+    for i, n in enumerate(buckets):
+
+        if n and cumulative + n >= rank:
+
+            if i == len(BOUNDS):
+                return BOUNDS[-1]
+
+            lower = BOUNDS[i - 1] if i else 0
+            return lower + (BOUNDS[i] - lower) * (rank - cumulative) / n
+
+        cumulative += n
+
+    return BOUNDS[-1]
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, Float, Boolean, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, Text, Index, LargeBinary
 
 class Models:
       BASE = declarative_base()   
@@ -10,15 +10,34 @@ class Models:
       class Hyperlink(BASE):
 
             __tablename__ = "Hyperlinks"
+            __table_args__ = (
+                  Index("ix_Hyperlinks_frontier", "CONTENT_SCRAPED", "HYPERLINKS_SCRAPED", "SCORE"),
+                  Index("ix_Hyperlinks_refresh", "CONTENT_SCRAPED", "NEXT_REFRESH"),
+            )
 
             ID = Column(Integer, primary_key = True)
-            PARENT_HYPERLINK = Column(String, index = True)
+            PARENT_HYPERLINK = Column(String) # superseded by PARENT_URL_ID
+            PARENT_URL_ID = Column(Integer)
             ATTEMPTS = Column(Integer)
             HYPERLINKS_SCRAPED = Column(Boolean)
             CONTENT_SCRAPED = Column(Boolean)
-            HYPERLINK = Column(String, index = True)
+            HYPERLINK = Column(String)
+            URL_ID = Column(Integer, index = True, unique = True)
+            CANONICAL_URL_ID = Column(Integer) # of the page a redirect, canonical link or near-duplicate resolves to
             PARENT_PRIORITY = Column(Integer)
             TIMESTAMP = Column(Float)
+            LEASE_OWNER = Column(String, index = True)
+            LEASE_EXPIRES = Column(Float)
+            ETAG = Column(String)
+            LAST_MODIFIED = Column(String)
+            BODY_HASH = Column(String)
+            FETCHED = Column(Float)
+            CHECKS = Column(Integer)
+            CHANGES = Column(Integer)
+            NEXT_REFRESH = Column(Float)
+            HTML_HASH = Column(String) # of the raw HTML of its latest fetch, in the HTML cache
+            DEPTH = Column(Integer) # links from the seed
+            SCORE = Column(Float) # rank in the frontier, higher first
 
       class Page(BASE):
            
@@ -26,7 +45,77 @@ class Models:
 
             ID = Column(Integer, primary_key = True)
             HYPERLINK = Column(String)
+            URL_ID = Column(Integer, index = True, unique = True)
             TITLE = Column(String)
             HEADING = Column(String)
             CONTENT = Column(Text)
+            TIMESTAMP = Column(Float, index = True) # when the page was scraped
+            WRITTEN = Column(Float, index = True) # when the database writer stored the row, the window of exports
+            CONTENT_HASH = Column(String, index = True)
+            SIMHASH = Column(BigInteger, index = True) # signed 64 bit SimHash of CONTENT
+
+      class DeadLetter(BASE):
+
+            __tablename__ = "DeadLetters"
+
+            ID = Column(Integer, primary_key = True)
+            HYPERLINK = Column(String)
+            URL_ID = Column(Integer, index = True, unique = True)
+            FAILURE = Column(String) # permanent, throttled, transient or parse
+            ERROR_CODE = Column(Integer) # HTTP status of the last failure, if it was one
+            ERROR = Column(String)
+            ATTEMPTS = Column(Integer)
+            TIMESTAMP = Column(Float)
+
+      class HtmlPage(BASE):
+
+            __tablename__ = "HtmlPages"
+
+            HASH = Column(String, primary_key = True) # sha256 of the raw HTML
+            PACK = Column(String)
+            OFFSET = Column(BigInteger)
+            SIZE = Column(Integer)
+            LENGTH = Column(Integer)
+            CODEC = Column(String)
+            TIMESTAMP = Column(Float)
+
+      class Url(BASE):
+
+            __tablename__ = "Urls"
+
+            ID = Column(Integer, primary_key = True)
+            URL = Column(String, unique = True)
+
+      class Checkpoint(BASE):
+
+            __tablename__ = "Checkpoints"
+
+            STREAM = Column(String, primary_key = True)
+            SEQUENCE = Column(BigInteger) # also the byte offset of an ingested dump
+            TIMESTAMP = Column(Float)
+
+      class Edge(BASE):
+
+            __tablename__ = "Edges"
+
+            SOURCE_ID = Column(Integer, primary_key = True)
+            TARGET_ID = Column(Integer, primary_key = True)
+
+      class Content(BASE):
+
+            __tablename__ = "Contents"
+
+            HASH = Column(String, primary_key = True)
+            CODEC = Column(String)
+            DICTIONARY_ID = Column(Integer)
+            SIZE = Column(Integer)
+            DATA = Column(LargeBinary)
+
+      class Dictionary(BASE):
+
+            __tablename__ = "Dictionaries"
+
+            ID = Column(Integer, primary_key = True)
+            CODEC = Column(String)
+            DATA = Column(LargeBinary)
             TIMESTAMP = Column(Float)
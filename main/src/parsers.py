@@ -0,0 +1,242 @@
+from html.parser import HTMLParser
+
+
+# elements that never have content or an end tag
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "meta", "param", "source", "track", "wbr"
+}
+
+# start tags that implicitly close an open <p> (HTML5 tree construction, "in body" insertion mode)
+CLOSES_P = {
+    "address", "article", "aside", "blockquote", "center", "details", "dialog", "dir", "div", "dl", "dd", "dt", "fieldset",
+    "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hgroup", "hr", "li", "listing",
+    "main", "menu", "nav", "ol", "p", "plaintext", "pre", "search", "section", "summary", "table", "ul", "xmp"
+}
+
+# elements that bound the "button scope" an open <p> is searched for in
+BUTTON_SCOPE = {"applet", "caption", "html", "table", "td", "th", "marquee", "object", "template", "button", "svg", "math"}
+
+FOREIGN_ROOTS = {"svg", "math"}
+
+CONTENT_DIV_CLASS = "mw-content-ltr mw-parser-output"
+HEADING_CLASSES = ("mw-heading2", "mw-heading3")
+
+
+class PageParser(HTMLParser):
+
+    """
+    Streaming, single-pass parser that collects every hyperlink of a Wikipedia page along with its title and its
+    h2, h3 and text content. Mirrors the html5lib tree that get_hyperlinks_from_page and get_content_from_page walk,
+    without building it.
+
+    Only the tree construction rules that Wikipedia pages exercise are mirrored: implied end tags, closing <p> in
+    button scope and foreign (svg, math) content. On malformed markup that needs the rest of the HTML5 algorithm the
+    output can differ from bs4 with html5lib, namely on content foster-parented out of a <table>, on a <p> inside
+    svg or math that breaks out of foreign content, on nested <a> elements that the adoption agency algorithm
+    reorders, and on a <table> inside a <p> in quirks mode. Set PARSER_BACKEND to bs4 for the exact html5lib output.
+
+    Can be fed incrementally with feed(), results are read through result() once close() has been called.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+
+        self.hyperlinks: list[str] = []
+
+        self.stack: list[str] = [] # names of open elements
+        self.foreign_depth = 0
+
+        self.title_main: list[str] = None # text of span.mw-page-title-main
+        self.title_main_depth = -1
+        self.title_heading: list[str] = None # text of h1.firstHeading.mw-first-heading
+        self.title_heading_depth = -1
+
+        self.content_depth = -1 # stack length inside the content div, -1 until it is found
+        self.content_done = False
+
+        self.children: list[tuple[str, str, list[str]]] = [] # (name, heading class, text parts)
+        self.child = None
+
+    @staticmethod
+    def get_classes(attrs: list[tuple[str, str]]):
+        for name, value in attrs:
+            if name == "class":
+                return (value or "").split()
+        return []
+
+    def close_p(self):
+        """
+        Closes an open <p> in button scope, as the HTML5 tree builder would before certain start tags.
+        """
+        for i in range(len(self.stack) - 1, -1, -1):
+            name = self.stack[i]
+            if name == "p":
+                self.pop_to(i)
+                return
+            if name in BUTTON_SCOPE:
+                return
+
+    def pop_to(self, index: int):
+        """
+        Pops the element at index and every element opened after it.
+        """
+        while len(self.stack) > index:
+            self.pop()
+
+    def pop(self):
+        name = self.stack.pop()
+        depth = len(self.stack)
+
+        if name in FOREIGN_ROOTS and self.foreign_depth:
+            self.foreign_depth -= 1
+
+        if depth == self.title_main_depth:
+            self.title_main_depth = -1
+        if depth == self.title_heading_depth:
+            self.title_heading_depth = -1
+
+        if self.content_depth != -1:
+            if depth == self.content_depth:
+                self.child = None
+            elif depth == self.content_depth - 1:
+                self.content_depth = -1
+                self.content_done = True
+
+    def push(self, name: str, attrs: list[tuple[str, str]]):
+        depth = len(self.stack)
+        self.stack.append(name)
+
+        if name in FOREIGN_ROOTS:
+            self.foreign_depth += 1
+
+        if name == "span" and self.title_main is None and "mw-page-title-main" in self.get_classes(attrs):
+            self.title_main = []
+            self.title_main_depth = depth
+
+        if name == "h1" and self.title_heading is None and " ".join(self.get_classes(attrs)) == "firstHeading mw-first-heading":
+            self.title_heading = []
+            self.title_heading_depth = depth
+
+        if self.content_depth == -1:
+            if not self.content_done and name == "div" and " ".join(self.get_classes(attrs)) == CONTENT_DIV_CLASS:
+                self.content_depth = depth + 1
+
+        elif depth == self.content_depth:
+            self.child = None
+            if name == "p":
+                self.child = ("p", None, [])
+            elif name == "div":
+                classes = self.get_classes(attrs)
+                if len(classes) == 2 and classes[1] in HEADING_CLASSES:
+                    self.child = ("div", classes[1], [])
+            if self.child is not None:
+                self.children.append(self.child)
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str]]):
+
+        if tag == "a":
+            for name, value in attrs:
+                if name == "href":
+                    self.hyperlinks.append(value or "")
+                    break
+
+        if not self.foreign_depth and tag in CLOSES_P:
+            self.close_p()
+
+        if tag in VOID_ELEMENTS and not self.foreign_depth:
+            return
+
+        self.push(tag, attrs)
+
+    def handle_startendtag(self, tag: str, attrs: list[tuple[str, str]]):
+        # the self-closing flag is only honoured on foreign (svg/math) elements
+        self.handle_starttag(tag, attrs)
+        if self.foreign_depth and tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str):
+
+        if tag in ("html", "body"):
+            # content after </body> still belongs to the body
+            return
+
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i] == tag:
+                self.pop_to(i)
+                return
+
+        if tag == "p":
+            # a stray </p> produces an empty <p> element
+            self.handle_starttag("p", [])
+            self.handle_endtag("p")
+
+    def handle_data(self, data: str):
+
+        if self.title_main_depth != -1:
+            self.title_main.append(data)
+        if self.title_heading_depth != -1:
+            self.title_heading.append(data)
+        if self.child is not None:
+            self.child[2].append(data)
+
+    def result(self):
+        """
+        Gets the extracted page.
+
+        Returns:
+            hyperlinks (list[str]): All the hyperlinks present in the page.
+            heading (str): The title of the page, None if not found.
+            content (str): The string of the content of the page divided into h2, h3 and text tags, None if not found.
+        """
+
+        if self.title_main is not None:
+            heading = "".join(self.title_main)
+        elif self.title_heading is not None:
+            heading = "".join(self.title_heading).lstrip("<i>").rstrip("</i>")
+        else:
+            heading = None
+
+        if self.content_depth == -1 and not self.content_done:
+            return self.hyperlinks, heading, None
+
+        children = self.children
+
+        # drop trailing headings that are not followed by a paragraph
+        end = len(children)
+        while end > 0 and children[end - 1][0] != "p":
+            end -= 1
+
+        combined_content_string = ""
+
+        for name, heading_class, parts in children[:end]:
+
+            text_from_element = "".join(parts).strip()
+
+            if text_from_element:
+
+                if name == "p":
+                    combined_content_string += "<text>%s</text>" % text_from_element
+
+                elif heading_class == "mw-heading2":
+                    combined_content_string += "<h2>%s</h2>" % text_from_element
+
+                else:
+                    combined_content_string += "<h3>%s</h3>" % text_from_element
+
+        return self.hyperlinks, heading, combined_content_string
+
+
+def parse_page(content: bytes):
+    """
+    Parses the page once with PageParser.
+
+    Args:
+        content (bytes): The HTML content of the page in bytes.
+
+    Returns:
+        (tuple): hyperlinks, heading and content, as returned by PageParser.result.
+    """
+    parser = PageParser()
+    parser.feed(content.decode("utf-8", errors="replace"))
+    parser.close()
+    return parser.result()
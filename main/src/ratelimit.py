@@ -0,0 +1,95 @@
+import asyncio
+from multiprocessing import Lock, RawArray
+from time import monotonic, sleep
+
+PERIODS = (1, 60, 3600) # seconds per tier of RATELIMITS: per second, per minute and per hour
+
+
+class RateLimiter:
+
+    """
+    Token buckets for the per second, minute and hour rate limits, shared by all processes. The bucket state lives in
+    shared memory and is updated in a short critical section, so checking and taking tokens is one atomic step with no
+    IPC, and callers that have to wait sleep until the next token is due instead of spinning.
+
+    Args:
+        limits (list[int]): Base rate limits, per second, minute and hour.
+    """
+
+    def __init__(self, limits: list[int]) -> None:
+
+        self.limits = list(limits)
+        self.rates = [limit / period for limit, period in zip(self.limits, PERIODS)]
+
+        now = monotonic()
+        self.state = RawArray("d", [float(i) for i in self.limits] + [now] * len(self.limits)) # tokens, then last refill
+        self.lock = Lock()
+
+    def refill(self, now: float):
+        """
+        Adds the tokens accrued since the last refill of every bucket. Must be called with the lock held.
+        """
+        tiers = len(self.limits)
+        for i in range(tiers):
+            self.state[i] = min(self.limits[i], self.state[i] + (now - self.state[tiers + i]) * self.rates[i])
+            self.state[tiers + i] = now
+
+    def reserve(self, n: int = 1):
+        """
+        Takes n tokens from every bucket if they are all available.
+
+        Args:
+            n (int): Number of calls to make.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        if n > min(self.limits):
+            raise ValueError("Cannot acquire %d tokens at once with rate limits %s." % (n, self.limits))
+
+        with self.lock:
+
+            self.refill(monotonic())
+
+            tokens = self.state[:len(self.limits)]
+
+            if all(i >= n for i in tokens):
+                for i in range(len(tokens)):
+                    self.state[i] -= n
+                return 0
+
+            return max((n - tokens[i]) / self.rates[i] for i in range(len(tokens)) if tokens[i] < n)
+
+    def try_acquire(self, n: int = 1):
+        """
+        Takes n tokens without blocking.
+
+        Returns:
+            bool: True if the calls can be made.
+        """
+        return self.reserve(n) == 0
+
+    def acquire(self, n: int = 1):
+        """
+        Blocks until n calls can be made adhering to the rate limits.
+        """
+        while (delay := self.reserve(n)) > 0:
+            sleep(delay)
+
+    async def acquire_async(self, n: int = 1):
+        """
+        Suspends the calling coroutine until n calls can be made adhering to the rate limits.
+        """
+        while (delay := self.reserve(n)) > 0:
+            await asyncio.sleep(delay)
+
+    def available(self):
+        """
+        Gets the tokens currently left in each bucket.
+
+        Returns:
+            list[int]: Calls that can still be made, per second, minute and hour.
+        """
+        with self.lock:
+            self.refill(monotonic())
+            return [int(i) for i in self.state[:len(self.limits)]]
@@ -0,0 +1,170 @@
+from argparse import ArgumentParser
+from multiprocessing import Pool, cpu_count
+from threading import BoundedSemaphore
+from time import monotonic, time
+
+from sqlalchemy import text
+
+import main
+import utils
+from dedup import simhash, to_signed
+from exceptions import ContentScrapeError
+from graph import LinkGraph
+from models import Models
+from search import SearchIndex
+
+# the latest cached page of every hyperlink, under the URL its page is stored at, in the order of the packs
+CACHED = (
+    'SELECT h."HYPERLINK", COALESCE(u."URL", h."HYPERLINK"), h."CONTENT_SCRAPED", c."PACK", c."OFFSET", c."SIZE", c."CODEC" '
+    'FROM "Hyperlinks" h JOIN "HtmlPages" c ON c."HASH" = h."HTML_HASH" LEFT JOIN "Urls" u ON u."ID" = h."CANONICAL_URL_ID" '
+    '%s ORDER BY c."PACK", c."OFFSET"'
+)
+
+
+def page_rows(url: str, page: bytes):
+    """
+    Extracts a cached page with the extraction functions of the crawl and gets the rows to write for it: the page,
+    under the ID it already has, and its out-links if the link graph is enabled.
+
+    Returns:
+        list[tuple[str, dict]]: Table name and row pairs for the database writer.
+    """
+    hyperlinks, heading, content = utils.extract_page(page)
+
+    if heading is None or content is None:
+        raise ContentScrapeError()
+
+    out = Models.Page(HYPERLINK=url, TITLE=heading, HEADING=heading, CONTENT=content, TIMESTAMP=time())
+
+    if main.DUPLICATE_DETECTION:
+        out.SIMHASH = to_signed(simhash(content))
+
+    rows = main.CONTENT_STORE.page_rows(out)
+
+    if main.SEARCH_INDEX_ENABLED:
+        for table, row in rows:
+            if table == out.__tablename__:
+                row["_SEARCH"] = SearchIndex.document(out.HYPERLINK, out.TITLE, out.CONTENT)
+
+    if main.LINK_GRAPH_ENABLED:
+        rows.append(LinkGraph.edges_row(url, utils.screen_hyperlinks(url, hyperlinks)))
+
+    return rows
+
+
+def reextract_chunk(records: list[tuple]):
+    """
+    Process pool task: reads the pages of a chunk of records from the cache and extracts them. Hyperlinks that had
+    failed to be scraped are marked scraped once their page is extracted.
+
+    Returns:
+        tuple[list, int, int]: The rows, the number of pages and of pages that could not be extracted.
+    """
+    rows, pages, errors = [], 0, 0
+
+    for hyperlink, url, content_scraped, pack, offset, size, codec in records:
+        try:
+            rows.extend(page_rows(url, main.HTML_CACHE.get(pack, offset, size, codec)))
+
+            if not content_scraped:
+                rows.append((Models.Hyperlink.__tablename__, {"HYPERLINK": hyperlink, "_PARENT": None, "HYPERLINKS_SCRAPED": True, "CONTENT_SCRAPED": True}))
+
+            pages += 1
+
+        except Exception:
+            errors += 1
+
+    return rows, pages, errors
+
+
+def reextract(processes: int, chunk_records: int = 100, failed_only: bool = False, report_seconds: float = 10):
+    """
+    Extracts every page in the HTML cache again and rewrites its Pages row, e.g. after a fix to the extraction
+    functions. Cached pages are read in pack order and a process pool extracts them, while this process writes their
+    rows in transactions of WRITER_FLUSH_ROWS rows. A page kept for several of its aliases is extracted once.
+
+    Args:
+        processes (int): Number of extracting processes.
+        chunk_records (int): Number of pages per task of the pool.
+        failed_only (bool): Whether to only extract the pages of hyperlinks whose content failed to be scraped.
+        report_seconds (float): Seconds between progress reports.
+
+    Returns:
+        int: Number of pages written.
+    """
+    writer = main.create_writer(None, None)
+
+    pending: dict[str, list[dict]] = {}
+    count = pages = errors = 0
+
+    start = last_report = monotonic()
+
+    window = BoundedSemaphore(processes * 4) # chunks in flight, so the reader stays bounded ahead of the writer
+
+    def chunks():
+
+        urls = set()
+
+        with main.DATABASE.ENGINE.connect() as connection:
+
+            result = connection.execution_options(stream_results=True).execute(text(CACHED % ('WHERE NOT h."CONTENT_SCRAPED"' if failed_only else "")))
+
+            while records := result.fetchmany(chunk_records):
+
+                chunk = []
+
+                for record in records:
+                    if record[1] not in urls:
+                        urls.add(record[1])
+                        chunk.append(tuple(record))
+
+                if chunk:
+                    window.acquire()
+                    yield chunk
+
+    def report():
+        elapsed = monotonic() - start
+        print("%d pages, %d errors, %.1f pages/s." % (pages, errors, pages / elapsed if elapsed else 0))
+
+    with Pool(processes) as pool:
+
+        for rows, chunk_pages, chunk_errors in pool.imap(reextract_chunk, chunks()):
+
+            window.release()
+
+            for name, row in rows:
+                pending.setdefault(name, []).append(row)
+
+            count += len(rows)
+            pages += chunk_pages
+            errors += chunk_errors
+
+            if count >= main.WRITER_FLUSH_ROWS:
+                writer.flush(pending)
+                pending, count = {}, 0
+
+            if monotonic() - last_report >= report_seconds:
+                report()
+                last_report = monotonic()
+
+        writer.flush(pending)
+
+    report()
+
+    return pages
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Extract the pages in the HTML cache again and rewrite them, without fetching them.")
+    parser.add_argument("--processes", type=int, default=cpu_count())
+    parser.add_argument("--chunk-records", type=int, default=100, help="pages per task of the process pool")
+    parser.add_argument("--failed-only", action="store_true", help="only extract the pages whose content failed to be scraped")
+
+    args = parser.parse_args()
+
+    main.create_tables()
+
+    pages = reextract(args.processes, args.chunk_records, args.failed_only)
+
+    print("%d pages extracted again." % pages)
@@ -0,0 +1,193 @@
+from argparse import ArgumentParser
+from heapq import heappush, heappop
+from itertools import count
+from random import uniform
+from time import time
+
+from sqlalchemy import delete, func, select, update
+
+from database import Database
+from exceptions import WebpageError, HyperlinksScrapeError, ContentScrapeError
+from models import Models
+from workitem import HyperlinkItem
+
+PERMANENT = "permanent" # the page is not there, and retrying will not change that
+THROTTLED = "throttled" # the server asked for fewer requests
+TRANSIENT = "transient" # server errors, timeouts and dropped connections
+PARSE = "parse" # the page was fetched but could not be scraped
+
+FAILURES = (PERMANENT, THROTTLED, TRANSIENT, PARSE)
+
+PERMANENT_CODES = {400, 401, 403, 404, 405, 406, 410, 414, 451}
+THROTTLED_CODES = {429, 503}
+
+
+def classify(error: Exception):
+    """
+    Gets the class of failure of an exception raised fetching or scraping a page.
+    """
+    if isinstance(error, WebpageError):
+        if error.error_code in THROTTLED_CODES:
+            return THROTTLED
+        if error.error_code in PERMANENT_CODES:
+            return PERMANENT
+        return TRANSIENT
+
+    if isinstance(error, (HyperlinksScrapeError, ContentScrapeError)):
+        return PARSE
+
+    return TRANSIENT
+
+
+class RetryScheduler:
+
+    """
+    Decides when a failed hyperlink is tried again, or that it is not. Transient failures are retried after an
+    exponential backoff with jitter, throttled ones after at least the Retry-After of the response, parse failures,
+    which are likely to fail the same way again, after fewer attempts, and permanent failures not at all.
+
+    Args:
+        max_attempts (int): Attempts after which a hyperlink is dead-lettered.
+        parse_attempts (int): Attempts after which a hyperlink that failed to parse is dead-lettered.
+        base_seconds (float): Backoff after the first failure, doubled on every further one.
+        max_seconds (float): Longest backoff, and longest Retry-After honoured.
+    """
+
+    def __init__(self, max_attempts: int = 5, parse_attempts: int = 2, base_seconds: float = 10, max_seconds: float = 3600) -> None:
+
+        self.max_attempts = max_attempts
+        self.parse_attempts = parse_attempts
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+
+    def backoff(self, attempts: int):
+        """
+        Gets the backoff after a number of failed attempts, with equal jitter: at least half the exponential backoff,
+        so retries are spread out without coming back right away.
+        """
+        backoff = min(self.max_seconds, self.base_seconds * 2 ** max(0, attempts - 1))
+        return backoff / 2 + uniform(0, backoff / 2)
+
+    def delay(self, failure: str, attempts: int, retry_after: float = None):
+        """
+        Gets the seconds after which to retry a hyperlink that failed attempts times.
+
+        Returns:
+            float: The delay, None if the hyperlink is not to be retried.
+        """
+        if failure == PERMANENT:
+            return None
+
+        if attempts >= (self.parse_attempts if failure == PARSE else self.max_attempts):
+            return None
+
+        delay = self.backoff(attempts)
+
+        if failure == THROTTLED and retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_seconds))
+
+        return delay
+
+
+class DelayQueue:
+
+    """
+    Time-ordered queue of items that become due at a given time, as a heap. Items due at the same time come out in
+    the order they were pushed.
+    """
+
+    def __init__(self) -> None:
+        self.heap = []
+        self.order = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, due: float, item):
+        heappush(self.heap, (due, next(self.order), item))
+
+    def next_due(self):
+        """
+        Gets the time the earliest item is due, None if the queue is empty.
+        """
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: float):
+        """
+        Pops the items due by now, earliest first.
+        """
+        items = []
+
+        while self.heap and self.heap[0][0] <= now:
+            items.append(heappop(self.heap)[2])
+
+        return items
+
+
+def dead_letter_row(hyperlink: HyperlinkItem, failure: str, error: Exception):
+    """
+    Gets an item for the database writer recording a hyperlink that is not retried any more.
+
+    Returns:
+        tuple[str, dict]: Table name and row.
+    """
+    return (Models.DeadLetter.__tablename__, {
+        "HYPERLINK": hyperlink.HYPERLINK,
+        "FAILURE": failure,
+        "ERROR_CODE": error.error_code if isinstance(error, WebpageError) else None,
+        "ERROR": ("%s: %s" % (type(error).__name__, error))[:1000],
+        "ATTEMPTS": hyperlink.ATTEMPTS,
+        "TIMESTAMP": time(),
+    })
+
+
+def summary(database: Database):
+    """
+    Gets the number of dead-lettered hyperlinks by failure and error code.
+    """
+    table = Models.DeadLetter.__table__
+
+    with database.ENGINE.connect() as connection:
+        return connection.execute(
+            select(table.c.FAILURE, table.c.ERROR_CODE, func.count()).group_by(table.c.FAILURE, table.c.ERROR_CODE).order_by(func.count().desc())
+        ).all()
+
+
+def requeue(database: Database, failure: str = None):
+    """
+    Deletes dead letters, of one failure class or all, and resets the attempts of their hyperlinks, so the crawl
+    tries them again, e.g. after an outage was mistaken for permanent failures.
+
+    Returns:
+        int: Number of hyperlinks requeued.
+    """
+    dead_letters = Models.DeadLetter.__table__
+    hyperlinks = Models.Hyperlink.__table__
+
+    url_ids = select(dead_letters.c.URL_ID)
+
+    if failure is not None:
+        url_ids = url_ids.where(dead_letters.c.FAILURE == failure)
+
+    with database.ENGINE.begin() as connection:
+
+        connection.execute(update(hyperlinks).where(hyperlinks.c.URL_ID.in_(url_ids)).values(ATTEMPTS=0, LEASE_OWNER=None, LEASE_EXPIRES=None))
+
+        return connection.execute(delete(dead_letters).where(dead_letters.c.URL_ID.in_(url_ids))).rowcount
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Summarise the dead-lettered hyperlinks, or requeue them to be crawled again.")
+    parser.add_argument("--requeue", action="store_true", help="delete the dead letters and reset the attempts of their hyperlinks")
+    parser.add_argument("--failure", choices=FAILURES, help="only requeue the dead letters of this failure class")
+
+    args = parser.parse_args()
+
+    database = Database()
+
+    if args.requeue:
+        print("%d hyperlinks requeued." % requeue(database, args.failure))
+    else:
+        for failure, error_code, number in summary(database):
+            print("%-10s %-6s %d" % (failure, error_code if error_code is not None else "-", number))
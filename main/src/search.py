@@ -0,0 +1,175 @@
+from argparse import ArgumentParser
+import re
+
+from sqlalchemy import text
+
+from config import get_config
+from database import Database
+from models import Models
+from storage import ContentStore
+
+SECTION = re.compile(r"<(text|h2|h3)>(.*?)</\1>", re.DOTALL)
+
+# bm25 weights of the TITLE, H2, H3 and BODY columns
+WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+
+class SearchIndex:
+
+    """
+    Full-text index over the scraped pages, kept in the SQLite FTS5 table PagesSearch with one row per page (rowid is
+    the ID of the page). Titles and h2/h3 headings are indexed as their own columns and weighted above body text.
+
+    Args:
+        database (Database): The database holding the pages.
+    """
+
+    TABLE = "PagesSearch"
+
+    def __init__(self, database: Database) -> None:
+        self.database = database
+
+    def create(self):
+        """
+        Creates the index table if it does not exist yet.
+
+        Raises:
+            ValueError: If the database is not SQLite, as the index is an FTS5 table.
+        """
+        if self.database.BACKEND.name != "sqlite":
+            raise ValueError("SEARCH_INDEX = true requires a SQLite database.")
+
+        with self.database.ENGINE.begin() as connection:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(TITLE, H2, H3, BODY, HYPERLINK UNINDEXED, tokenize = 'porter unicode61')" % self.TABLE
+            ))
+
+    @staticmethod
+    def document(hyperlink: str, title: str, content: str):
+        """
+        Splits the content of a page into the columns of the index.
+
+        Args:
+            hyperlink (str): The hyperlink of the page.
+            title (str): The title of the page.
+            content (str): The string of the content of the page divided into h2, h3 and text tags.
+
+        Returns:
+            dict: The document to index.
+        """
+        sections = {"text": [], "h2": [], "h3": []}
+
+        for tag, value in SECTION.findall(content or ""):
+            sections[tag].append(value)
+
+        return {
+            "HYPERLINK": hyperlink,
+            "TITLE": title or "",
+            "H2": "\n".join(sections["h2"]),
+            "H3": "\n".join(sections["h3"]),
+            "BODY": "\n".join(sections["text"]),
+        }
+
+    def index_rows(self, connection, rows: list[dict]):
+        """
+        Database writer hook: indexes the documents attached to newly written Pages rows, in the same transaction.
+
+        Args:
+            connection (Connection): The connection of the writer transaction.
+            rows (list[dict]): Page rows with their ID and the document under "_SEARCH".
+        """
+        documents = [dict(row["_SEARCH"], ID=row["ID"]) for row in rows if row.get("_SEARCH")]
+
+        if documents:
+            connection.execute(text(
+                "INSERT OR REPLACE INTO %s (rowid, TITLE, H2, H3, BODY, HYPERLINK) VALUES (:ID, :TITLE, :H2, :H3, :BODY, :HYPERLINK)" % self.TABLE
+            ), documents)
+
+    def rebuild(self, content_store: ContentStore, batch_size: int = 1000):
+        """
+        Indexes every stored page from scratch.
+
+        Args:
+            content_store (ContentStore): Store to read the content of the pages with.
+            batch_size (int): Pages indexed per statement.
+
+        Returns:
+            int: Number of pages indexed.
+        """
+        self.create()
+
+        count = 0
+
+        with self.database.createSession() as session, self.database.ENGINE.begin() as connection:
+
+            connection.execute(text("DELETE FROM %s" % self.TABLE))
+
+            batch = []
+
+            for page in session.query(Models.Page).yield_per(batch_size):
+
+                document = self.document(page.HYPERLINK, page.TITLE, content_store.get_content(page, session))
+
+                batch.append({"ID": page.ID, "_SEARCH": document})
+
+                if len(batch) >= batch_size:
+                    self.index_rows(connection, batch)
+                    count += len(batch)
+                    batch = []
+
+            self.index_rows(connection, batch)
+            count += len(batch)
+
+        return count
+
+    def search(self, query: str, limit: int = 10, offset: int = 0):
+        """
+        Searches the index.
+
+        Args:
+            query (str): FTS5 query, e.g. gandhi AND salt, "civil disobedience" or H2:legacy.
+            limit (int): Maximum number of hits.
+            offset (int): Number of hits to skip.
+
+        Returns:
+            list[dict]: Hits, best first, with the ID, HYPERLINK and TITLE of the page, a SNIPPET of the best matching
+            column and the bm25 SCORE (lower is better).
+        """
+        statement = text(
+            "SELECT rowid AS ID, HYPERLINK, TITLE, snippet(%s, -1, '[', ']', '...', 16) AS SNIPPET, bm25(%s, %s) AS SCORE "
+            "FROM %s WHERE %s MATCH :query ORDER BY SCORE LIMIT :limit OFFSET :offset"
+            % (self.TABLE, self.TABLE, ", ".join(str(i) for i in WEIGHTS), self.TABLE, self.TABLE)
+        )
+
+        with self.database.ENGINE.connect() as connection:
+            return [dict(row._mapping) for row in connection.execute(statement, {"query": query, "limit": limit, "offset": offset})]
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Query or rebuild the full-text index of the scraped pages.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query = subparsers.add_parser("query", help="print ranked hits with snippets")
+    query.add_argument("query")
+    query.add_argument("--limit", type=int, default=10)
+    query.add_argument("--offset", type=int, default=0)
+
+    subparsers.add_parser("rebuild", help="index every stored page from scratch")
+
+    args = parser.parse_args()
+
+    database = Database()
+    database.createTables()
+    index = SearchIndex(database)
+
+    if args.command == "rebuild":
+
+        content_store = ContentStore(database, get_config().choice("CONTENT_STORAGE", "plain"), get_config().choice("CONTENT_CODEC", "zlib"))
+
+        print("%d pages indexed." % index.rebuild(content_store))
+
+    else:
+
+        for hit in index.search(args.query, args.limit, args.offset):
+            print("%8.3f  %s  %s\n          %s" % (hit["SCORE"], hit["TITLE"], hit["HYPERLINK"], hit["SNIPPET"]))
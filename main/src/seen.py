@@ -0,0 +1,75 @@
+from multiprocessing import Lock, RawArray
+from hashlib import blake2b
+from math import ceil, log
+
+
+class SeenFilter:
+
+    """
+    Bloom filter of every hyperlink the crawl has come across, kept in shared memory so that all worker processes
+    consult the same set without any round trips to the manager or the database.
+
+    A negative answer is definite; a positive one may be a false positive at roughly error_rate, and is confirmed
+    against the database by the caller.
+
+    Args:
+        capacity (int): Number of hyperlinks the filter is sized for.
+        error_rate (float): False positive rate at capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+
+        self.num_bits = max(8, ceil(-capacity * log(error_rate) / (log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * log(2)))
+
+        self.bits = RawArray("B", (self.num_bits + 7) // 8)
+        self.lock = Lock() # serialises writers, readers never block
+
+    def positions(self, hyperlink: str):
+        """
+        Gets the bit positions of a hyperlink, using double hashing over a single 128 bit digest.
+        """
+        digest = blake2b(hyperlink.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def contains_many(self, hyperlinks: list[str]):
+        """
+        Checks a batch of hyperlinks against the filter.
+
+        Args:
+            hyperlinks (list[str]): The hyperlinks to check.
+
+        Returns:
+            list[bool]: For each hyperlink, False if it has definitely not been seen.
+        """
+        bits = self.bits
+        return [all(bits[i >> 3] & (1 << (i & 7)) for i in self.positions(hyperlink)) for hyperlink in hyperlinks]
+
+    def add_many(self, hyperlinks: list[str]):
+        """
+        Adds a batch of hyperlinks to the filter.
+
+        Args:
+            hyperlinks (list[str]): The hyperlinks to add.
+
+        Returns:
+            list[bool]: For each hyperlink, whether it may have been present already. The check and the add are atomic
+            across processes, so of two workers adding the same new hyperlink only one sees False.
+        """
+        positions = [self.positions(hyperlink) for hyperlink in hyperlinks]
+        bits = self.bits
+        present = []
+
+        with self.lock:
+            for hyperlink_positions in positions:
+                seen = True
+                for i in hyperlink_positions:
+                    mask = 1 << (i & 7)
+                    if not bits[i >> 3] & mask:
+                        bits[i >> 3] |= mask
+                        seen = False
+                present.append(seen)
+
+        return present
@@ -0,0 +1,231 @@
+from argparse import ArgumentParser
+from hashlib import sha256
+from time import time
+import zlib
+
+from sqlalchemy import func
+
+from config import get_config
+from database import Database
+from models import Models
+from writer import model_to_row
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ZLIB_WINDOW = 32768 # zlib only looks back this far, so a longer preset dictionary is wasted
+
+
+class ContentStore:
+
+    """
+    Stores and reads page content according to CONTENT_STORAGE.
+
+    In plain mode the content is kept in Pages.CONTENT as before. In compressed mode it is compressed with zlib or
+    zstd (optionally with the newest shared dictionary of the codec) and stored once per distinct body in Contents,
+    addressed by the sha256 of the text; Pages only keeps CONTENT_HASH, and HEADING only when it differs from TITLE.
+
+    Args:
+        database (Database): The database holding the dictionaries and contents.
+        mode (str): plain or compressed.
+        codec (str): zlib or zstd.
+        level (int): Compression level.
+    """
+
+    def __init__(self, database: Database, mode: str = "plain", codec: str = "zlib", level: int = 6) -> None:
+
+        if codec == "zstd" and zstandard is None:
+            raise ImportError("CONTENT_CODEC = zstd requires the zstandard package.")
+
+        self.database = database
+        self.mode = mode
+        self.codec = codec
+        self.level = level
+
+        self.dictionary_id = None
+        self.dictionary_loaded = False # loaded lazily, once per process
+        self.dictionaries: dict[int, tuple[str, bytes]] = {}
+
+    def load_dictionary(self):
+        """
+        Loads the newest dictionary of the codec, if any, to compress with.
+        """
+        with self.database.createSession() as session:
+
+            dictionary = session.query(Models.Dictionary).filter(
+                Models.Dictionary.CODEC == self.codec
+            ).order_by(Models.Dictionary.ID.desc()).first()
+
+            if dictionary is not None:
+                self.dictionary_id = dictionary.ID
+                self.dictionaries[dictionary.ID] = (dictionary.CODEC, dictionary.DATA)
+
+        self.dictionary_loaded = True
+
+    def get_dictionary(self, dictionary_id: int):
+        if dictionary_id not in self.dictionaries:
+            with self.database.createSession() as session:
+                dictionary = session.get(Models.Dictionary, dictionary_id)
+                self.dictionaries[dictionary_id] = (dictionary.CODEC, dictionary.DATA)
+        return self.dictionaries[dictionary_id][1]
+
+    def compress(self, data: bytes):
+        """
+        Compresses data with the codec and the current dictionary.
+
+        Returns:
+            bytes: The compressed data.
+        """
+        if not self.dictionary_loaded:
+            self.load_dictionary()
+
+        dictionary = self.dictionaries[self.dictionary_id][1] if self.dictionary_id is not None else None
+
+        if self.codec == "zstd":
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdCompressor(level=self.level, dict_data=dict_data).compress(data)
+
+        compressor = zlib.compressobj(self.level, zdict=dictionary) if dictionary else zlib.compressobj(self.level)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, content: Models.Content):
+        """
+        Decompresses a stored content.
+
+        Returns:
+            bytes: The original data.
+        """
+        dictionary = self.get_dictionary(content.DICTIONARY_ID) if content.DICTIONARY_ID is not None else None
+
+        if content.CODEC == "zstd":
+            if zstandard is None:
+                raise ImportError("Reading zstd compressed content requires the zstandard package.")
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(content.DATA)
+
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        return decompressor.decompress(content.DATA) + decompressor.flush()
+
+    def page_rows(self, page: Models.Page):
+        """
+        Gets the rows to write for a page.
+
+        Args:
+            page (Models.Page): The scraped page.
+
+        Returns:
+            list[tuple[str, dict]]: Table name and row pairs for the database writer.
+        """
+        row = model_to_row(page)
+
+        if self.mode != "compressed" or page.CONTENT is None:
+            return [(page.__tablename__, row)]
+
+        data = page.CONTENT.encode()
+
+        content_hash = sha256(data).hexdigest()
+
+        compressed = self.compress(data)
+
+        content = {
+            "HASH": content_hash,
+            "CODEC": self.codec,
+            "DICTIONARY_ID": self.dictionary_id,
+            "SIZE": len(data),
+            "DATA": compressed,
+        }
+
+        row["CONTENT"] = None
+        row["CONTENT_HASH"] = content_hash
+
+        if row["HEADING"] == row["TITLE"]:
+            row["HEADING"] = None
+
+        return [(Models.Content.__tablename__, content), (page.__tablename__, row)]
+
+    def get_content(self, page: Models.Page, session = None):
+        """
+        Gets the content of a page, however it is stored.
+
+        Args:
+            page (Models.Page): The page.
+            session (Session): Session to read the compressed content with, a new one is used if not given.
+
+        Returns:
+            str: The string of the content of the page divided into h2, h3 and text tags.
+        """
+        if page.CONTENT is not None or page.CONTENT_HASH is None:
+            return page.CONTENT
+
+        if session is None:
+            with self.database.createSession() as session:
+                return self.get_content(page, session)
+
+        content = session.get(Models.Content, page.CONTENT_HASH)
+
+        return self.decompress(content).decode()
+
+    @staticmethod
+    def get_heading(page: Models.Page):
+        """
+        Gets the heading of a page, which compressed mode only stores when it differs from the title.
+        """
+        return page.HEADING if page.HEADING is not None else page.TITLE
+
+    def train_dictionary(self, sample_size: int = 2000, dictionary_size: int = 112640):
+        """
+        Trains a shared dictionary for the codec on a random sample of stored pages and saves it; processes started
+        afterwards compress with it.
+
+        Args:
+            sample_size (int): Number of pages to sample.
+            dictionary_size (int): Size of the dictionary in bytes (zlib uses at most 32 KiB).
+
+        Returns:
+            int: ID of the new dictionary.
+        """
+        with self.database.createSession() as session:
+
+            pages = session.query(Models.Page).order_by(func.random()).limit(sample_size).all()
+
+            samples = [content.encode() for content in (self.get_content(page, session) for page in pages) if content]
+
+            if not samples:
+                raise ValueError("No pages to train a dictionary on.")
+
+            if self.codec == "zstd":
+                data = zstandard.train_dictionary(dictionary_size, samples).as_bytes()
+            else:
+                # zlib has no trainer, the tail of the samples serves as its preset dictionary
+                data = b"".join(samples)[-min(dictionary_size, ZLIB_WINDOW):]
+
+            dictionary = Models.Dictionary(CODEC=self.codec, DATA=data, TIMESTAMP=time())
+
+            session.add(dictionary)
+
+            session.commit()
+
+            self.dictionary_id = dictionary.ID
+            self.dictionaries[dictionary.ID] = (self.codec, data)
+            self.dictionary_loaded = True
+
+            return dictionary.ID
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Maintain the compressed page content store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train = subparsers.add_parser("train", help="train a shared compression dictionary on a sample of stored pages")
+    train.add_argument("--sample-size", type=int, default=2000)
+    train.add_argument("--dictionary-size", type=int, default=112640)
+
+    args = parser.parse_args()
+
+    store = ContentStore(Database(), "compressed", get_config().choice("CONTENT_CODEC", "zlib"), get_config().integer("CONTENT_COMPRESSION_LEVEL", 6))
+
+    print("Dictionary %d saved." % store.train_dictionary(args.sample_size, args.dictionary_size))
@@ -0,0 +1,344 @@
+from argparse import ArgumentParser
+import re
+from time import time
+from urllib.parse import urlsplit, unquote, quote
+
+from sqlalchemy import select, update, bindparam, text
+
+from backends import get_backend
+from config import get_config
+from database import Database
+from models import Models
+
+# namespaces (and their talk pages) whose pages are not articles
+NAMESPACES = {
+    "media", "special", "talk", "user", "user talk", "wikipedia", "wikipedia talk", "project", "project talk", "wp",
+    "file", "file talk", "image", "image talk", "mediawiki", "mediawiki talk", "template", "template talk", "help",
+    "help talk", "category", "category talk", "portal", "portal talk", "draft", "draft talk", "timedtext",
+    "timedtext talk", "module", "module talk", "event", "event talk",
+}
+
+# interwiki prefixes that point outside of the wiki
+INTERWIKI = {
+    "w", "m", "b", "n", "q", "s", "v", "d", "c", "wikt", "wiktionary", "wikibooks", "wikinews", "wikiquote", "wikisource",
+    "wikiversity", "voy", "wikivoyage", "species", "wikispecies", "commons", "meta", "metawiki", "mw", "mediawikiwiki",
+    "wikidata", "wmf", "foundation", "phab", "phabricator", "doi", "arxiv",
+}
+
+LANGUAGE_PREFIX = re.compile(r"^[a-z]{2,3}(-[a-z]+)*$")
+
+# characters MediaWiki does not allow in titles
+INVALID_TITLE = re.compile(r"[#<>\[\]|{}\x00-\x1f\x7f\ufffd]")
+
+# characters MediaWiki leaves unescaped in the path of an article URL
+TITLE_SAFE = ";@$!*(),/~:"
+
+
+def normalize_title(title: str):
+    """
+    Normalizes a decoded title the way MediaWiki does: spaces and underscores are the same, runs of them collapse,
+    leading and trailing ones are dropped and the first letter is upper case.
+
+    Returns:
+        str: The normalized title, None if it is not the title of an article.
+    """
+    title = re.sub(r"[ _]+", "_", title.replace("\u00a0", " ")).strip("_")
+
+    if not title or INVALID_TITLE.search(title):
+        return None
+
+    if ":" in title:
+        prefix = title.split(":", 1)[0]
+        if prefix.replace("_", " ").lower() in NAMESPACES or prefix.lower() in INTERWIKI or LANGUAGE_PREFIX.match(prefix):
+            return None
+
+    first = title[0].upper()
+    if len(first) == 1: # some letters upper case to more than one character, MediaWiki leaves those alone
+        title = first + title[1:]
+
+    return title
+
+
+def canonicalize_url(hyperlink: str, base: str):
+    """
+    Reduces a hyperlink to the canonical URL of the article it points at, on the wiki at base.
+
+    Relative (/wiki/X), protocol relative (//host/wiki/X) and absolute hyperlinks are accepted with any scheme, host
+    case and mobile host; the fragment is dropped, percent-escapes are decoded and the title is normalized.
+
+    Args:
+        hyperlink (str): The hyperlink as found on a page.
+        base (str): Scheme and host of the wiki, e.g. https://en.wikipedia.org.
+
+    Returns:
+        str: The canonical URL, None if the hyperlink does not point at an article of the wiki.
+    """
+    base_parts = urlsplit(base)
+    host = base_parts.hostname
+
+    try:
+        parts = urlsplit(hyperlink.strip())
+    except ValueError:
+        return None
+
+    if parts.scheme and parts.scheme.lower() not in ("http", "https"):
+        return None
+
+    if parts.netloc:
+        hostname = (parts.hostname or "").lower()
+        if hostname != host and hostname != host.replace(".", ".m.", 1):
+            return None
+        if parts.port is not None and parts.port != base_parts.port:
+            return None
+
+    if parts.query or not parts.path.startswith("/wiki/"):
+        return None
+
+    title = normalize_title(unquote(parts.path[len("/wiki/"):], errors="replace"))
+
+    if title is None:
+        return None
+
+    return "%s://%s/wiki/%s" % (base_parts.scheme, base_parts.netloc.lower(), quote(title, safe=TITLE_SAFE))
+
+
+def title_to_url(title: str, base: str):
+    """
+    Gets the canonical URL of the article with a title, e.g. from a dump.
+
+    Returns:
+        str: The canonical URL, None if the title is not the title of an article.
+    """
+    title = normalize_title(title)
+
+    if title is None:
+        return None
+
+    return "%s/wiki/%s" % (base, quote(title, safe=TITLE_SAFE))
+
+
+def get_base(url: str):
+    """
+    Gets the scheme and host of a URL, the base canonical URLs are built on.
+    """
+    parts = urlsplit(url)
+    return "%s://%s" % (parts.scheme, parts.netloc.lower())
+
+
+def require_sqlite(database: Database):
+    """
+    Refuses databases other than SQLite, for the backfills of the rows of older versions, which update with UPDATE OR
+    IGNORE.
+    """
+    if database.BACKEND.name != "sqlite":
+        raise ValueError("Backfilling requires a SQLite database, rows written to %s are interned already." % database.BACKEND.name)
+
+
+class UrlDictionary:
+
+    """
+    Interns canonical URLs to compact integer IDs, kept in the Urls table.
+
+    Args:
+        cache_size (int): Number of IDs kept in memory.
+    """
+
+    def __init__(self, cache_size: int = 1000000) -> None:
+        self.cache_size = cache_size
+        self.cache: dict[str, int] = {}
+
+    def clear(self):
+        """
+        Forgets the cached IDs, e.g. after a transaction that interned URLs was rolled back.
+        """
+        self.cache.clear()
+
+    def intern(self, connection, urls: list[str]):
+        """
+        Gets the IDs of URLs, adding the ones that do not have one yet.
+
+        Args:
+            connection (Connection): The connection of the current transaction.
+            urls (list[str]): The URLs.
+
+        Returns:
+            dict[str, int]: ID of every URL.
+        """
+        ids = {url: self.cache[url] for url in urls if url in self.cache}
+
+        missing = list({url for url in urls if url not in ids})
+
+        if missing:
+
+            table = Models.Url.__table__
+
+            connection.execute(get_backend(connection).insert_ignore(table), [{"URL": url} for url in missing]) # ON CONFLICT DO NOTHING on PostgreSQL
+
+            for i in range(0, len(missing), 500):
+                for url_id, url in connection.execute(select(table.c.ID, table.c.URL).where(table.c.URL.in_(missing[i:i+500]))):
+                    ids[url] = url_id
+
+            if len(self.cache) + len(missing) > self.cache_size:
+                self.cache.clear()
+
+            self.cache.update((url, ids[url]) for url in missing)
+
+        return ids
+
+    def resolve_hyperlinks(self, connection, rows: list[dict]):
+        """
+        Database writer resolver of the Hyperlinks table: sets URL_ID and PARENT_URL_ID of rows that do not have them
+        from their HYPERLINK and their parent hyperlink, queued under "_PARENT". The CANONICAL_URL_ID of aliases is
+        set from the canonical hyperlink of their page, queued under "_CANONICAL", or for near-duplicates from the
+        page with the SimHash queued under "_DUPLICATE_OF", which is written before them.
+        """
+        pending = [row for row in rows if row.get("URL_ID") is None]
+
+        urls = [row["HYPERLINK"] for row in pending] + [row["_PARENT"] for row in pending if row.get("_PARENT")]
+        urls += [row["_CANONICAL"] for row in rows if row.get("_CANONICAL")]
+
+        ids = self.intern(connection, urls)
+
+        for row in pending:
+            row["URL_ID"] = ids[row["HYPERLINK"]]
+            if row.get("_PARENT"):
+                row["PARENT_URL_ID"] = ids[row["_PARENT"]]
+
+        for row in rows:
+            if row.get("_CANONICAL"):
+                row["CANONICAL_URL_ID"] = ids[row["_CANONICAL"]]
+
+        duplicates = [row for row in rows if row.get("_DUPLICATE_OF") is not None]
+
+        if duplicates:
+            table = Models.Page.__table__
+            simhashes = list({row["_DUPLICATE_OF"] for row in duplicates})
+            pages = {}
+            for i in range(0, len(simhashes), 500):
+                pages.update(connection.execute(select(table.c.SIMHASH, table.c.URL_ID).where(table.c.SIMHASH.in_(simhashes[i:i+500]))).all())
+            for row in duplicates:
+                row["CANONICAL_URL_ID"] = pages.get(row["_DUPLICATE_OF"])
+
+        return rows
+
+    def resolve_dead_letters(self, connection, rows: list[dict]):
+        """
+        Database writer resolver of the DeadLetters table: sets the URL_ID of rows from their HYPERLINK.
+        """
+        ids = self.intern(connection, [row["HYPERLINK"] for row in rows])
+
+        for row in rows:
+            row["URL_ID"] = ids[row["HYPERLINK"]]
+
+        return rows
+
+    def resolve_pages(self, connection, rows: list[dict]):
+        """
+        Database writer resolver of the Pages table: sets the URL_ID of rows and gives rows of a page that is already
+        stored its ID, so that a refreshed page updates its row instead of adding another. Of the rows of one page in
+        the same flush, e.g. of an alias and its canonical URL scraped at once, the last one is kept. Rows are stamped
+        with the time they are written, rows replayed from the journal included, for the window of exports.
+        """
+        table = Models.Page.__table__
+
+        ids = self.intern(connection, [row["HYPERLINK"] for row in rows])
+
+        written = time()
+
+        for row in rows:
+            row["URL_ID"] = ids[row["HYPERLINK"]]
+            row["WRITTEN"] = written
+
+        rows = list({row["URL_ID"]: row for row in rows}.values()) # in the order of their last row, URL_ID is unique
+
+        url_ids = list({row["URL_ID"] for row in rows})
+        existing = {}
+
+        for i in range(0, len(url_ids), 500):
+            existing.update((url_id, page_id) for page_id, url_id in connection.execute(select(table.c.ID, table.c.URL_ID).where(table.c.URL_ID.in_(url_ids[i:i+500]))))
+
+        for row in rows:
+            if row["URL_ID"] in existing:
+                row["ID"] = existing[row["URL_ID"]]
+
+        return rows
+
+    def backfill(self, database: Database, base: str, batch_size: int = 10000):
+        """
+        Canonicalizes and interns the Hyperlinks rows written before URLs were interned. Rows that are not articles,
+        or whose canonical URL already has a row, are left without a URL_ID.
+
+        Raises:
+            ValueError: If the database is not SQLite, which every database written before URLs were interned is.
+
+        Returns:
+            tuple[int, int]: Rows interned and rows left.
+        """
+        require_sqlite(database)
+
+        table = Models.Hyperlink.__table__
+        done = skipped = 0
+        last_id = 0
+
+        while True:
+
+            with database.ENGINE.begin() as connection:
+
+                rows = connection.execute(
+                    select(table.c.ID, table.c.HYPERLINK).where(table.c.URL_ID == None, table.c.ID > last_id).order_by(table.c.ID).limit(batch_size)
+                ).all()
+
+                if not rows:
+                    return done, skipped
+
+                last_id = rows[-1][0]
+
+                canonical = {row_id: canonicalize_url(hyperlink or "", base) for row_id, hyperlink in rows}
+                ids = self.intern(connection, [url for url in canonical.values() if url])
+
+                updates = [{"b_ID": row_id, "b_HYPERLINK": url, "b_URL_ID": ids[url]} for row_id, url in canonical.items() if url]
+
+                if updates:
+                    connection.execute(
+                        update(table).prefix_with("OR IGNORE").where(table.c.ID == bindparam("b_ID")).values(HYPERLINK=bindparam("b_HYPERLINK"), URL_ID=bindparam("b_URL_ID")),
+                        updates
+                    )
+
+                interned = connection.execute(select(table.c.ID).where(table.c.ID.in_([i["b_ID"] for i in updates]), table.c.URL_ID != None)).all() if updates else []
+
+                done += len(interned)
+                skipped += len(rows) - len(interned)
+
+    def backfill_pages(self, database: Database):
+        """
+        Sets the URL_ID of the Pages rows written before pages were keyed by it, from their interned hyperlink.
+
+        Raises:
+            ValueError: If the database is not SQLite, which every database written before pages were keyed is.
+
+        Returns:
+            int: Rows updated.
+        """
+        require_sqlite(database)
+
+        with database.ENGINE.begin() as connection:
+            return connection.execute(text(
+                'UPDATE OR IGNORE "Pages" SET URL_ID = (SELECT ID FROM "Urls" WHERE "Urls".URL = "Pages".HYPERLINK) WHERE URL_ID IS NULL'
+            )).rowcount
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Maintain the URL dictionary.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backfill", help="canonicalize and intern Hyperlinks and Pages rows written before URL interning")
+
+    args = parser.parse_args()
+
+    database = Database()
+    database.createTables()
+
+    url_dictionary = UrlDictionary()
+
+    print("%d rows interned, %d rows left." % url_dictionary.backfill(database, get_base(get_config().string("WIKI_SEED_URL"))))
+    print("%d pages keyed by their URL." % url_dictionary.backfill_pages(database))
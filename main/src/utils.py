@@ -1,14 +1,32 @@
-from os import getenv
-from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from requests import get, Response
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from config import get_config
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
 from exceptions import WebpageError, HyperlinksScrapeError, ContentScrapeError
-from time import time, sleep
+from parsers import parse_page
+from urls import canonicalize_url, get_base
+from time import sleep, time
 import traceback
 from functools import wraps
+from hashlib import sha256
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+import re
 
-load_dotenv(dotenv_path="config.env")
-WIKI_SEED_URL = getenv("WIKI_SEED_URL")
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+CONFIG = get_config()
+WIKI_SEED_URL = CONFIG.string("WIKI_SEED_URL")
+WIKI_BASE = get_base(WIKI_SEED_URL)
+CONNECTION_POOL_SIZE = CONFIG.integer("CONNECTION_POOL_SIZE", 10)
+PARSER_BACKEND = CONFIG.choice("PARSER_BACKEND", "stream")
+
+SESSION: Session = None
+
+CANONICAL_LINK = re.compile(rb"<link\b[^>]*\brel=[\"']?canonical\b[^>]*>", re.I)
+HREF = re.compile(rb"\bhref=[\"']([^\"']+)")
 
 def trace_unhandled_exceptions(func):
     @wraps(func)
@@ -21,6 +39,100 @@ def trace_unhandled_exceptions(func):
     return wrapped_func
 
 
+def get_session():
+
+    """
+    Gets the keep-alive HTTP session of the current process, creating it on first use so that every worker
+    process owns its own connection pool.
+
+    Returns:
+        session (Session): The pooled requests session.
+    """
+
+    global SESSION
+
+    if SESSION is None:
+
+        SESSION = Session()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTION_POOL_SIZE)
+
+        SESSION.mount("https://", adapter)
+        SESSION.mount("http://", adapter)
+
+    return SESSION
+
+class Fetched(NamedTuple):
+
+    """
+    Result of a fetch: the status (200, or 304 when the page did not change since the validators were issued), the
+    HTML content in bytes (None for a 304), the validators of the response and the URL it came from after redirects.
+    """
+
+    status: int
+    content: bytes
+    etag: str
+    last_modified: str
+    url: str = None
+
+def conditional_headers(etag: str = None, last_modified: str = None):
+
+    """
+    Gets the headers of a conditional request for a page fetched before with the given validators.
+    """
+
+    headers = {}
+
+    if etag:
+        headers["If-None-Match"] = etag
+
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    return headers
+
+def retry_after(value: str):
+
+    """
+    Gets the seconds to wait from a Retry-After header, which holds either seconds or an HTTP date.
+
+    Returns:
+        float: Seconds, None if the header is missing or not valid.
+    """
+
+    if not value or not value.strip():
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+def fetch_page(page_url: str, etag: str = None, last_modified: str = None):
+
+    """
+    Fetches a page, conditionally if validators of an earlier fetch are given, raises a WebpageError if not possible.
+
+    Raises:
+        WebpageError: Error is raised if the status code of the get request is not 200, or 304 for a conditional one.
+
+    Returns:
+        Fetched: The status, content and validators.
+    """
+
+    response: Response = get_session().get(url=page_url, headers=conditional_headers(etag, last_modified))
+
+    if response.status_code == 304 and (etag or last_modified):
+        return Fetched(304, None, response.headers.get("ETag", etag), response.headers.get("Last-Modified", last_modified), response.url)
+
+    if response.status_code != 200:
+        raise WebpageError(response.status_code, retry_after=retry_after(response.headers.get("Retry-After")))
+
+    return Fetched(200, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"), response.url)
+
 def get_bytes_from_page(page_url: str):
 
     """
@@ -33,14 +145,77 @@ def get_bytes_from_page(page_url: str):
         content (bytes): The HTML content of the page in bytes.
     """
 
-    response: Response = get(url=page_url)
+    return fetch_page(page_url).content
 
-    if response.status_code != 200:
-        raise WebpageError(response.status_code)
-    
-    content: bytes = response.content
+def body_hash(content: bytes):
+
+    """
+    Hashes the body of a page, from its content div on, so that the parts of the head that differ on every request
+    do not count as changes.
+
+    Returns:
+        str: The sha256 hex digest.
+    """
+
+    start = content.find(b'id="mw-content-text"')
+
+    return sha256(content[start:] if start != -1 else content).hexdigest()
+
+def canonical_link(content: bytes):
+
+    """
+    Gets the href of the <link rel="canonical"> of a page from its head, without parsing the page.
+
+    Returns:
+        str: The canonical link, None if the page has none.
+    """
+
+    end = content.find(b"</head>")
+
+    for tag in CANONICAL_LINK.findall(content[:end] if end != -1 else content):
+
+        href = HREF.search(tag)
+
+        if href:
+            return href.group(1).decode(errors="replace")
+
+    return None
+
+def page_url(hyperlink: str, final_url: str = None, canonical: str = None):
+
+    """
+    Gets the canonical URL of the page fetched for a hyperlink: that of its canonical link, else that of the URL the
+    fetch was redirected to, else the hyperlink itself. A hyperlink whose page URL differs is an alias of the page.
+
+    Returns:
+        str: The canonical URL of the page.
+    """
+
+    for url in (canonical, final_url):
+
+        canonical_url = canonicalize_url(url, WIKI_BASE) if url else None
+
+        if canonical_url:
+            return canonical_url
+
+    return hyperlink
+
+def parse_html(content: bytes):
+
+    """
+    Parses a page with BeautifulSoup and html5lib, which are imported on first use, as only the bs4 backend needs
+    them.
+
+    Args:
+        content (bytes): The html content of the page in bytes.
+
+    Returns:
+        parsed (BeautifulSoup): The parsed page.
+    """
+
+    from bs4 import BeautifulSoup
 
-    return content
+    return BeautifulSoup(content, "html5lib")
 
 def get_hyperlinks_from_page(content: bytes):
 
@@ -54,9 +229,21 @@ def get_hyperlinks_from_page(content: bytes):
         hyperlinks (list[str]): All the hyperlinks present in the page.
     """
 
-    hyperlinks: list[str] = []
+    return hyperlinks_from_parsed(parse_html(content))
+
+def hyperlinks_from_parsed(parsed: BeautifulSoup):
 
-    parsed: BeautifulSoup = BeautifulSoup(content, "html5lib")
+    """
+    Gets all the hyperlinks from an already parsed page.
+
+    Args:
+        parsed (BeautifulSoup): The parsed page.
+
+    Returns:
+        hyperlinks (list[str]): All the hyperlinks present in the page.
+    """
+
+    hyperlinks: list[str] = []
 
     i: BeautifulSoup = None
     
@@ -71,57 +258,50 @@ def get_hyperlinks_from_page(content: bytes):
 def screen_hyperlinks(hyperlink: str, hyperlinks: list[str]):
 
     """
-    A simple function to screen the hyperlinks for a certain prefix; in this use case, en.wikipedia.org and format the ones which match accordingly.
+    Screens the hyperlinks for articles of the wiki of the seed URL and reduces them to their canonical URLs, so that
+    every spelling of a link to the same article is one hyperlink.
 
     Args:
         hyperlink (str): The original hyperlink.
         hyperlinks (list[str]): The list of hyperlinks to screen.
 
     Returns:
-        set[str]: The screened list of hyperlinks. 
+        set[str]: The canonical URLs, without the original hyperlink.
     """
-    
-    screened_hyperlinks: list[str] = [] 
-    
-    prefix_restriction = "en.wikipedia.org"
-    
-    for i in hyperlinks:
-
-        if "wikipedia" in i:
 
-            if prefix_restriction in i:
+    screened_hyperlinks = {canonicalize_url(i, WIKI_BASE) for i in hyperlinks}
 
-                screened_hyperlinks.append(i)
+    screened_hyperlinks.discard(None)
+    screened_hyperlinks.discard(canonicalize_url(hyperlink, WIKI_BASE))
 
-        elif i.startswith("/wiki"): # /wiki/Madeleine_Slade
+    return screened_hyperlinks
 
-            screened_hyperlinks.append("https://"+prefix_restriction+i)
+def get_content_from_page(content: bytes):
 
-        elif i.startswith("//"):
-            
-            if prefix_restriction in i:
+    """
+    Gets content from page using bytes, returns single divided into h2, h3, and text tags.
 
-                screened_hyperlinks.append("https:"+i)
-    
-    formatted_hyperlinks = ["https:" + i if "https:" not in i else i for i in screened_hyperlinks]
+    Arguments:
+        content (bytes): The HTML code of the page in bytes.
 
-    formatted_hyperlinks = [i for i in formatted_hyperlinks if i != hyperlink and ":" not in i[6:] and "?" not in i and "%" not in i and "#" not in i]
+    Returns:
+        (str): The string of the content of the page divided into h2, h3 and text tags.
+    """
     
-    return set(formatted_hyperlinks)
+    return content_from_parsed(parse_html(content))
 
-def get_content_from_page(content: bytes):
+def content_from_parsed(parsed: BeautifulSoup):
 
     """
-    Gets content from page using bytes, returns single divided into h2, h3, and text tags.
+    Gets content from an already parsed page, returns single divided into h2, h3, and text tags.
 
     Arguments:
-        content (bytes): The HTML code of the page in bytes.
+        parsed (BeautifulSoup): The parsed page.
 
     Returns:
         (str): The string of the content of the page divided into h2, h3 and text tags.
     """
-    
-    parsed: BeautifulSoup = BeautifulSoup(content, "html5lib")
+
 # <h1 class="firstHeading mw-first-heading" <i>Bristol Post</i>
     try:
         current_heading = parsed.find(name="span", attrs={"class":"mw-page-title-main"}).text #was here before, works for most
@@ -174,93 +354,44 @@ def get_content_from_page(content: bytes):
             combined_content_string += temp
 
     return (current_heading, combined_content_string)
-    
-
 
+def extract_page(content: bytes):
 
-def wait(frequency: float):
     """
-    Helper function to return True after waiting (1/frequency) seconds.
+    Parses the page once and gets its hyperlinks, title and content together. Uses the streaming parser unless
+    PARSER_BACKEND is set to bs4, the exact fallback for malformed pages the streaming parser does not mirror.
 
     Arguments:
-        frequency (float): the frequency of execution of a process.
-
-    """
-    sleep(1/frequency)
-    return True
-
+        content (bytes): The HTML code of the page in bytes.
 
-def refresh(RATELIMITS: list[int], rate_limits: list[int], last_refreshed_rate_limits: list[float]) -> None:
+    Returns:
+        hyperlinks (list[str]): All the hyperlinks present in the page.
+        heading (str): The title of the page, None if it could not be found.
+        content (str): The string of the content of the page divided into h2, h3 and text tags, None if it could not be found.
     """
-    Refresh the rate limits
 
-    Args:
-        RATELIMITS (list[int]): Base rate limits
-        rate_limits (list[int]): current rate limits
-        last_refreshed_rate_limits (list[float]): timestamp when rate limits last refreshed
-    """    
-    current_time = time()
-
-    #refresh per second limit
-    if (current_time-last_refreshed_rate_limits[0]) >= 1:
-        rate_limits[0] = RATELIMITS[0]
-        last_refreshed_rate_limits[0] = current_time
+    if PARSER_BACKEND != "bs4":
+        return parse_page(content)
 
-    #refresh per minute limit
-    if (current_time - last_refreshed_rate_limits[1]) >= 60:
-        rate_limits[1] = RATELIMITS[1]
-        last_refreshed_rate_limits[1] = current_time
+    parsed: BeautifulSoup = parse_html(content)
 
-    #refreh per hour limit 
-    if (current_time - last_refreshed_rate_limits[2]) >= 3600: 
-        rate_limits[2] = RATELIMITS[2]
-        last_refreshed_rate_limits[2] = current_time
+    hyperlinks = hyperlinks_from_parsed(parsed)
 
+    try:
+        heading, combined_content_string = content_from_parsed(parsed)
+    except Exception:
+        heading, combined_content_string = None, None
 
-def makeCall(rate_limits: list[int]) -> None:
+    return hyperlinks, heading, combined_content_string
 
-    #make(emulate) API call without checking or blocking
-    for i in range(len(rate_limits)):
-        rate_limits[i] -= 1
 
-def isValidCall(rate_limits: list[int]) -> bool:
+def wait(frequency: float):
     """
-    Check adherance of a call to the rate limits
-
-    Args:
-        rate_limits (list[int]): current rate limits
-
-    Returns:
-        bool: True if valid call
-    """    
+    Helper function to return True after waiting (1/frequency) seconds.
 
-    #check if the call doesn't exceed the rate limits and is valid.
-    flag = None
-    if (rate_limits[0] > 0 and rate_limits[1] > 0 and rate_limits[2] > 0):
-        flag = True
-    else:
-        flag = False
+    Arguments:
+        frequency (float): the frequency of execution of a process.
 
-    return flag
-    
-def makeBlockingCall(RATELIMITS: list[int], rate_limits: list[int], last_refreshed_rate_limits: list[float]) -> None:
     """
-    Block call if not adhering to rate limits.
-
-    Args:
-        RATELIMITS (list[int]): Base rate limits
-        rate_limits (list[int]): current rate limits
-        last_refreshed_rate_limits (list[float]): timestamp when rate limits last refreshed
-
-    Returns:
-        _type_: _description_
-    """    
-    refresh(RATELIMITS, rate_limits, last_refreshed_rate_limits)
-
-    #classic blocking call, blocks untill the call can be made adhering to the rate limits.
-    proceed = isValidCall(rate_limits)
-    if not proceed:
-        while not isValidCall(rate_limits):
-            refresh(RATELIMITS, rate_limits, last_refreshed_rate_limits)
-    makeCall(rate_limits)
-    return None
+    sleep(1/frequency)
+    return True
@@ -0,0 +1,252 @@
+from argparse import ArgumentParser
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from threading import Thread
+from time import sleep
+from urllib.parse import quote, unquote
+
+WORDS = (
+    "the of and in to was is for on as by with he that at from his it an were are which this also be has or had first "
+    "one their its new after who they two her she been other when there all during into school time may years more "
+    "most only over city some world would where later up such used many can state about national out known university "
+    "united then made movement independence government india british party congress nonviolent salt march civil "
+    "rights campaign leader indian south africa london law village spinning wheel fasting truth resistance"
+).split()
+
+SECTIONS = ("Early life", "Career", "Political views", "Legacy", "Personal life", "Death", "Honours", "Works")
+
+# links every page carries that the crawler has to screen out
+NOISE_LINKS = (
+    "/wiki/Main_Page", "/wiki/Special:Search", "/wiki/Help:Contents", "/wiki/Wikipedia:About", "/wiki/Portal:Current_events",
+    "/wiki/File:Example.jpg", "/wiki/Category:Living_people", "/wiki/Talk:%s", "#cite_note-1", "#History",
+    "/w/index.php?title=%s&action=edit", "https://www.example.org/", "//commons.wikimedia.org/wiki/Main_Page",
+    "https://de.wikipedia.org/wiki/%s", "/wiki/wikt:word",
+)
+
+
+class PageGenerator:
+
+    """
+    Generates a deterministic synthetic wiki of num_pages articles with the markup of Wikipedia pages: the title in
+    span.mw-page-title-main, the body in div.mw-content-ltr.mw-parser-output with mw-heading2/3 heading divs, an
+    infobox, references and navigation chrome, and hundreds of /wiki/ links, to popular articles more often.
+
+    Args:
+        num_pages (int): Number of articles.
+        links_per_page (int): Mean number of article links in a body.
+        paragraphs (int): Mean number of paragraphs in a body.
+        seed (int): Seed of the generator; the same seed gives the same wiki.
+    """
+
+    def __init__(self, num_pages: int = 10000, links_per_page: int = 300, paragraphs: int = 30, seed: int = 0) -> None:
+        self.num_pages = num_pages
+        self.links_per_page = links_per_page
+        self.paragraphs = paragraphs
+        self.seed = seed
+
+    def title(self, index: int):
+        """
+        Gets the title of an article, with spaces, punctuation and non-ASCII letters like real titles.
+        """
+        kinds = ("Article %d", "Battle of Place %d", "Café (%d)", "List of things, %d", "Gandhi–Nehru %d", "Σ-algebra %d")
+        return kinds[index % len(kinds)] % index
+
+    def href(self, index: int, rng: Random):
+        """
+        Gets a link to an article, spelt in one of the ways pages link to articles.
+        """
+        title = self.title(index)
+        spelling = rng.random()
+
+        if spelling < 0.7:
+            return "/wiki/" + quote(title.replace(" ", "_"))
+        if spelling < 0.8:
+            return "/wiki/" + quote(title.replace(" ", "_")) + "#" + quote(rng.choice(SECTIONS).replace(" ", "_"))
+        if spelling < 0.9:
+            return "/wiki/" + quote(title[0].lower() + title[1:].replace(" ", "_"))
+        return "/wiki/" + quote(title, safe="")
+
+    def target(self, rng: Random):
+        """
+        Picks the article a link points at, with a heavy tail of popular articles.
+        """
+        return min(int(rng.paretovariate(1.2)) - 1, self.num_pages - 1) if rng.random() < 0.3 else rng.randrange(self.num_pages)
+
+    def words(self, rng: Random, n: int):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    def paragraph(self, rng: Random, links: int):
+        parts = []
+        for _ in range(links):
+            index = self.target(rng)
+            parts.append('%s <a href="%s" title="%s">%s</a>' % (self.words(rng, rng.randint(3, 12)), self.href(index, rng), self.title(index), self.words(rng, rng.randint(1, 3))))
+        parts.append(self.words(rng, rng.randint(5, 20)) + '.<sup id="cite_ref-%d" class="reference"><a href="#cite_note-%d">[%d]</a></sup>' % ((rng.randint(1, 99),) * 3))
+        return "<p>" + " ".join(parts) + "\n</p>"
+
+    def page(self, index: int):
+        """
+        Generates the HTML of an article.
+
+        Returns:
+            bytes: The page, UTF-8 encoded.
+        """
+        rng = Random(self.seed * 1000003 + index)
+
+        title = self.title(index)
+        num_paragraphs = max(1, int(rng.gauss(self.paragraphs, self.paragraphs / 4)))
+        links = max(0, int(rng.gauss(self.links_per_page, self.links_per_page / 4)))
+
+        body = [
+            '<table class="infobox vcard"><tbody><tr><th colspan="2" class="infobox-above">%s</th></tr>'
+            '<tr><th scope="row" class="infobox-label">Born</th><td class="infobox-data">%s</td></tr></tbody></table>' % (title, self.words(rng, 6)),
+            '<div class="shortdescription nomobile noexcerpt noprint searchaux" style="display:none">%s</div>' % self.words(rng, 5),
+        ]
+
+        for i in range(num_paragraphs):
+
+            if i and i % 6 == 0:
+                section = rng.choice(SECTIONS)
+                level = 2 if i % 12 == 0 else 3
+                body.append(
+                    '<div class="mw-heading mw-heading%d"><h%d id="%s">%s</h%d><span class="mw-editsection"><span class="mw-editsection-bracket">[</span>'
+                    '<a href="/w/index.php?title=%s&amp;action=edit&amp;section=%d" title="Edit section: %s"><span>edit</span></a>'
+                    '<span class="mw-editsection-bracket">]</span></span></div>' % (level, level, section.replace(" ", "_"), section, level, quote(title), i, section)
+                )
+
+            body.append(self.paragraph(rng, links // num_paragraphs))
+
+        body.append(
+            '<div class="mw-heading mw-heading2"><h2 id="References">References</h2></div>'
+            '<div class="reflist"><ol class="references">%s</ol></div>' % "".join(
+                '<li id="cite_note-%d"><span class="reference-text">%s <a rel="nofollow" class="external text" href="https://www.example.org/%d">source</a></span></li>' % (i, self.words(rng, 8), i) for i in range(1, 20)
+            )
+        )
+
+        body.append('<div class="navbox">%s</div>' % " ".join('<a href="%s">%s</a>' % (self.href(self.target(rng), rng), self.words(rng, 2)) for _ in range(40)))
+
+        noise = " ".join('<a href="%s">x</a>' % (link % quote(title.replace(" ", "_")) if "%s" in link else link) for link in NOISE_LINKS)
+
+        html = (
+            '<!DOCTYPE html>\n<html class="client-nojs" lang="en" dir="ltr"><head><meta charset="UTF-8"><title>%s - Wikipedia</title>'
+            '<script>RLCONF={"wgRequestId":"%%s","wgPageName":"%s"};</script></head>'
+            '<body class="skin-vector mediawiki ltr"><div id="mw-navigation">%s</div><main id="content" class="mw-body">'
+            '<header class="mw-body-header"><h1 id="firstHeading" class="firstHeading mw-first-heading"><span class="mw-page-title-main">%s</span></h1></header>'
+            '<div id="bodyContent" class="vector-body"><div id="mw-content-text" class="mw-body-content"><div class="mw-content-ltr mw-parser-output" lang="en" dir="ltr">'
+            '%s</div></div></div></main><footer id="footer">%s</footer></body></html>'
+        ) % (title, quote(title.replace(" ", "_")), noise, title, "\n".join(body), self.words(rng, 20))
+
+        return html.encode()
+
+    def index(self, title: str):
+        """
+        Gets the index of the article with the given title from a request path, None if there is none.
+        """
+        title = unquote(title).replace("_", " ")
+        digits = title.rstrip(")").rsplit(" ", 1)[-1].lstrip("(")
+        if digits.isdigit() and int(digits) < self.num_pages and self.title(int(digits)) == title[:1].upper() + title[1:]:
+            return int(digits)
+        return None
+
+
+class WikiServer:
+
+    """
+    Local stand-in for Wikipedia serving a PageGenerator wiki under /wiki/, with ETag validation, configurable latency
+    and a configurable rate of 503 errors, for offline benchmarks.
+
+    Args:
+        generator (PageGenerator): The wiki to serve.
+        port (int): Local port to listen on, 0 for any free one.
+        latency (float): Mean added latency of a response in seconds, exponentially distributed.
+        error_rate (float): Fraction of requests answered with a 503.
+    """
+
+    def __init__(self, generator: PageGenerator, port: int = 8765, latency: float = 0, error_rate: float = 0) -> None:
+
+        server = self
+        self.generator = generator
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = Random(generator.seed)
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+
+                server.requests += 1
+
+                if server.latency:
+                    sleep(server.rng.expovariate(1 / server.latency))
+
+                if server.rng.random() < server.error_rate:
+                    return self.reply(503, b"")
+
+                index = generator.index(self.path[len("/wiki/"):]) if self.path.startswith("/wiki/") else None
+
+                if index is None:
+                    return self.reply(404, b"")
+
+                page = generator.page(index)
+                etag = '"%s"' % md5(page).hexdigest()
+
+                if self.headers.get("If-None-Match") == etag:
+                    return self.reply(304, b"", etag)
+
+                self.reply(200, page.replace(b"%s", b"%016x" % server.rng.getrandbits(64), 1), etag)
+
+            def reply(self, status: int, body: bytes, etag: str = None):
+                self.send_response(status)
+                if etag:
+                    self.send_header("ETag", etag)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def url(self, index: int = 0):
+        """
+        Gets the URL of an article, e.g. to seed a crawl with.
+        """
+        return "http://127.0.0.1:%d/wiki/%s" % (self.port, quote(self.generator.title(index).replace(" ", "_")))
+
+    def start(self):
+        """
+        Serves on a daemon thread.
+        """
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser(description="Serve a synthetic wiki with the markup of Wikipedia, for offline benchmarks.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--links", type=int, default=300, help="mean article links per page")
+    parser.add_argument("--paragraphs", type=int, default=30, help="mean paragraphs per page")
+    parser.add_argument("--latency", type=float, default=0, help="mean added latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    server = WikiServer(PageGenerator(args.pages, args.links, args.paragraphs, args.seed), args.port, args.latency, args.error_rate)
+
+    print("Serving %d pages, seed URL %s" % (args.pages, server.url()))
+
+    server.server.serve_forever()
@@ -0,0 +1,57 @@
+from models import Models
+
+COLUMNS = tuple(column.name for column in Models.Hyperlink.__table__.columns)
+EXTRAS = ("_CANONICAL", "_DUPLICATE_OF") # passed on to the resolver of the database writer, never written
+
+
+class HyperlinkItem:
+
+    """
+    Hyperlink in flight between the frontier, the workers and the database writer, with the columns of the
+    Hyperlinks table as slots. Unlike an instance of Models.Hyperlink it carries no SQLAlchemy state, and pickles to
+    the tuple of its values, so moving it through a WorkQueue costs little more than its data. Columns that are not
+    given are None.
+    """
+
+    __slots__ = COLUMNS + EXTRAS
+
+    def __init__(self, **columns) -> None:
+
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+        for name, value in columns.items():
+            setattr(self, name, value)
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: tuple):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "HyperlinkItem(%r)" % self.HYPERLINK
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Gets the item of a row of the Hyperlinks table, as selected with Core.
+        """
+        item = cls()
+
+        for name, value in row._mapping.items():
+            setattr(item, name, value)
+
+        return item
+
+    def row(self):
+        """
+        Gets the row of the item for the database writer, without the ID of items not in the database yet.
+        """
+        row = {name: getattr(self, name) for name in COLUMNS}
+
+        if row["ID"] is None:
+            row.pop("ID")
+
+        return row
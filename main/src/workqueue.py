@@ -0,0 +1,152 @@
+from multiprocessing import Condition, Lock, RawArray
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from queue import Full
+from time import monotonic
+
+HEADER = 4 # bytes used to store the length of a record, before and after its payload
+
+
+class WorkQueue:
+
+    """
+    Bounded multi-producer/multi-consumer queue of work items, held in a shared memory ring buffer. Items are
+    pickled by the caller and a whole batch is pushed or popped under a single lock acquisition, so moving many
+    items costs one synchronisation instead of one IPC round trip each.
+
+    Each record is stored as [length][payload][length], which lets the queue be consumed from either end.
+
+    Args:
+        capacity (int): Size of the ring buffer in bytes.
+    """
+
+    def __init__(self, capacity: int) -> None:
+
+        self.capacity = capacity
+
+        self.buffer = RawArray("B", capacity)
+        self.state = RawArray("q", 4) # head offset, tail offset, bytes used, item count
+
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+
+    def __len__(self):
+        return self.state[3]
+
+    def write(self, view: memoryview, offset: int, data: bytes):
+        end = offset + len(data)
+        if end <= self.capacity:
+            view[offset:end] = data
+        else:
+            split = self.capacity - offset
+            view[offset:] = data[:split]
+            view[:end - self.capacity] = data[split:]
+        return end % self.capacity
+
+    def read(self, view: memoryview, offset: int, size: int):
+        end = offset + size
+        if end <= self.capacity:
+            return bytes(view[offset:end])
+        return bytes(view[offset:]) + bytes(view[:end - self.capacity])
+
+    def put_many(self, items: list, timeout: float = None):
+        """
+        Pushes a batch of items to the tail of the queue, blocking while it is full.
+
+        Args:
+            items (list): The items to push.
+            timeout (float): Seconds to wait for space, None to wait indefinitely.
+
+        Raises:
+            queue.Full: There was not enough space before the timeout, items pushed until then stay queued.
+        """
+        records = []
+        for item in items:
+            payload = dumps(item, protocol=HIGHEST_PROTOCOL)
+            size = len(payload).to_bytes(HEADER, "little")
+            if len(payload) + 2*HEADER > self.capacity:
+                raise ValueError("Work item of %d bytes does not fit in the queue." % len(payload))
+            records.append(size + payload + size)
+
+        if not records:
+            return
+
+        deadline = None if timeout is None else monotonic() + timeout
+        view = memoryview(self.buffer).cast("B")
+        state = self.state
+
+        with self.lock:
+
+            for record in records:
+
+                while self.capacity - state[2] < len(record):
+                    self.not_empty.notify_all() # let consumers make room
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if (remaining is not None and remaining <= 0) or not self.not_full.wait(remaining):
+                        raise Full()
+
+                state[1] = self.write(view, state[1], record)
+                state[2] += len(record)
+                state[3] += 1
+
+            self.not_empty.notify_all()
+
+    def get_many(self, n: int, timeout: float = None, from_tail: bool = False):
+        """
+        Pops up to n items, waiting for at least one to be available.
+
+        Args:
+            n (int): Maximum number of items to pop.
+            timeout (float): Seconds to wait for an item, 0 to not wait and None to wait indefinitely.
+            from_tail (bool): Pop the most recently pushed items instead of the oldest ones.
+
+        Returns:
+            list: The popped items, empty if none arrived before the timeout.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        view = memoryview(self.buffer).cast("B")
+        state = self.state
+        payloads = []
+
+        with self.lock:
+
+            while state[3] == 0:
+                remaining = None if deadline is None else deadline - monotonic()
+                if (remaining is not None and remaining <= 0) or not self.not_empty.wait(remaining):
+                    if state[3] == 0:
+                        return []
+
+            for _ in range(min(n, state[3])):
+
+                if from_tail:
+                    end = state[1]
+                    size = int.from_bytes(self.read(view, (end - HEADER) % self.capacity, HEADER), "little")
+                    start = (end - size - 2*HEADER) % self.capacity
+                    payloads.append(self.read(view, (start + HEADER) % self.capacity, size))
+                    state[1] = start
+                else:
+                    start = state[0]
+                    size = int.from_bytes(self.read(view, start, HEADER), "little")
+                    payloads.append(self.read(view, (start + HEADER) % self.capacity, size))
+                    state[0] = (start + size + 2*HEADER) % self.capacity
+
+                state[2] -= size + 2*HEADER
+                state[3] -= 1
+
+            self.not_full.notify_all()
+
+        return [loads(payload) for payload in payloads]
+
+    def wait_for_length(self, n: int, timeout: float = None):
+        """
+        Waits until the queue holds at most n items, e.g. for consumers to drain it to a low watermark.
+
+        Args:
+            n (int): Number of items to wait for the queue to hold at most.
+            timeout (float): Seconds to wait, None to wait indefinitely.
+
+        Returns:
+            bool: Whether the queue holds at most n items.
+        """
+        with self.lock:
+            return self.not_full.wait_for(lambda: self.state[3] <= n, timeout)
@@ -0,0 +1,323 @@
+from time import monotonic, sleep, time
+import traceback
+
+from sqlalchemy import update, bindparam, select, func
+
+from database import Database
+from journal import Journal
+from metrics import Metrics
+from workqueue import WorkQueue
+
+
+def model_to_row(instance):
+    """
+    Converts a model instance to a row for the writer.
+
+    Args:
+        instance (Models.Page | Models.Hyperlink): The instance to convert.
+
+    Returns:
+        dict: Column name to value, without the ID of instances that are not in the database yet.
+    """
+    row = {column.name: getattr(instance, column.name) for column in instance.__table__.columns}
+
+    if row.get("ID") is None:
+        row.pop("ID", None)
+
+    return row
+
+
+class DatabaseWriter:
+
+    """
+    Single writer stage for the crawl. Producers push (table name, row) items to its queue; rows are applied in one
+    transaction per flush with the bulk inserts of the backend of the database and executemany updates, flushing
+    when flush_rows rows are pending or the oldest pending row is flush_seconds old. Rows carrying an ID update the
+    existing row, the others are inserted. Rows marked _DISCOVERED, of hyperlinks just found on a page, are only
+    inserted if their key is free: they are written before the other rows of their table, so a discovery never
+    overwrites the state of a row written earlier, and a later row of the same flush is written over it.
+
+    Keys starting with an underscore are not written; they are passed on, with the row, to the hooks of the table,
+    which run inside the flush transaction. Rows inserted into a table with hooks are given their ID by the writer,
+    which as the only writer knows the next free one. A resolver of a table turns its queued rows into the rows to
+    write, inside the flush transaction, before anything else is done with them.
+
+    Items queued by a Journal carry a batch of rows with its stream and sequence number; the batch is flushed as a
+    whole, and the last sequence number of every stream is written to Checkpoints in the same transaction. A stream
+    closed by the Journal has its segments deleted once the rows queued before the close are committed.
+
+    A flush that fails is tried again up to flush_attempts times, then the failing items are isolated by flushing
+    the halves of the batch apart, down to single items. The rows of an item that fails alone are written one by
+    one, and the rows that fail even then are rejected: logged, and kept by the journal in a file of rejected rows.
+    The checkpoint of the item is committed either way, so one bad row holds up neither the rows behind it nor the
+    truncation of the journal.
+
+    Args:
+        database (Database): The database to write to.
+        write_queue (WorkQueue): The queue of (table name, row) items.
+        flush_rows (int): Number of pending rows that triggers a flush.
+        flush_seconds (float): Maximum age of a pending row before it is flushed.
+        hooks (dict[str, list[Callable]]): Callables taking (connection, rows), by table name.
+        resolvers (dict[str, Callable]): Callables taking (connection, rows) and returning rows, by table name.
+        journal (Journal): Journal whose committed segments are deleted after every flush.
+        metrics (Metrics): Metrics to record the latency of flushes and the rows written in.
+        flush_attempts (int): Number of times a flush is tried before its failing items are isolated.
+        caches (list): Objects caching what they write inside a flush transaction, e.g. a UrlDictionary, whose clear
+            method is called when a flush fails, so that none of them keeps what was rolled back.
+    """
+
+    STOP = ("STOP", None)
+
+    def __init__(self, database: Database, write_queue: WorkQueue, flush_rows: int, flush_seconds: float, hooks: dict = None, resolvers: dict = None, journal: Journal = None, metrics: Metrics = None, flush_attempts: int = 3, caches: list = None) -> None:
+
+        self.database = database
+        self.write_queue = write_queue
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.hooks = hooks or {}
+        self.resolvers = resolvers or {}
+        self.journal = journal
+        self.metrics = metrics
+        self.flush_attempts = max(1, flush_attempts)
+        self.caches = caches or []
+
+        models = database.MODELS
+        self.tables = {model.__tablename__: model.__table__ for model in (models.Content, models.HtmlPage, models.Page, models.Hyperlink, models.Edge, models.DeadLetter)}
+        self.ignore_duplicates = {models.Content.__tablename__, models.HtmlPage.__tablename__, models.Edge.__tablename__} # rows written once
+        self.upsert_keys = {models.Hyperlink.__tablename__: "URL_ID", models.DeadLetter.__tablename__: "URL_ID"} # a later insert of the same key updates the row
+        self.checkpoints_table = models.Checkpoint.__table__
+        self.committed: dict[str, int] = {} # last sequence number committed of every stream
+
+    def run(self):
+        """
+        Consumes the queue until a STOP item is received, flushing what is pending before returning.
+        """
+        items = []
+        closed = []
+        count = 0
+        oldest = None
+
+        while True:
+
+            timeout = None if oldest is None else max(0, oldest + self.flush_seconds - monotonic())
+
+            stop = False
+
+            for item in self.write_queue.get_many(max(1, self.flush_rows - count), timeout=timeout):
+                if item == self.STOP:
+                    stop = True
+                elif item[0] == Journal.CLOSED:
+                    closed.append(item[1])
+                else:
+                    items.append(item)
+                    count += len(item[1][2]) if item[0] == Journal.RECORD else 1
+
+            if count and oldest is None:
+                oldest = monotonic()
+
+            if count and (stop or count >= self.flush_rows or monotonic() - oldest >= self.flush_seconds):
+
+                self.commit(items, count)
+
+                items = []
+                count = 0
+                oldest = None
+
+            if closed and not count: # every row queued before the closes is committed
+                self.close(closed)
+                closed = []
+
+            if stop:
+                return
+
+    def collect(self, items: list):
+        """
+        Gathers queued items into the rows of every table, in the order of tables, and the last sequence number of
+        every journal stream among them.
+
+        Returns:
+            tuple[dict[str, list[dict]], dict[str, int]]: The rows by table name, and the checkpoints.
+        """
+        pending: dict[str, list[dict]] = {name: [] for name in self.tables}
+        checkpoints: dict[str, int] = {}
+
+        for name, row in items:
+            if name == Journal.RECORD:
+                stream, sequence, rows = row
+                for table, journaled in rows:
+                    pending[table].append(journaled)
+                checkpoints[stream] = sequence
+            else:
+                pending[name].append(row)
+
+        return pending, checkpoints
+
+    def commit(self, items: list, count: int):
+        """
+        Flushes a batch of queued items, trying again up to flush_attempts times before isolating the failing ones,
+        then deletes the journal segments committed.
+        """
+        pending, checkpoints = self.collect(items)
+
+        for attempt in range(1, self.flush_attempts + 1):
+
+            start = monotonic()
+
+            if self.try_flush(pending, checkpoints, "flush of %d rows, attempt %d of %d" % (count, attempt, self.flush_attempts)):
+                if self.metrics is not None:
+                    self.metrics.observe("flush", monotonic() - start)
+                    self.metrics.increment("rows_written", count)
+                break
+
+            if attempt < self.flush_attempts:
+                sleep(1)
+
+        else:
+            rejected = self.isolate(items)
+            if self.metrics is not None:
+                self.metrics.increment("rows_written", count - rejected)
+                self.metrics.increment("rows_rejected", rejected)
+
+        self.committed.update(checkpoints)
+
+        if self.journal is not None and checkpoints:
+            self.journal.truncate(checkpoints)
+
+    def close(self, streams: list[str]):
+        """
+        Deletes the segments of closed journal streams whose rows are all committed.
+        """
+        for stream in streams:
+            if self.journal is not None and not self.journal.remove(stream, self.committed.pop(stream, 0)):
+                print("Journal stream %s left for recovery, its last record was not queued." % stream)
+
+    def try_flush(self, pending: dict[str, list[dict]], checkpoints: dict[str, int], description: str):
+        """
+        Flushes rows, reporting a failure instead of raising it.
+
+        Returns:
+            bool: Whether the flush was committed.
+        """
+        try:
+            self.flush(pending, checkpoints)
+        except Exception:
+            print("WRITER ERROR, %s failed" % description)
+            traceback.print_exc()
+            for cache in self.caches:
+                cache.clear()
+            if self.metrics is not None:
+                self.metrics.increment("flush_errors")
+            return False
+
+        return True
+
+    def isolate(self, items: list):
+        """
+        Flushes the items of a batch that failed to flush, in order, splitting it in halves down to single items so
+        that only the rows that fail by themselves are left out. Those are rejected.
+
+        Returns:
+            int: Number of rows rejected.
+        """
+        if len(items) > 1:
+
+            rejected = 0
+            middle = len(items) // 2
+
+            for half in (items[:middle], items[middle:]):
+                if not self.try_flush(*self.collect(half), "flush of %d isolated items" % len(half)):
+                    rejected += self.isolate(half)
+
+            return rejected
+
+        (name, row), = items
+
+        if name == Journal.RECORD:
+            stream, sequence, rows = row
+            checkpoints = {stream: sequence}
+        else:
+            rows, checkpoints = [(name, row)], {}
+
+        rejected = [(table, journaled) for table, journaled in rows if not self.try_flush({table: [journaled]}, None, "flush of a row of %s" % table)]
+
+        if rejected:
+            print("WRITER ERROR, %d rows rejected" % len(rejected))
+            if self.journal is not None:
+                self.journal.reject(rejected)
+
+        if checkpoints:
+            self.try_flush({}, checkpoints, "checkpoint of an isolated item")
+
+        return len(rejected)
+
+    def flush(self, pending: dict[str, list[dict]], checkpoints: dict[str, int] = None):
+        """
+        Applies the pending rows of every table in a single transaction.
+
+        Args:
+            pending (dict[str, list[dict]]): Rows to write, by table name.
+            checkpoints (dict[str, int]): Last sequence number of the journal streams the rows came from.
+        """
+        with self.database.ENGINE.begin() as connection:
+
+            for name, rows in pending.items():
+
+                table = self.tables[name]
+
+                rows = [dict(row) for row in rows] # resolvers set columns in place, and a failed flush is tried again
+
+                if name in self.resolvers and rows:
+                    rows = self.resolvers[name](connection, rows)
+
+                inserts = [row for row in rows if "ID" not in row]
+                updates = [row for row in rows if "ID" in row]
+
+                hooks = self.hooks.get(name, [])
+
+                if hooks and inserts:
+                    next_id = (connection.execute(select(func.max(table.c.ID))).scalar() or 0) + 1
+                    inserts = [dict(row, ID=next_id + i) for i, row in enumerate(inserts)]
+
+                for columns, group in self.group_by_columns([row for row in inserts if row.get("_DISCOVERED")]):
+                    self.database.BACKEND.insert_rows(connection, table, columns, group, "ignore")
+
+                for columns, group in self.group_by_columns([row for row in inserts if not row.get("_DISCOVERED")]):
+                    self.insert_rows(connection, name, columns, group)
+
+                for columns, group in self.group_by_columns(updates):
+                    statement = update(table).where(table.c.ID == bindparam("b_ID")).values(
+                        {column: bindparam("b_" + column) for column in columns if column != "ID"}
+                    )
+                    connection.execute(statement, [{"b_" + key: value for key, value in row.items()} for row in group])
+
+                for hook in hooks:
+                    hook(connection, inserts + updates)
+
+            if checkpoints:
+                self.database.BACKEND.insert_rows(
+                    connection, self.checkpoints_table, ("SEQUENCE", "STREAM", "TIMESTAMP"),
+                    [{"STREAM": stream, "SEQUENCE": sequence, "TIMESTAMP": time()} for stream, sequence in checkpoints.items()],
+                    "update", "STREAM"
+                )
+
+    def insert_rows(self, connection, name: str, columns: tuple, rows: list[dict]):
+        """
+        Inserts rows of the given columns into a table, with the bulk load of the backend of the database.
+        """
+        if name in self.ignore_duplicates:
+            self.database.BACKEND.insert_rows(connection, self.tables[name], columns, rows, "ignore")
+        elif name in self.upsert_keys:
+            self.database.BACKEND.insert_rows(connection, self.tables[name], columns, rows, "update", self.upsert_keys[name])
+        else:
+            self.database.BACKEND.insert_rows(connection, self.tables[name], columns, rows)
+
+    @staticmethod
+    def group_by_columns(rows: list[dict]):
+        """
+        Groups rows by their set of columns, as each executemany needs rows of the same shape.
+        """
+        groups: dict[tuple, list[dict]] = {}
+        for row in rows:
+            row = {key: value for key, value in row.items() if not key.startswith("_")}
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        return groups.items()